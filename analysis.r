@@ -4,10 +4,13 @@ red <- "#E06666"
 yellow <- "#FFD966"
 green <- "#93C47D"
 
-resilver_results_old <- read.csv("firstrun.csv")
-resilver_results_new <- read.csv("output.csv")
-names(resilver_results_old) <- names(resilver_results_new)
-resilver_results <- rbind(resilver_results_old, resilver_results_new)
+resilver_results_old <- read_legacy_results("firstrun.csv")
+if (file.exists("results_store/manifest.jsonl")) {
+   resilver_results_new <- read_results_store("summary")
+} else {
+   resilver_results_new <- read.csv("output.csv")
+}
+resilver_results <- bind_results(resilver_results_old, resilver_results_new)
 
 resilver_results <- resilver_results %>%
    mutate(EffectiveWidth = ifelse((VdevType == "draid1" | VdevType == "draid2" | VdevType == "draid3"), as.integer(dRAIDDataDisks) + ParityLevel, VdevWidth))
@@ -4,6 +4,88 @@ library(ggplot2)
 library(scales)
 library(stringr)
 
+# Read a table ("summary", "fio", "diskstats", "cpustats", "zfsthreads", "kstats") from the partitioned Parquet results store written by resilver.py
+# Partitions and their columns are picked from results_store/manifest.jsonl; filters match partition keys, e.g.
+# read_results_store("fio", columns = c("Phase", "WriteMonitorLatencyMs"), frag = "high")
+# Re-run tests only keep the most recently written partition
+read_results_store <- function(table, columns = NULL, store = "results_store", ...) {
+   filters <- list(...)
+   entries <- list()
+   for (line in readLines(file.path(store, "manifest.jsonl"))) {
+      entry <- jsonlite::fromJSON(line)
+      if (entry$table != table) next
+      if (!all(vapply(names(filters), function(key) !is.null(entry[[key]]) && as.character(entry[[key]]) == as.character(filters[[key]]), logical(1)))) next
+      entries[[entry$path]] <- entry
+   }
+
+   partitions <- lapply(entries, function(entry) {
+      # Older partitions may not have every requested column; bind_rows fills them with NA
+      wanted <- if (is.null(columns)) entry$columns else intersect(columns, entry$columns)
+      df <- arrow::read_parquet(entry$path, col_select = wanted)
+      # Add the partition keys so rows from different partitions can be told apart
+      for (key in results_partition_keys) {
+         if (!(key %in% names(df))) {
+            df[[key]] <- if (is.null(entry[[key]])) NA_character_ else as.character(entry[[key]])
+         }
+      }
+      df
+   })
+   bind_rows(partitions)
+}
+
+# Columns of the summary CSV written before the results store (firstrun.csv), in file order
+legacy_results_columns <- c(
+   "TestIndex", "Layout", "VdevType", "VdevWidth", "ParityLevel", "NumVdevs", "NumHotSpares", "SizePerVdev",
+   "LayoutDescription", "dRAIDDataDisks", "dRAIDSpareDisks", "RecordSize", "TargetFillPercent", "UsedBytes", "UsedTiB",
+   "AvailableBytes", "AvailableTiB", "UsedPercent", "PoolSizeBytes", "PoolSizeTiB", "FragPercent", "DiskSize", "FragLevel",
+   "CPUStress", "DiskStress", "ResilverTime", "ResilverTimeSeconds", "ResilverTimeMinutes",
+   paste0("PoolAFR", 1:10, "percent"), paste0("PoolAFR", 1:10, "percent100x"),
+   "Scanned", "ScanSpeedMBps", "Issued", "IssueSpeedMBps", "FillSpeedGiBps")
+
+# Legacy columns that were renamed since; Scanned and Issued held human-readable zpool status sizes (e.g., "1.23T")
+legacy_results_renames <- c(ScannedBytes = "Scanned", IssuedBytes = "Issued")
+
+# Partition keys of the results store
+results_partition_keys <- c("layout", "frag", "recordsize", "test", "tunables")
+
+# Read a legacy summary CSV and give it the current column names; columns added since are left for bind_results to fill
+read_legacy_results <- function(path) {
+   df <- read.csv(path)
+   if (ncol(df) == length(legacy_results_columns)) {
+      names(df) <- legacy_results_columns
+   }
+   df %>%
+      mutate(across(any_of(unname(legacy_results_renames)), parse_zfs_size)) %>%
+      rename(any_of(legacy_results_renames))
+}
+
+# Convert ZFS sizes, exact or human-readable (e.g., "512", "500G", "1.23T"), to bytes; anything else (e.g., "-") becomes NA
+parse_zfs_size <- function(size) {
+   size <- trimws(as.character(size))
+   units <- c(B = 0, K = 1, M = 2, G = 3, T = 4, P = 5, E = 6)
+   unit <- substr(size, nchar(size), nchar(size))
+   has_unit <- unit %in% names(units)
+   number <- suppressWarnings(as.numeric(ifelse(has_unit, substr(size, 1, nchar(size) - 1), size)))
+   number * 1024^ifelse(has_unit, unname(units[unit]), 0)
+}
+
+# Bind result sets by column name, filling columns one of them lacks with NA
+# Columns read as numbers in one set and text in the other (e.g., FragLevel "med" vs 25) are kept as text
+bind_results <- function(...) {
+   sets <- list(...)
+   columns <- unique(unlist(lapply(sets, names)))
+   for (column in columns) {
+      classes <- unique(unlist(lapply(sets, function(df) if (column %in% names(df)) class(df[[column]])[1])))
+      if (length(classes) > 1) {
+         sets <- lapply(sets, function(df) {
+            if (column %in% names(df)) df[[column]] <- as.character(df[[column]])
+            df
+         })
+      }
+   }
+   bind_rows(sets)
+}
+
 plot_3group <- function(df, datatype, ydata, group1, group2, group3, dashed_data, solid_data, dotted_data) {
    medians <- df %>%
       group_by(!!sym(group1), !!sym(group2), !!sym(group3)) %>%
@@ -4,31 +4,171 @@
 # Test resilvering times on different ZFS layouts, varies recordsize, fill percent, and fragmentation levels
 # Runs resilver with and without CPU and disk stress
 # Outputs results to a CSV file
-# Uses pool name "tank" and dataset name "test"
+# Uses pool name "tank" (or "tank0", "tank1", ... when running pools concurrently) and dataset name "test"
 # Uses FIO for CPU and disk stress as well as pool fill
 # The ZFS layouts to test are defined in external file "layouts"
 
-import subprocess, shlex, math, time, os, random, csv, signal, sys, logging, psutil, shutil
+import subprocess, shlex, math, time, os, random, csv, signal, sys, logging, psutil, shutil, multiprocessing, queue, threading, datetime, json, re, collections, array, struct, functools, concurrent.futures, hashlib, http.server
+import numpy
+
+# pyarrow is only needed for the columnar results store; without it results are written to CSV only
+try:
+   import pyarrow, pyarrow.parquet, pyarrow.csv
+except ImportError:
+   pyarrow = None
 
 fill_percent = 70             # Target pool fill percent for all tests
+fill_tolerance = 0.25         # Stop filling once the pool is within this many percent of the fill target
+fill_min_poll_interval = 0.5  # Shortest interval (seconds) between pool usage checks as the fill nears its target
+prune_workers = 32            # Number of fill directories pruned at the same time
+prune_seed = None             # Seed for choosing which files to prune; None picks a new one (it is logged so the prune can be reproduced)
+frag_tolerance = 3            # Stop fragmenting once pool fragmentation is within this many percent of the target
+frag_max_rounds = 10          # Maximum number of write/prune rounds when fragmenting to a target
+frag_gain = 1                 # Percent of the pool rewritten per round for each percent of fragmentation error
 physical_disk_size = "7.3T"   # Size of physical disks
 format_disks = True           # Format disks before creating pool
 format_size = "500G"          # Size to format disks to
+format_workers = 16           # Number of disks to partition at the same time
 target_disk = "sda"           # Disk to offline/online during testing
 results_file = "output.csv"   # Output file name
 log_file = "resilver.log"     # Log file name
+trace_file = "trace.json"     # Chrome trace (Perfetto/chrome://tracing) of every external command and test phase ("" to disable)
 append_results = True         # Append results to existing output file instead of creating a new one
+tunables_file = "tunables"    # File listing the sets of ZFS module tunables to test (see get_tunables()); without it only the defaults are tested
 skip_pool_fill = False        # Skip pool fill step
+golden_image = "none"         # Reuse filled pools: "none" or "snapshot" (zfs snapshot/rollback); "checkpoint" is rejected, see main()
+pool_name = "tank"            # Name of the pool to test; concurrent pools are named pool_name + group number
+concurrent_pools = 1          # Split the disks into this many groups and test a different layout on each group in parallel
+contention_threshold = 0.9    # Minimum ratio of concurrent to solo disk group read bandwidth before falling back to sequential testing
+resilver_start_timeout = 60   # Seconds to wait for the resilver to start after offlining the target disk
+rebuild_mode = "offline"      # How the target disk is failed and rebuilt (tests can override it with "rebuild", see get_rebuild_mode()):
+                              # "offline" (offline -f; ZED swaps in a spare), "draid_spare" (replace with a dRAID distributed spare),
+                              # "sequential" (replace -s onto the wiped disk), or "replace" (healing resilver onto the wiped disk)
+readiness_probes = True       # Wait for fio to exit, txgs to sync, and the pool to go idle between test phases instead of sleeping
+probe_timeout = 120           # Longest a readiness probe waits (seconds) before moving on anyway
+probe_interval = 0.25         # Seconds between readiness probe checks
+idle_iops = 50                # Pool disks count as idle once their combined IOPS drop below this
+cache_reset = "arc"           # How ARC is cleared before each test: "arc" (shrink the ARC, falling back to export/import) or "export"
+arc_reset_size = 256*1024**2  # ARC size limit (bytes) set while shrinking the ARC; the reset succeeds once the ARC is this small
+arc_reset_timeout = 30        # Seconds to wait for the ARC to shrink before falling back to export/import
+status_backend = "auto"       # Pool status backend: "json" (zpool status -j), "text" (zpool status -p), or "auto" to detect
+fio_ring_size = 720           # Number of fio status intervals kept in memory per fio process
+fio_stats_interval = 5        # Seconds between rows of the per-test fio stats CSV
+baseline_min = 30             # Shortest pre-resilver baseline (seconds)
+baseline_max = 300            # Longest pre-resilver baseline (seconds); the resilver is started even if the workloads haven't settled
+baseline_window = 6           # Number of fio stats rows the steady-state check looks back over
+baseline_cv = 0.15            # Workloads are steady once monitor latency and stress IOPS vary by less than this (coefficient of variation)
+diskstats_interval = 1        # Seconds between per-disk I/O samples from /proc/diskstats (as low as 0.1)
+diskstats_block_size = 600    # Number of per-disk samples buffered in memory before being written to disk
+cpustats_interval = 1         # Seconds between per-core and ZFS kernel thread CPU samples (as low as 0.1)
+cpustats_rescan = 10          # Seconds between scans of /proc for ZFS kernel threads that started since the last scan
+kstat_interval = 1            # Seconds between samples of the ZFS kstats in kstat_files
+kstat_files = ("arcstats","dmu_tx","zil","abdstats","{pool}/io","{pool}/iostats","{pool}/txgs") # Under kstat_root; {pool} is the pool name
+zfs_thread_prefixes = ("z_","txg_","spa_","dp_","dbu_","dbuf_","arc_","l2arc","mmp","zthr","zvol","spl_") # Kernel threads counted as ZFS work
+results_store = "results_store" # Directory for the partitioned Parquet results store ("" to write CSV files only)
+mount_root = "/mnt"           # Pools are mounted at mount_root/<pool name>
+backend = "hardware"          # "hardware" tests the disks in the shelf; "sim" tests simulated disks (see set_up_sim())
+sim_dir = "sim"               # Sim backend: directory for the simulated disks, pool data, and stand-in tools
+sim_vdevs = "auto"            # Sim backend: "scripted" (stand-in zpool/zfs/fio from sim.py), "files" (real ZFS on sparse files; needs root), or "auto"
+sim_vdev_size = "2G"          # Sim backend: size of each sparse file vdev
+sim_time_scale = 1000         # Sim backend: simulated seconds per real second; the harness's own waits are shortened to match
+journal_file = "campaign.journal" # Append-only record of campaign progress used to resume after a crash or reboot ("" to disable)
+metrics_port = 9470           # Port for live Prometheus/OpenMetrics metrics (curl localhost:9470/metrics); concurrent pools use the next ports (0 to disable)
+
+# Pool AFR is reported for every combination of disk AFR (percent) and resilver time multiplier
+afr_disk_percents = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+afr_time_multipliers = [1, 100]
 
 # starting_run can be used to resume testing from a specific run number
-# First value is the layout, second is the fragmentation level, third is the recordsize, and fourth is the test schedule
-# [0,0,0,0] starts from the beginning
-starting_test = [0, 0, 0, 0]
+# First value is the layout, second is the fragmentation level, third is the recordsize, fourth is the test schedule, and
+# fifth is the tunables schedule
+# [0,0,0,0,0] starts from the beginning
+# Campaigns interrupted by a crash or reboot are resumed from the journal without setting this (see resume_campaign())
+starting_test = [0, 0, 0, 0, 0]
+
+# Test indices the journal shows as finished by an interrupted run of this campaign
+finished_tests = set()
+
+# Filled pools from an interrupted run that can be reused, keyed by pool name (see resume_campaign())
+resume_fills = {}
 
 # Total number of disks in the pool
 TOTAL_NUM_DISKS = 82
 
+# Disks assigned to this process when running concurrent pools (None uses every disk from get_disk_list())
+disk_group = None
+
+# Ratio of concurrent to solo read bandwidth measured for this disk group ("-" when running a single pool)
+contention_ratio = "-"
+
+# Fixed waits in the harness are divided by time_scale (sim_time_scale on the sim backend, otherwise 1)
+time_scale = 1
+
+# Loop devices backing sparse file vdevs on the sim backend (None uses the disks from lsblk)
+sim_disks = None
+
+# Where per-disk I/O counters are read from (the sim backend's stand-in fio writes its own)
+diskstats_path = "/proc/diskstats"
+
+# Where ZFS kstats are read from
+kstat_root = "/proc/spl/kstat/zfs"
+
+# Where ZFS module parameters are read and set
+zfs_parameters_path = "/sys/module/zfs/parameters"
+
+# Values of the ZFS module tunables changed by apply_tunables(), keyed by name, for restore_tunables() to put back
+tunables_defaults = {}
+
+# kstat values that are levels rather than running totals (so are recorded as is instead of as a rate), besides names
+# ending in "size"
+kstat_gauges = ("c","c_min","c_max","p","arc_meta_used","arc_meta_limit","arc_meta_max","arc_meta_min","arc_dnode_limit","arc_no_grow",
+   "arc_tempreserve","arc_loaned_bytes","arc_sys_free","memory_all_bytes","memory_free_bytes","memory_available_bytes","l2_asize",
+   "wcnt","rcnt")
+
+# Index of the test (or "[layout, frag, recordsize, -]" during the pool fill) shown in log lines and trace spans
+test_index = "-"
+
+# Time spent in each readiness probe against the fixed sleep it replaced, keyed by probe name (see wait_ready())
+probe_stats = {}
+
+# Live metrics endpoint for this process (None when metrics_port is 0)
+metrics = None
+
+# Long-running child processes (fio, zpool wait/events) started with start_process(), stopped by stop_processes() on exit
+child_procs = []
+
+# Calls, total wall time, and failures of each external command run with run_command(), keyed by command (e.g., "zpool list")
+command_stats = {}
+command_stats_lock = threading.Lock()
+
+# Trace file descriptor and the process it was opened by; forked workers open their own (see write_trace_event())
+trace_fd = None
+trace_pid = None
+
+# Metrics served by the metrics endpoint: type and help text
+# Every metric is labeled with the pool name; monitor metrics are also labeled with the fio monitor ("read", "write", or "stress")
+metrics_help = {
+   "resilver_tests_total":                ("gauge","Number of tests in the campaign"),
+   "resilver_tests_finished":             ("gauge","Number of tests finished so far, including tests finished before a restart"),
+   "resilver_test_info":                  ("gauge","Test currently running on the pool (always 1)"),
+   "resilver_fill_used_percent":          ("gauge","Pool used percent while the pool is being filled"),
+   "resilver_fill_target_percent":        ("gauge","Pool used percent the fill is aiming for"),
+   "resilver_fill_rate_bytes":            ("gauge","Rate the pool is being filled at (bytes/s)"),
+   "resilver_resilvering":                ("gauge","1 while a resilver is running, otherwise 0"),
+   "resilver_percent_done":               ("gauge","Percent of the running resilver that is done"),
+   "resilver_scan_rate_bytes":            ("gauge","Resilver scan rate (bytes/s)"),
+   "resilver_issue_rate_bytes":           ("gauge","Resilver issue rate (bytes/s)"),
+   "resilver_time_left_seconds":          ("gauge","Estimated time left in the running resilver"),
+   "resilver_duration_seconds":           ("histogram","Resilver time reported by zpool status for each finished test"),
+   "resilver_monitor_iops":               ("gauge","IOPS of a fio monitor or the disk stress over the last sampling interval"),
+   "resilver_monitor_bandwidth_mibps":    ("gauge","Bandwidth (MiB/s) of a fio monitor or the disk stress over the last sampling interval"),
+   "resilver_monitor_latency_seconds":    ("histogram","Completion latency of I/Os issued by a fio monitor or the disk stress"),
+   "resilver_cpu_percent":                ("gauge","CPU utilization by mode (user or system)")
+}
+
 # Fragmentation levels to test on each configuration
+# "med" and "high" use fixed fio recipes (fill to 100% with unaligned blocks, then prune) and "none" fills sequentially
+# A number (e.g., 25) is a target pool fragmentation percent reached by alternating write and prune rounds (see fragment_pool())
 frag_schedule = [
    "none",     # 0
    "med",      # 1
@@ -43,6 +183,7 @@ recordsize_schedule = [
 # Tests to run on each configuration
 # cpu: CPU stress level
 # disk: Disk stress level
+# rebuild (optional): rebuild mode for the test, e.g., {"cpu": "none", "disk": "none", "rebuild": "sequential"}; defaults to rebuild_mode
 test_schedule = [
    {"cpu": "none", "disk": "none"},    # 0
    {"cpu": "med",  "disk": "none"},    # 1
@@ -53,6 +194,110 @@ test_schedule = [
    {"cpu": "high", "disk": "high"}     # 6
 ]
 
+# Sets of ZFS module tunables to run each test with, read from tunables_file by main() (see get_tunables())
+# {} runs the test with the module's current settings
+tunables_schedule = [{}]
+
+# Names of the pool AFR columns, e.g., "PoolAFR1percent" at 1x resilver time and "PoolAFR1percent100x" at 100x
+def get_afr_columns(disk_percents,multipliers):
+   columns = []
+   for multiplier in multipliers:
+      for disk_percent in disk_percents:
+         column = "PoolAFR" + str(disk_percent) + "percent"
+         if multiplier != 1:
+            column += str(multiplier) + "x"
+         columns.append(column)
+   return columns
+
+# Latency histograms kept for each test: monitors (and their results column prefixes) and test phases
+latency_histogram_monitors = {"write": "WriteMonitor","stress": "DiskStress","read": "ReadMonitor"}
+latency_histogram_phases = ("baseline","resilver")
+
+# Names of the per-phase latency histogram columns, e.g., "WriteMonitorResilverLatencyP99ms"
+def get_latency_columns(monitors,phases):
+   columns = []
+   for monitor in monitors.values():
+      for phase in phases:
+         for statistic in ("P50","P99","P999","Max"):
+            columns.append(monitor + phase.capitalize() + "Latency" + statistic + "ms")
+   return columns
+
+# Columns of the results CSV (and the summary table of the columnar results store)
+results_header = [
+   "TestIndex",
+   "Layout",
+   "VdevType",
+   "VdevWidth",
+   "ParityLevel",
+   "NumVdevs",
+   "NumHotSpares",
+   "SizePerVdev",
+   "LayoutDescription",
+   "dRAIDDataDisks",
+   "dRAIDSpareDisks",
+   "RecordSize",
+   "TargetFillPercent",
+   "FillErrorPercent",
+   "UsedBytes",
+   "UsedTiB",
+   "AvailableBytes",
+   "AvailableTiB",
+   "UsedPercent",
+   "PoolSizeBytes",
+   "PoolSizeTiB",
+   "FragPercent",
+   "DiskSize",
+   "FragLevel",
+   "CPUStress",
+   "DiskStress",
+   "TunablesIndex",
+   "Tunables",
+   "RebuildMode",
+   "ResilverTime",
+   "ResilverTimeSeconds",
+   "MeasuredResilverTimeSeconds",
+   "VerifyScrubSeconds",
+   "ResilverTimeMinutes"] + \
+   get_afr_columns(afr_disk_percents,afr_time_multipliers) + [
+   "ScannedBytes",
+   "ScanSpeedMBps",
+   "IssuedBytes",
+   "IssueSpeedMBps",
+   "FillSpeedGiBps",
+   "RestoreTimeSeconds",
+   "RestoreBytes",
+   "ContentionRatio",
+   "BaselineSeconds",
+   "BaselineSteady",
+   "BaselineWriteLatencyCV",
+   "BaselineReadLatencyCV",
+   "BaselineStressIOPSCV"] + \
+   get_latency_columns(latency_histogram_monitors,latency_histogram_phases)
+
+# Results columns that hold text; every other column is stored as a number in the columnar results store
+results_text_columns = ("TestIndex","Layout","VdevType","LayoutDescription","RecordSize","TargetFillPercent","UsedPercent",
+   "FragPercent","DiskSize","FragLevel","CPUStress","DiskStress","Tunables","RebuildMode","ResilverTime")
+
+# Resilver progress parsed from zpool status
+# state is "resilvering", "complete", "pending" (resilver not started yet), "healthy", or "unknown" (status could not be read)
+# Sizes are in bytes, rates in bytes/s, times in seconds (start_time and end_time are seconds since the epoch)
+# Values that zpool status doesn't report for the pool layout or resilver phase are None
+ResilverProgress = collections.namedtuple("ResilverProgress",[
+   "state",
+   "scanned",
+   "issued",
+   "total",
+   "resilvered",
+   "scan_rate",
+   "issue_rate",
+   "percent_done",
+   "time_left",
+   "start_time",
+   "end_time",
+   "resilver_time",
+   "errors"],
+   defaults=[None] * 12)
+
 # Names of the values returned by fio terse output
 fio_key = ("terse_version_3;fio_version;jobname;groupid;error;read_kb;read_bandwidth_kb;read_iops;read_runtime_ms;"
    "read_slat_min_us;read_slat_max_us;read_slat_mean_us;read_slat_dev_us;read_clat_min_us;read_clat_max_us;"
@@ -82,6 +327,8 @@ def main():
    global starting_test
    global f
    global skip_pool_fill
+   global pool_name
+   global tunables_schedule
 
    overall_start_time = time.time()
 
@@ -96,18 +343,26 @@ def main():
    log = logging.getLogger()
    log.addHandler(logging.StreamHandler(sys.stdout))
 
+   # ZFS can't attach, replace, or detach a device while the pool has a checkpoint, so hot spares, distributed spares, and
+   # replacements would never start the resilver being measured. A checkpoint can't be dropped for the resilver either,
+   # since the rewind back to the golden image needs it
+   if golden_image == "checkpoint":
+      log.info("golden_image = \"checkpoint\" can't be used: a pool checkpoint blocks the spare attach or replace that starts " + \
+         "the resilver. Use \"snapshot\" instead")
+      sys.exit(1)
+
    # Setup main output file
-   # Check if output file exists and has a header row
+   # Check if output file exists and has a header row with the current columns
    if os.path.isfile(results_file) and append_results == True:
       f = open(results_file,"r")
-      header = f.readline().strip()
-      if "TestIndex" in header:
+      header = next(csv.reader(f),[])
+      if header == results_header:
          # Results file exists and has a header row, open for appending
          f.close()
          f = open(results_file,"a")
          results = csv.writer(f)
       else:
-         # Results file exists but does not have a header row; make a copy of it and create a new one
+         # Results file exists but does not have a header row (or has an older one); make a copy of it and create a new one
          f.close()
          os.rename(results_file,results_file + ".old")
          f = open(results_file,"w")
@@ -121,6 +376,14 @@ def main():
       f = open(results_file,"w")
       results = set_up_csv(f)
 
+   if results_store != "" and pyarrow == None:
+      log.info("pyarrow is not installed, writing results to CSV only")
+
+   start_trace()
+
+   if backend == "sim":
+      set_up_sim()
+
    # Check if fio stats directory exists; if not, create it. If it exists, rename it
    try:
       os.mkdir("fio_stats")
@@ -135,490 +398,2070 @@ def main():
       else:
          pass
 
-   # Get the layouts to test from the external file
+   # Get the layouts and tunables to test from the external files
    layouts = get_layouts()
    layout_index = starting_test[0]
+   tunables_schedule = get_tunables()
 
    # Display total number of tests to run and starting test number
-   total_tests = len(layouts) * len(frag_schedule) * len(recordsize_schedule) * len(test_schedule)
-   starting_test_number = starting_test[0]*len(frag_schedule)*len(recordsize_schedule)*len(test_schedule) + \
-      starting_test[1]*len(recordsize_schedule)*len(test_schedule) + \
-      starting_test[2]*len(test_schedule) + starting_test[3]
+   tests_per_config = len(test_schedule) * len(tunables_schedule)
+   total_tests = len(layouts) * len(frag_schedule) * len(recordsize_schedule) * tests_per_config
+   starting_test_number = starting_test[0]*len(frag_schedule)*len(recordsize_schedule)*tests_per_config + \
+      starting_test[1]*len(recordsize_schedule)*tests_per_config + \
+      starting_test[2]*tests_per_config + starting_test[3]*len(tunables_schedule) + starting_test[4]
    log.info("Total tests to run: " + str(total_tests) + " | Starting test number: " + str(starting_test_number))
 
+   # Pick up where an interrupted run of this campaign left off
+   resume_campaign(layouts,total_tests)
+
+   if metrics_port != 0:
+      start_metrics(metrics_port)
+      set_metric("resilver_tests_total",total_tests)
+      set_metric("resilver_tests_finished",len(finished_tests))
+
    # Format disks if needed; destroy pool (if exists) before formatting
+   # If a golden image exists on the current pool, keep it so an interrupted campaign can resume without a refill
    if format_disks and not skip_pool_fill:
-      destroy_pool()
-      format(format_size)
+      if golden_image != "none" and get_golden_image() != None:
+         log.info("Found golden image on existing pool, skipping disk format")
+      elif resume_fills != {}:
+         log.info("Found filled pool from the interrupted run, skipping disk format")
+      else:
+         destroy_pool()
+         # Concurrent pools from a previous campaign also hold the disks and need to be destroyed before formatting
+         if concurrent_pools > 1:
+            single_pool_name = pool_name
+            for group_number in range(concurrent_pools):
+               pool_name = single_pool_name + str(group_number)
+               destroy_pool()
+            pool_name = single_pool_name
+         format(format_size)
 
    # Kill old instances of fio
+   kill_fio()
+
+   # Child processes still running when the campaign ends or is interrupted (see kill()) are stopped on the way out
    try:
-      subprocess.check_output("pkill -9  fio",shell=True)
-   except:
-      pass
+      # Run layouts on separate disk groups in parallel; layouts too wide for a group are returned and run on the full shelf below
+      # Module tunables apply to every pool, so tunables sweeps can't share the shelf between layouts
+      if concurrent_pools > 1 and tunables_schedule != [{}]:
+         log.info("Tunables schedule in " + tunables_file + " changes module-wide settings, running layouts sequentially")
+         deferred_layouts = list(range(layout_index,len(layouts)))
+      elif concurrent_pools > 1:
+         deferred_layouts = run_concurrent(layouts,layout_index,results,overall_start_time,total_tests)
+      else:
+         deferred_layouts = list(range(layout_index,len(layouts)))
+
+      # Iterate through layouts
+      for layout_index in deferred_layouts:
+         # Refresh layouts list
+         layouts = get_layouts()
+         layout = layouts[layout_index]
+         run_layout(layouts,layout,results,overall_start_time,total_tests)
+
+      # Log completion time
+      log.info("All tests completed in " + sec_to_dhms(time.time() - overall_start_time))
+      log_probe_summary()
+      log_command_summary()
+      journal("campaign_finished")
+   finally:
+      stop_processes()
+      restore_tunables()
+
+      # Close output file after all tests completed
+      f.close()
+
+# Test and tunables schedule positions to run on each configuration, in order: every tunables set of each test
+# The first configuration of a resumed campaign starts at starting_test[3] and starting_test[4]
+def get_test_runs():
+   runs = [(test_position,tunables_position) for test_position in range(len(test_schedule)) for tunables_position in range(len(tunables_schedule))]
+   return runs[starting_test[3]*len(tunables_schedule) + starting_test[4]:]
+
+# Run every fragmentation level, recordsize, and test on a single layout
+def run_layout(layouts,layout,results,overall_start_time,total_tests):
+   global log
+   global test_index
+   global starting_test
+   global f
+   global skip_pool_fill
 
-   # Iterate through layouts
-   while layout_index < len(layouts):
-      # Refresh layouts list
-      layouts = get_layouts()
-      layout = layouts[layout_index]
-      layout_index += 1
+   log.info("Starting layout: " + layout["layout"])
+   
+   # Iterate through fragmentation levels
+   for frag in frag_schedule[starting_test[1]:]:
+      log.info("Starting fragmentation level: " + str(frag))
+
+      # Iterate through recordsize values
+      for recordsize in recordsize_schedule[starting_test[2]:]:
+         log.info("Starting recordsize: " + recordsize)
+
+         # Skip configurations whose tests all finished before a restart, without filling the pool again
+         config_index = "[" + str(layouts.index(layout)) + ", " + str(frag_schedule.index(frag)) + ", " + str(recordsize_schedule.index(recordsize)) + ", "
+         if all(config_index + str(test_position) + ", " + str(tunables_position) + "]" in finished_tests
+            for test_position, tunables_position in get_test_runs()):
+            log.info("Skipping " + config_index + "-, -], all tests finished before the restart")
+            starting_test[3] = 0
+            starting_test[4] = 0
+            continue
+         
+         # Golden images are keyed on everything that determines the contents of the filled pool
+         golden_key = layout["layout"] + "|" + str(layout["width"]) + "|" + str(layout["minspares"]) + "|" + \
+            str(frag) + "|" + recordsize + "|" + str(fill_percent)
+         restore_time = 0
+         restore_bytes = 0
+
+         # If the pool already holds a golden image of this configuration, restore it instead of refilling
+         pool_restored = False
+         pool_resumed = False
+         if golden_image != "none" and not skip_pool_fill and get_golden_image() == golden_key:
+            log.info("Reusing golden image for " + golden_key)
+            restore_time, restore_bytes = restore_golden_image()
+            pool_restored = True
+
+         # If the interrupted run had already filled the pool for this configuration, pick the pool back up as it is
+         elif not skip_pool_fill and pool_name in resume_fills and resume_fills[pool_name]["key"] == golden_key and \
+            get_pool_fill() == golden_key:
+            log.info("Reusing pool filled before the restart for " + golden_key)
+            recover_pool()
+            pool_resumed = True
+
+         # Destroy, recreate, and refill pool
+         elif not skip_pool_fill:
+            destroy_pool()
+            create_pool(layout["layout"],layout["width"],recordsize,layout["minspares"])
+            journal("pool_created",layout=layout["layout"],key=golden_key)
+         
+         # Initialize test index to diplay during pool fill
+         test_index = "[" + str(layouts.index(layout)) + ", " + str(frag_schedule.index(frag)) + ", " + str(recordsize_schedule.index(recordsize)) + ", -, -]"
+         
+         # fill_pool() returns the speed at which the pool was filled
+         # Restored pools report the fill speed recorded when the golden image was saved
+         # Resumed pools report the fill speed recorded in the journal
+         if pool_restored:
+            fill_speed = get_golden_fill_speed()
+         elif pool_resumed:
+            fill_speed = resume_fills.pop(pool_name)["fill_speed"]
+         elif not skip_pool_fill:
+            fill_speed = fill_pool(fill_percent,frag)
+            run_command(["zfs","set","resilver:fill=" + golden_key,pool_name + "/test"])
+            if golden_image != "none":
+               save_golden_image(golden_key,fill_speed)
+         else:
+            fill_speed = 0
 
-      log.info("Starting layout: " + layout["layout"])
-      
-      # Iterate through fragmentation levels
-      for frag in frag_schedule[starting_test[1]:]:
-         log.info("Starting fragmentation level: " + frag)
+         # Tracks whether a test has modified the pool since it was filled or restored
+         # A resumed pool may have been part way through a test when the run was interrupted
+         pool_dirty = pool_resumed
 
-         # Iterate through recordsize values
-         for recordsize in recordsize_schedule[starting_test[2]:]:
-            log.info("Starting recordsize: " + recordsize)
-            
-            # Destroy, recreate, and refill pool
-            if not skip_pool_fill:
-               destroy_pool()
-               create_pool(layout["layout"],layout["width"],recordsize,layout["minspares"])
-            
-            # Initialize test index to diplay during pool fill
-            test_index = "[" + str(layouts.index(layout)) + ", " + str(frag_schedule.index(frag)) + ", " + str(recordsize_schedule.index(recordsize)) + ", -]"
+         # Gather pool status for results CSV
+         zfs_status = run_command(["zfs","list","-Hpo","used,available",pool_name + "/test"])
+         used = int(zfs_status.split()[0])
+         used_tib = round(used/1024**4,2)
+         avail = int(zfs_status.split()[1])
+         avail_tib = round(avail/1024**4,2)
+         used_percent = round(used/(used+avail)*100,2)
+         pool_size = used + avail
+         pool_size_tib = round(pool_size/1024**4,2)
+         frag_percent = run_command(["zpool","list","-Hpo","frag",pool_name]).strip()
+         if not pool_resumed and not skip_pool_fill:
+            journal("pool_filled",key=golden_key,fill_speed=fill_speed,used_percent=used_percent,frag_percent=frag_percent)
+
+         # Once pool is filled with appropriate fragmentation level, iterate through tests
+         for test_position, tunables_position in get_test_runs():
+            test = test_schedule[test_position]
+            tunables = tunables_schedule[tunables_position]
+            tests_per_config = len(test_schedule) * len(tunables_schedule)
+            test_number = layouts.index(layout)*len(frag_schedule)*len(recordsize_schedule)*tests_per_config + \
+               frag_schedule.index(frag)*len(recordsize_schedule)*tests_per_config + \
+               recordsize_schedule.index(recordsize)*tests_per_config + test_position*len(tunables_schedule) + tunables_position
+            test_index = "[" + str(layouts.index(layout)) + ", " + str(frag_schedule.index(frag)) + ", " + \
+               str(recordsize_schedule.index(recordsize)) + ", " + str(test_position) + ", " + str(tunables_position) + "]"
+
+            # Tests that finished before a restart are not run again
+            if test_index in finished_tests:
+               log.info("Skipping test index " + test_index + ", finished before the restart")
+               continue
+            rebuild = get_rebuild_mode(layout,test)
+            test_span = TraceSpan("test",cpu=test["cpu"],disk=test["disk"],tunables=tunables_position,rebuild=rebuild)
+
+            # Roll the pool back to the golden image so every test starts from the same filled state
+            if golden_image != "none" and pool_dirty and get_golden_image() == golden_key:
+               restore_time, restore_bytes = restore_golden_image()
+
+            # Kill old instances of fio and let pending writes sync; dirty data can't be evicted or exported
+            kill_fio()
+            wait_ready("fio_exited",5,lambda: fio_running() == 0)
+            wait_ready("txg_synced",0,pool_synced)
+
+            # Before starting the tests, clear ARC data so the resilver and monitors don't read from cache
+            reset_cache()
+
+            set_metric("resilver_test_info",1,replace=True,test_index=test_index,layout=layout["layout"],frag=str(frag),
+               recordsize=recordsize,cpu=test["cpu"],disk=test["disk"],tunables=str(tunables_position),rebuild=rebuild)
+
+            # Log test index
+            elapsed_time = sec_to_dhms(time.time() - overall_start_time)
+            log.info("Starting test index " + test_index + " (" + str(test_number) + "/" + str(total_tests) + ") | Total runtime: " + elapsed_time)
+            journal("test_started",test=test_index)
+
+            # Set this test's ZFS module tunables; the baseline and the resilver both run with them
+            applied_tunables = apply_tunables(tunables)
+
+            # Set up FIO stats CSV file
+            fio_stats_file = "fio_stats/" + test_index.replace("[","").replace("]","").replace(", ","-") + ".csv"   
+            fio_file = open(fio_stats_file,"w")
+
+            fio_stats = csv.writer(fio_file)
+            fio_stats.writerow([
+               "Write IOPS (monitor)",
+               "Write Bandwidth (MiB/s, monitor)",
+               "Write Latency (mSec, monitor)",
+               "Write IOPS (stress)",
+               "Write Bandwidth (MiB/s, stress)",
+               "Write Latency (mSec, stress)",
+               "Read IOPS",
+               "Read Bandwidth (MiB/s)",
+               "Read Latency (mSec)",
+               "CPU % User",
+               "CPU % System",
+               "Timestamp",
+               "Write Latency p50 (mSec, monitor)",
+               "Write Latency p99 (mSec, monitor)",
+               "Write Latency p99.9 (mSec, monitor)",
+               "Write Latency p50 (mSec, stress)",
+               "Write Latency p99 (mSec, stress)",
+               "Write Latency p99.9 (mSec, stress)",
+               "Read Latency p50 (mSec)",
+               "Read Latency p99 (mSec)",
+               "Read Latency p99.9 (mSec)"
+            ])
+
+            # Start CPU and disk stress. If stress is set to "none", these functions will return 0
+            disk_stress_handle = disk_stress(test["disk"])
+            cpu_stress_handle = cpu_stress(test["cpu"])
+            read_monitor_handle = read_latency_monitor()
+            write_monitor_handle = write_latency_monitor()
+
+            # Sample per-disk I/O for every disk in the pool until the resilver is done
+            disk_stats_sampler = DiskStatsSampler(fio_stats_file.replace(".csv",".diskstats"),get_disk_list())
+
+            # Sample per-core utilization and ZFS kernel thread CPU time until the resilver is done
+            cpu_stats_sampler = CpuStatsSampler(fio_stats_file.replace(".csv",".cpustats"))
+
+            # Sample ZFS kstats (ARC, txgs, dmu_tx throttling, pool I/O) until the resilver is done
+            kstat_sampler = KstatSampler(fio_stats_file.replace(".csv",".kstats"))
+
+            # Sample fio and CPU stats on a background thread until the resilver is done
+            fio_stats_sampler = FioStatsSampler(fio_file,fio_stats,disk_stress_handle,read_monitor_handle,write_monitor_handle)
+
+            # Gather CPU and disk stats before the resilver starts, until the stress and monitor workloads settle
+            log.info("Gathering pre-resilver system stats until the workloads are steady (" + str(baseline_min) + "-" + \
+               str(baseline_max) + " seconds)...")
+            baseline_span = TraceSpan("baseline")
+            baseline_seconds, baseline_steady, baseline_variation = wait_for_baseline(fio_stats_sampler)
+            baseline_span.end()
             
-            # fill_pool() returns the speed at which the pool was filled
-            if not skip_pool_fill:
-               fill_speed = fill_pool(fill_percent,frag)
-            else:
-               fill_speed = 0
-
-            # Gather pool status for results CSV
-            zfs_status = subprocess.check_output("zfs list -Hpo used,available tank/test",shell=True).decode("utf-8")
-            used = int(zfs_status.split()[0])
-            used_tib = round(used/1024**4,2)
-            avail = int(zfs_status.split()[1])
-            avail_tib = round(avail/1024**4,2)
-            used_percent = round(used/(used+avail)*100,2)
-            pool_size = used + avail
-            pool_size_tib = round(pool_size/1024**4,2)
-            frag_percent = subprocess.check_output("zpool list -Hpo frag tank",shell=True).decode("utf-8").strip()
-
-            # Once pool is filled with appropriate fragmentation level, iterate through tests
-            for test in test_schedule[starting_test[3]:]:
-
-               # Before starting the tests, export and import the pool to clear ARC data
-               log.info("Exporting and importing pool to clear ARC...")
+            # Follow zpool events so resilver start and end are timestamped by the kernel rather than by our polling
+            resilver_events = ResilverEvents()
+
+            # Fail the target disk to start the resilver or rebuild, log event in fio stat file, wait for it to start before checking status
+            resilver_span = TraceSpan("resilver",rebuild=rebuild)
+            if rebuild != test.get("rebuild",rebuild_mode):
+               log.info("Rebuild mode " + test.get("rebuild",rebuild_mode) + " isn't supported on " + layout["layout"] + ", using " + rebuild)
+            offline_time = time.time()
+            start_rebuild(target_disk,rebuild)
+            fio_stats_sampler.mark("Resilver Start",phase="resilver")
+            if not resilver_events.started.wait(timeout=resilver_start_timeout/time_scale):
+               log.info("No resilver start event after " + str(resilver_start_timeout) + " seconds, checking pool status")
+
+            # zpool wait returns as soon as the resilver finishes; progress is still sampled every 5 seconds while it runs
+            wait_proc = start_process(["zpool","wait","-t","resilver",pool_name],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+
+            # Set up average speed tracking variables
+            scan_speed_avg = 0
+            scan_sample_count = 1
+            issue_speed_avg = 0
+            issue_sample_count = 1
+
+            # Wait for resilver to complete, checking status every 5 seconds
+            # "pending" means the resilver hasn't shown up in pool status yet; "unknown" means the status couldn't be read
+            # Versions that don't report sequential rebuilds in pool status show the pool as "healthy" while zpool wait runs
+            replaced = rebuild != "offline"
+            resilver_status = get_resilver_status(offline_time,replaced)
+            last_progress = resilver_status
+            while resilver_status.state == "resilvering" or \
+               (resilver_status.state in ("unknown","healthy") and wait_proc.poll() == None) or \
+               (resilver_status.state == "pending" and time.time() - offline_time < resilver_start_timeout/time_scale):
+
+               # Calculate average scan and issue speeds (MiB/s)
+               if resilver_status.scan_rate != None:
+                  scan_speed_avg = (scan_speed_avg * (scan_sample_count - 1) + resilver_status.scan_rate/1024**2)/scan_sample_count
+                  scan_sample_count += 1
+               if resilver_status.issue_rate != None:
+                  issue_speed_avg = (issue_speed_avg * (issue_sample_count - 1) + resilver_status.issue_rate/1024**2)/issue_sample_count
+                  issue_sample_count += 1
                
-               # Kill old instances of fio before exporting the pool
+               # Update live metrics and log resilver status
+               set_metric("resilver_resilvering",1 if resilver_status.state == "resilvering" else 0)
+               for name, value in (("resilver_percent_done",resilver_status.percent_done),("resilver_scan_rate_bytes",resilver_status.scan_rate),
+                  ("resilver_issue_rate_bytes",resilver_status.issue_rate),("resilver_time_left_seconds",resilver_status.time_left)):
+                  if value != None:
+                     set_metric(name,value)
+               if resilver_status.state == "resilvering":
+                  percent_done = "{:.2f}%".format(resilver_status.percent_done) if resilver_status.percent_done != None else "-"
+                  issue_speed = str(round(resilver_status.issue_rate/1024**2,1)) + "M/s" if resilver_status.issue_rate != None else "-"
+                  time_left = sec_to_dhms(resilver_status.time_left) if resilver_status.time_left != None else "-"
+                  log.info(test_index + " Resilvering: " + percent_done + " (" + issue_speed + ", ETA " + time_left + ")")
+
+
+               # fio stats are sampled on their own thread, so this loop only has to poll pool status every 5 seconds
+               # (pool status itself is a blocking run_command() call; only the long-running streams are in the background)
+               # If zpool wait exited before the resilver was visible in pool status, start it again so we don't spin
+               if wait_proc.poll() != None and not resilver_events.finished.is_set():
+                  wait_proc = start_process(["zpool","wait","-t","resilver",pool_name],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
                try:
-                  subprocess.check_output("pkill -9  fio",shell=True)
-               except:
+                  wait_proc.wait(timeout=5/time_scale)
+               except subprocess.TimeoutExpired:
                   pass
-               time.sleep(5)
-
-               # Pool will occasionally fail to export if pool is busy; retry until successful
-               pool_exported = False
-               export_attempts = 0
-               while pool_exported == False:
-                  try:
-                     subprocess.check_output("zpool export tank",shell=True)
-                     pool_exported = True
-                  except:
-                     export_attempts += 1
-                     time.sleep(30)
-                     log.info("Failed to export pool, retrying... Attempt " + str(export_attempts))
-
-               subprocess.check_output("zpool import tank",shell=True)
-
-               test_number = layouts.index(layout)*len(frag_schedule)*len(recordsize_schedule)*len(test_schedule) + \
-                  frag_schedule.index(frag)*len(recordsize_schedule)*len(test_schedule) + \
-                  recordsize_schedule.index(recordsize)*len(test_schedule) + test_schedule.index(test)
-               test_index = "[" + str(layouts.index(layout)) + ", " + str(frag_schedule.index(frag)) + ", " + \
-                  str(recordsize_schedule.index(recordsize)) + ", " + str(test_schedule.index(test)) + "]"
-               # Log test index
-               elapsed_time = sec_to_dhms(time.time() - overall_start_time)
-               log.info("Starting test index " + test_index + " (" + str(test_number) + "/" + str(total_tests) + ") | Total runtime: " + elapsed_time)
-
-               # Set up latency tracking variables
-               num_write_latency_samples_mon = 1
-               write_lat_mean_mon = 0
-               num_write_latency_samples_stress = 1
-               write_lat_mean_stress = 0
-               num_read_latency_samples = 1
-               read_lat_mean = 0
-
-               # Set up FIO stats CSV file
-               fio_stats_file = "fio_stats/" + test_index.replace("[","").replace("]","").replace(", ","-") + ".csv"   
-               fio_file = open(fio_stats_file,"w")
-
-               fio_stats = csv.writer(fio_file)
-               fio_stats.writerow([
-                  "Write IOPS (monitor)",
-                  "Write Bandwidth (MiB/s, monitor)",
-                  "Write Latency (mSec, monitor)",
-                  "Write IOPS (stress)",
-                  "Write Bandwidth (MiB/s, stress)",
-                  "Write Latency (mSec, stress)",
-                  "Read IOPS",
-                  "Read Bandwidth (MiB/s)",
-                  "Read Latency (mSec)",
-                  "CPU % User",
-                  "CPU % System"
-               ])
-
-               # Start CPU and disk stress. If stress is set to "none", these functions will return 0
-               disk_stress_handle = disk_stress(test["disk"])
-               cpu_stress_handle = cpu_stress(test["cpu"])
-               read_monitor_handle = read_latency_monitor()
-               write_monitor_handle = write_latency_monitor()
-
-               # Gather CPU and disk stats before resilver starts
-               log.info("Gathering pre-resilver system stats for 60 seconds...")
-               for i in range(12):
-                  get_fio_stats(
-                     disk_stress_handle,
-                     read_monitor_handle,
-                     write_monitor_handle,
-                     fio_stats,
-                     5,
-                     num_read_latency_samples,
-                     read_lat_mean,
-                     num_write_latency_samples_mon,
-                     write_lat_mean_mon,
-                     num_write_latency_samples_stress,
-                     write_lat_mean_stress)
-               
-               # Offline target disk to start the resilver, log event in fio stat file, wait for 5 seconds before checking resilver status
-               offline_disk(target_disk)
-               fio_stats.writerow(["Resilver Start"])
-               fio_file.flush()
-               time.sleep(5)
-
-               # Set up average speed tracking variables
-               scan_speed_avg = 0
-               scan_sample_count = 1
-               issue_speed_avg = 0
-               issue_sample_count = 1
-
-               # Wait for resilver to complete, checking status every 5 seconds
-               resilver_status = get_resilver_status()
-               while resilver_status[0] == "resilvering":
-
-                  # Calculate average scan speed
-                  scan_speed = resilver_status[1]
-                  try:
-                     if "T/s" in scan_speed:
-                        scan_speed_float = float(scan_speed.split("T/s")[0]) * 1000 * 1000
-                     elif "G/s" in scan_speed:
-                        scan_speed_float = float(scan_speed.split("G/s")[0]) * 1000
-                     elif "M/s" in scan_speed:
-                        scan_speed_float = float(scan_speed.split("M/s")[0])
-                     scan_speed_avg = (scan_speed_avg * (scan_sample_count - 1) + scan_speed_float)/scan_sample_count
-                     scan_sample_count += 1
-                  
-                  except:
-                     pass
-
-                  # Calculate average issue speed
-                  issue_speed = resilver_status[2]
-                  try:
-                     if "T/s" in issue_speed:
-                        issue_speed_float = float(issue_speed.split("T/s")[0]) * 1000 * 1000
-                     elif "G/s" in issue_speed:
-                        issue_speed_float = float(issue_speed.split("G/s")[0]) * 1000
-                     elif "M/s" in issue_speed:
-                        issue_speed_float = float(issue_speed.split("M/s")[0])
-                     issue_speed_avg = (issue_speed_avg * (issue_sample_count - 1) + issue_speed_float)/issue_sample_count
-                     issue_sample_count += 1
-                  
-                  except:
-                     pass
-                  
-                  # Log resilver status
-                  percent_done = resilver_status[3]
-                  time_left = resilver_status[4]
-                  log.info(test_index + " Resilvering: " + percent_done + " (" + issue_speed + ", ETA " + time_left + ")")
-                  
-                  # Gather FIO stats
-                  get_fio_stats(
-                     disk_stress_handle,
-                     read_monitor_handle,
-                     write_monitor_handle,
-                     fio_stats,
-                     0.1,
-                     num_read_latency_samples,
-                     read_lat_mean,
-                     num_write_latency_samples_mon,
-                     write_lat_mean_mon,
-                     num_write_latency_samples_stress,
-                     write_lat_mean_stress)
-                  fio_file.flush()
-
-                  # Call to psutil above blocks for 0.1 seconds, so we sleep for 4.9 seconds to keep the 5 second interval
-                  time.sleep(4.9)
-
-                  # When resilver is at 100%, zpool status output can cause parse issues.
-                  # If we fail to parse, wait 5 seconds and try again
-                  try:
-                     resilver_status = get_resilver_status()
-                  except:
-                     time.sleep(5)
-                     resilver_status = get_resilver_status()
-               
-               # Log resilver results
-               log.info("Resilver complete in " + resilver_status[1] + " | " + resilver_status[3] + " resilvered")
-
-               # Calculate resilver time in seconds and minutes
-               resilver_time_seconds = int(resilver_status[1].split(":")[0])*60*60 + int(resilver_status[1].split(":")[1])*60 + int(resilver_status[1].split(":")[2])
-               resilver_time_minutes = resilver_time_seconds/60
-
-               # Terminate stress tests
-               if disk_stress_handle != 0:
-                  disk_stress_handle.terminate()
-                  log.info("Disk stress terminated")
-               if cpu_stress_handle != 0:
-                  cpu_stress_handle.terminate()
-                  log.info("CPU stress terminated")
-               read_monitor_handle.terminate()
-               write_monitor_handle.terminate()
-               time.sleep(5)
-               log.info("Read and write latency monitoring terminated")
-
-               # Clean up scan and issue speed values if needed
-               if scan_speed_avg == 0: scan_speed_avg = "-"
-               if issue_speed_avg == 0: issue_speed_avg = "-"
-
-               # Get some extra data for the output sheet for the pool
-               vdev_type = layout["layout"].split(":")[0]
-               parity_level = get_parity_level(vdev_type, layout["width"])
-               num_vdevs = get_num_vdevs(vdev_type, layout["width"])
-               size_per_vdev = pool_size / num_vdevs
-
-               # Generate a concise layout description
-               if "draid" in layout["layout"]:
-                  layout_description = layout["layout"]
-                  draid_data_disks = layout["layout"].split(":")[1].split("d")[0]
-                  draid_spare_disks = layout["layout"].split(":")[3].split("s")[0]
-                  num_hot_spares = 0
-               elif "raidz" in layout["layout"]:
-                  layout_description = str(layout["width"]) + "-wide " + layout["layout"]
-                  draid_data_disks = "-"
-                  draid_spare_disks = "-"
-                  num_hot_spares = TOTAL_NUM_DISKS - (num_vdevs * layout["width"])
-               elif "mirror" in layout["layout"]:
-                  layout_description = str(layout["width"]) + "-way mirror"
-                  draid_data_disks = "-"
-                  draid_spare_disks = "-"
-                  num_hot_spares = TOTAL_NUM_DISKS - (num_vdevs * layout["width"])
-
-               # Calculate pool AFR
-               afr_array_1x = []
-               for disk_afr in range(1,11):
-                  afr = disk_afr / 100
-                  pool_afr = get_pool_afr(layout["width"], parity_level, num_vdevs, afr, resilver_time_seconds)
-                  afr_array_1x.append(pool_afr)
-
-               afr_array_100x = []
-               for disk_afr in range(1,11):
-                  afr = disk_afr / 100
-                  pool_afr = get_pool_afr(layout["width"], parity_level, num_vdevs, afr, resilver_time_seconds * 100)
-                  afr_array_100x.append(pool_afr)
-               
-               # Write results from this run to CSV
-               results.writerow([
-                  test_index,                # Test Index
-                  layout["layout"],          # Layout
-                  vdev_type,                 # Vdev Type
-                  layout["width"],           # Vdev Width
-                  parity_level,              # Parity Level
-                  num_vdevs,                 # Number of Vdevs
-                  num_hot_spares,            # Number of Hot Spares
-                  size_per_vdev,             # Size per Vdev
-                  layout_description,        # Layout Description
-                  draid_data_disks,          # dRAID Data Disks
-                  draid_spare_disks,         # dRAID Spare Disks
-                  recordsize,                # Recordsize
-                  str(fill_percent) + "%",   # Target Fill Percent
-                  used,                      # Used (bytes)
-                  used_tib,                  # Used (TiB)
-                  avail,                     # Available (bytes)
-                  avail_tib,                 # Available (TiB)
-                  str(used_percent) + "%",   # Used Percent
-                  pool_size,                 # Pool Size (bytes)
-                  pool_size_tib,             # Pool Size (TiB)
-                  str(frag_percent) + "%",   # Fragmentation Percent
-                  format_size,               # Disk Size
-                  frag,                      # Fragmentation Level
-                  test["cpu"],               # CPU Stress
-                  test["disk"],              # Disk Stress
-                  resilver_status[1],        # Resilver Time
-                  resilver_time_seconds,     # Resilver Time (seconds)
-                  resilver_time_minutes,     # Resilver Time (minutes)
-                  afr_array_1x[0],           # Pool AFR at 1% disk AFR
-                  afr_array_1x[1],           # Pool AFR at 2% disk AFR
-                  afr_array_1x[2],           # Pool AFR at 3% disk AFR
-                  afr_array_1x[3],           # Pool AFR at 4% disk AFR
-                  afr_array_1x[4],           # Pool AFR at 5% disk AFR
-                  afr_array_1x[5],           # Pool AFR at 6% disk AFR
-                  afr_array_1x[6],           # Pool AFR at 7% disk AFR
-                  afr_array_1x[7],           # Pool AFR at 8% disk AFR
-                  afr_array_1x[8],           # Pool AFR at 9% disk AFR
-                  afr_array_1x[9],           # Pool AFR at 10% disk AFR
-                  afr_array_100x[0],         # Pool AFR at 1% disk AFR (100x resilver time)
-                  afr_array_100x[1],         # Pool AFR at 2% disk AFR (100x resilver time)
-                  afr_array_100x[2],         # Pool AFR at 3% disk AFR (100x resilver time)
-                  afr_array_100x[3],         # Pool AFR at 4% disk AFR (100x resilver time)
-                  afr_array_100x[4],         # Pool AFR at 5% disk AFR (100x resilver time)
-                  afr_array_100x[5],         # Pool AFR at 6% disk AFR (100x resilver time)
-                  afr_array_100x[6],         # Pool AFR at 7% disk AFR (100x resilver time)
-                  afr_array_100x[7],         # Pool AFR at 8% disk AFR (100x resilver time)
-                  afr_array_100x[8],         # Pool AFR at 9% disk AFR (100x resilver time)
-                  afr_array_100x[9],         # Pool AFR at 10% disk AFR (100x resilver time)
-                  resilver_status[2],        # Scanned
-                  scan_speed_avg,            # Scan Speed (M/s)
-                  resilver_status[3],        # Issued
-                  issue_speed_avg,           # Issue Speed (M/s)
-                  fill_speed                 # Fill Speed
-               ])
-               f.flush()
-
-               # Online target disk; data hasn't changed to resilvering should happen in <1 second
-               online_disk(target_disk)
-
-               # Sleep for 30 seconds between tests
-               log.info("Sleeping 30 seconds to let pool recover...")
-               time.sleep(30)
-
-            # Reset starting_test test schedule to 0 otherwise those tests will be skipped on the next run
+
+               resilver_status = get_resilver_status(offline_time,replaced)
+               if resilver_status.state == "resilvering":
+                  last_progress = resilver_status
+
+            # Once ZFS starts the scrub that follows a sequential rebuild, pool status shows the scrub instead of the rebuild,
+            # so the rebuild is timed from its zpool events
+            if resilver_status.state != "complete" and resilver_events.finished.is_set():
+               resilver_status = last_progress._replace(state="complete",start_time=resilver_events.start_time,
+                  end_time=resilver_events.end_time,resilver_time=round((resilver_events.end_time - resilver_events.start_time) * time_scale),
+                  resilvered=last_progress.resilvered if last_progress.resilvered != None else last_progress.issued or 0)
+               log.info("Rebuild no longer in pool status, timing it from zpool events (amounts are from the last status seen)")
+
+            if resilver_status.state != "complete":
+               raise Exception("Resilver did not complete (pool status: " + resilver_status.state + ")")
+            resilver_span.end()
+            set_metric("resilver_resilvering",0)
+            set_metric("resilver_percent_done",100)
+            observe_metric("resilver_duration_seconds",resilver_status.resilver_time)
+            
+            wait_time = time.time()
+            if wait_proc.poll() == None:
+               wait_proc.terminate()
+
+            # Calculate resilver time in seconds and minutes
+            resilver_time = sec_to_hms(resilver_status.resilver_time)
+            resilver_time_seconds = resilver_status.resilver_time
+            resilver_time_minutes = resilver_time_seconds/60
+
+            # Log resilver results
+            log.info("Resilver complete in " + resilver_time + " | " + str(round(resilver_status.resilvered/1024**3,2)) + "G resilvered")
+
+            # Measure resilver time from the zpool events timestamps, falling back to the offline and zpool wait times
+            # Scaled like the zpool status times, so sim runs report simulated seconds in every column
+            resilver_start_time = resilver_events.start_time if resilver_events.start_time != None else offline_time
+            resilver_end_time = resilver_events.end_time if resilver_events.end_time != None else wait_time
+            measured_resilver_seconds = round((resilver_end_time - resilver_start_time) * time_scale,3)
+            log.info("Measured resilver time: " + str(measured_resilver_seconds) + " seconds")
+
+            # Put the tunables back so the cooldown and the next test start from the defaults
+            restore_tunables()
+
+            fio_stats_sampler.stop()
+            disk_stats_sampler.stop()
+            cpu_stats_sampler.stop()
+            kstat_sampler.stop()
+            fio_file.close()
+            write_histogram_file(fio_stats_file.replace(".csv",".hist"),fio_stats_sampler.histograms)
+
+            # Terminate stress tests
+            if disk_stress_handle != 0:
+               disk_stress_handle.terminate()
+               log.info("Disk stress terminated")
+            if cpu_stress_handle != 0:
+               cpu_stress_handle.terminate()
+               log.info("CPU stress terminated")
+            read_monitor_handle.terminate()
+            write_monitor_handle.terminate()
+            stress_handles = [handle for handle in (disk_stress_handle,cpu_stress_handle,read_monitor_handle,write_monitor_handle) if handle != 0]
+            wait_ready("stress_exited",5,lambda: all(handle.poll() != None for handle in stress_handles))
+            log.info("Read and write latency monitoring terminated")
+
+            # Sequential rebuilds restore redundancy without checking block checksums, so ZFS scrubs the pool afterwards
+            verify_scrub_seconds = "-"
+            if rebuild in ("draid_spare","sequential"):
+               verify_scrub_seconds = wait_for_verify_scrub(resilver_events)
+            resilver_events.stop()
+
+            # Clean up scan and issue speed values if needed
+            if scan_speed_avg == 0: scan_speed_avg = "-"
+            if issue_speed_avg == 0: issue_speed_avg = "-"
+
+            # Get some extra data for the output sheet for the pool
+            vdev_type = layout["layout"].split(":")[0]
+            parity_level = get_parity_level(vdev_type, layout["width"])
+            num_vdevs = get_num_vdevs(vdev_type, layout["width"])
+            size_per_vdev = pool_size / num_vdevs
+
+            # Generate a concise layout description
+            if "draid" in layout["layout"]:
+               layout_description = layout["layout"]
+               draid_data_disks = layout["layout"].split(":")[1].split("d")[0]
+               draid_spare_disks = layout["layout"].split(":")[3].split("s")[0]
+               num_hot_spares = 0
+            elif "raidz" in layout["layout"]:
+               layout_description = str(layout["width"]) + "-wide " + layout["layout"]
+               draid_data_disks = "-"
+               draid_spare_disks = "-"
+               num_hot_spares = TOTAL_NUM_DISKS - (num_vdevs * layout["width"])
+            elif "mirror" in layout["layout"]:
+               layout_description = str(layout["width"]) + "-way mirror"
+               draid_data_disks = "-"
+               draid_spare_disks = "-"
+               num_hot_spares = TOTAL_NUM_DISKS - (num_vdevs * layout["width"])
+
+            # Calculate pool AFR for every disk AFR and resilver time multiplier
+            afr_values = get_pool_afr_table(layout["width"], parity_level, num_vdevs, resilver_time_seconds).tolist()
+
+            # Write results from this run to CSV
+            summary_row = [
+               test_index,                # Test Index
+               layout["layout"],          # Layout
+               vdev_type,                 # Vdev Type
+               layout["width"],           # Vdev Width
+               parity_level,              # Parity Level
+               num_vdevs,                 # Number of Vdevs
+               num_hot_spares,            # Number of Hot Spares
+               size_per_vdev,             # Size per Vdev
+               layout_description,        # Layout Description
+               draid_data_disks,          # dRAID Data Disks
+               draid_spare_disks,         # dRAID Spare Disks
+               recordsize,                # Recordsize
+               str(fill_percent) + "%",   # Target Fill Percent
+               round(used_percent - fill_percent,2), # Fill Error (percent)
+               used,                      # Used (bytes)
+               used_tib,                  # Used (TiB)
+               avail,                     # Available (bytes)
+               avail_tib,                 # Available (TiB)
+               str(used_percent) + "%",   # Used Percent
+               pool_size,                 # Pool Size (bytes)
+               pool_size_tib,             # Pool Size (TiB)
+               str(frag_percent) + "%",   # Fragmentation Percent
+               format_size,               # Disk Size
+               frag,                      # Fragmentation Level
+               test["cpu"],               # CPU Stress
+               test["disk"],              # Disk Stress
+               tunables_position,         # Tunables Index
+               applied_tunables,          # Tunables (as read back from the module)
+               rebuild,                   # Rebuild Mode
+               resilver_time,             # Resilver Time
+               resilver_time_seconds,     # Resilver Time (seconds)
+               measured_resilver_seconds, # Measured Resilver Time (seconds)
+               verify_scrub_seconds,      # Post-rebuild Verification Scrub Time (seconds)
+               resilver_time_minutes,     # Resilver Time (minutes)
+            ] + afr_values + [
+               resilver_status.scanned,   # Scanned (bytes)
+               scan_speed_avg,            # Scan Speed (M/s)
+               resilver_status.issued,    # Issued (bytes)
+               issue_speed_avg,           # Issue Speed (M/s)
+               fill_speed,                # Fill Speed
+               restore_time,              # Golden Image Restore Time (seconds)
+               restore_bytes,             # Golden Image Restore Size (bytes)
+               contention_ratio,          # Concurrent/solo disk group bandwidth ratio
+               baseline_seconds,          # Baseline length (seconds)
+               int(baseline_steady),      # Whether the workloads were steady when the baseline ended
+            ] + [
+               round(variation,4) if variation != None else "-" for variation in baseline_variation.values()
+            ] + get_latency_values(fio_stats_sampler.histograms)
+            results.writerow(summary_row)
+            f.flush()
+
+            # Add the summary row and this test's time series to the columnar results store
+            if results_store != "" and pyarrow != None:
+               partition = {"layout": layouts.index(layout),"frag": frag,"recordsize": recordsize,"test": test_position,
+                  "tunables": tunables_position}
+               store_test_results(partition,summary_row,fio_stats_file,fio_stats_file.replace(".csv",".diskstats"),
+                  fio_stats_file.replace(".csv",".cpustats"),fio_stats_file.replace(".csv",".kstats"))
+            journal("test_finished",test=test_index,resilver_seconds=resilver_time_seconds)
+            add_metric("resilver_tests_finished",1)
+            pool_dirty = True
+
+            # Bring the target disk back; data hasn't changed so resilvering should happen in <1 second
+            cooldown_span = TraceSpan("cooldown")
+            end_rebuild(target_disk,rebuild)
+
+            # Let the pool recover before the next test: wait for the resilver of the onlined disk to finish and the disks to go idle
+            # The resilver is scheduled in the next txg, so sync first to make sure zpool wait sees it
+            log.info("Waiting for pool to recover...")
+            wait_ready("txg_synced",0,pool_synced)
+            wait_ready("resilver_finished",30,resilver_finished)
+            if rebuild == "draid_spare":
+               detach_distributed_spares()
+            wait_ready("pool_idle",0,PoolIdleProbe())
+            cooldown_span.end()
+            test_span.end()
+
+         # Reset starting_test test and tunables schedules to 0 otherwise those tests will be skipped on the next run
+         starting_test[3] = 0
+         starting_test[4] = 0
+      
+      # Reset starting_test recordsize schedule to 0 otherwise those tests will be skipped on the next run
+      starting_test[2] = 0
+
+      # If skipping pool fill, reset it after completed set of tests
+      skip_pool_fill = False
+
+   # Reset starting_test frag schedule 0 otherwise those tests will be skipped on the next run
+   starting_test[1] = 0
+
+# Kill running instances of fio and return the number of processes killed
+# When running concurrent pools, only fio processes started by this worker are killed so the other pools are left alone
+def kill_fio(sig=signal.SIGKILL):
+   if disk_group == None:
+      try:
+         killed = run_command(["pkill","-e","-" + str(int(sig)),"fio"])
+         return len(killed.splitlines())
+      except:
+         return 0
+
+   num_killed = 0
+   for child in psutil.Process().children(recursive=True):
+      try:
+         if child.name() == "fio":
+            child.send_signal(sig)
+            num_killed += 1
+      except psutil.NoSuchProcess:
+         pass
+   return num_killed
+
+# Passes result rows from a concurrent pool worker back to the main process, which owns the results CSV
+class QueueWriter:
+   def __init__(self,results_queue):
+      self.results_queue = results_queue
+
+   def writerow(self,row):
+      self.results_queue.put(row)
+
+# Split the disks into groups and test layouts on each group in parallel, one pool and worker process per group
+# Returns the indices of layouts that are too wide for a disk group so they can be run on the full shelf afterwards
+def run_concurrent(layouts,layout_index,results,overall_start_time,total_tests):
+   global log
+   global f
+
+   # Split the disks into equally sized groups; leftover disks are left out of every group
+   disk_list = sorted(get_disk_list())
+   group_size = math.floor(len(disk_list)/concurrent_pools)
+   disk_groups = [disk_list[group*group_size:(group+1)*group_size] for group in range(concurrent_pools)]
+
+   # Only layouts that fit within a group (vdev width plus minimum spares) can run concurrently
+   concurrent_layouts = []
+   deferred_layouts = []
+   for index in range(layout_index,len(layouts)):
+      if layouts[index]["width"] + layouts[index]["minspares"] <= group_size:
+         concurrent_layouts.append(index)
+      else:
+         deferred_layouts.append(index)
+   if concurrent_layouts == []:
+      return deferred_layouts
+
+   # Check that the HBA and backplane can feed every group at once; if not, results would not be comparable
+   solo_bw = []
+   for group in disk_groups:
+      solo_bw.append(measure_group_bandwidth([group])[0])
+   concurrent_bw = measure_group_bandwidth(disk_groups)
+   ratios = []
+   for group in range(concurrent_pools):
+      ratios.append(round(concurrent_bw[group]/max(solo_bw[group],1),3))
+      log.info("Disk group " + str(group) + ": " + str(round(solo_bw[group]/1024,1)) + " MiB/s solo, " + \
+         str(round(concurrent_bw[group]/1024,1)) + " MiB/s concurrent (" + str(ratios[group]) + ")")
+   if min(ratios) < contention_threshold:
+      log.info("Bandwidth contention detected between disk groups (" + str(min(ratios)) + " < " + str(contention_threshold) + \
+         "), running layouts sequentially")
+      return list(range(layout_index,len(layouts)))
+
+   log.info("Running " + str(len(concurrent_layouts)) + " layouts on " + str(concurrent_pools) + " concurrent pools of " + \
+      str(group_size) + " disks")
+
+   # Workers are forked so they inherit this process's settings and state (log, results file, tunables, journal progress)
+   # Spawned or forkserver workers would re-import this script with its default settings, so fork is always used
+   fork_context = multiprocessing.get_context("fork")
+
+   # Workers pull layouts from a shared queue and send result rows back to this process
+   layout_queue = fork_context.Queue()
+   for index in concurrent_layouts:
+      layout_queue.put(index)
+   results_queue = fork_context.Queue()
+
+   # Flush the results file so forked workers don't inherit (and later rewrite) buffered rows
+   f.flush()
+   workers = []
+   for group in range(concurrent_pools):
+      worker = fork_context.Process(target=pool_worker,args=(group,disk_groups[group],ratios[group],layouts,layout_index,
+         layout_queue,results_queue,overall_start_time,total_tests))
+      worker.start()
+      workers.append(worker)
+
+   # Write result rows as they arrive until every worker has exited and the queue is drained
+   # If this process is interrupted, the workers are sent SIGTERM so they stop their own child processes and exit
+   try:
+      while True:
+         try:
+            results.writerow(results_queue.get(timeout=1))
+            f.flush()
+         except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+               break
+   finally:
+      for worker in workers:
+         if worker.is_alive():
+            worker.terminate()
+
+   for worker in workers:
+      worker.join()
+      if worker.exitcode != 0:
+         log.info("Pool worker " + worker.name + " exited with code " + str(worker.exitcode))
+
+   return deferred_layouts
+
+# Worker process for a single concurrent pool
+# Runs layouts from the shared queue on its own disk group, pool, and target disk
+def pool_worker(group,disks,ratio,layouts,layout_index,layout_queue,results_queue,overall_start_time,total_tests):
+   global log
+   global pool_name
+   global target_disk
+   global disk_group
+   global contention_ratio
+   global starting_test
+   global TOTAL_NUM_DISKS
+   global child_procs
+
+   pool_name = pool_name + str(group)
+   disk_group = disks
+
+   # Child processes of the main process are its to stop, not this worker's
+   child_procs = []
+   target_disk = disks[0].replace("/dev/","")
+   contention_ratio = ratio
+   TOTAL_NUM_DISKS = len(disks)
+
+   # Tag log lines with the pool name so interleaved output from the workers can be told apart
+   for handler in log.handlers:
+      handler.setFormatter(logging.Formatter("%(asctime)s [" + pool_name + "] %(message)s",datefmt="%Y-%m-%d %H:%M:%S"))
+
+   # The main process keeps serving its own metrics; each worker serves its pool's on the next ports up
+   if metrics_port != 0:
+      start_metrics(metrics_port + 1 + group)
+      set_metric("resilver_tests_total",total_tests)
+
+   results = QueueWriter(results_queue)
+   try:
+      while True:
+         try:
+            index = layout_queue.get(timeout=1)
+         except queue.Empty:
+            break
+
+         # Resume offsets in starting_test only apply to the first layout of the campaign
+         if index != layout_index:
+            starting_test[1] = 0
+            starting_test[2] = 0
             starting_test[3] = 0
-         
-         # Reset starting_test recordsize schedule to 0 otherwise those tests will be skipped on the next run
-         starting_test[2] = 0
+            starting_test[4] = 0
 
-         # If skipping pool fill, reset it after completed set of tests
-         skip_pool_fill = False
+         run_layout(layouts,layouts[index],results,overall_start_time,total_tests)
 
-      # Reset starting_test frag schedule 0 otherwise those tests will be skipped on the next run
-      starting_test[1] = 0
+      destroy_pool()
+      log_probe_summary()
+      log_command_summary()
+   finally:
+      stop_processes()
+
+# Measure sequential read bandwidth (KiB/s) of each disk group with all groups reading at the same time
+# Reads are done with --readonly against the raw devices so pool contents are never touched
+def measure_group_bandwidth(groups):
+   global fio_key
 
-   # Log completion time
-   log.info("All tests completed in " + sec_to_dhms(time.time() - overall_start_time))
+   procs = []
+   for group in groups:
+      cmd = ["fio","--readonly","--rw=read","--ioengine=io_uring","--direct=1","--bs=1Mi","--runtime=15","--time_based=1",
+         "--group_reporting","--output-format=terse"]
+      for disk in group:
+         cmd += ["--name=" + disk.replace("/dev/",""),"--filename=" + disk]
+      procs.append(start_process(cmd,stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,text=True))
 
-   # Close output file after all tests completed
-   f.close()
+   bandwidth = []
+   for proc in procs:
+      out = proc.communicate()[0].strip().splitlines()[-1].split(";")
+      bandwidth.append(float(out[fio_key.index("read_bandwidth_kb")]))
+   return bandwidth
 
 # Set up the CSV file with headers
 def set_up_csv(f):
    results = csv.writer(f)
-   results.writerow([
-      "TestIndex",
-      "Layout",
-      "VdevType",
-      "VdevWidth",
-      "ParityLevel",
-      "NumVdevs",
-      "NumHotSpares",
-      "SizePerVdev",
-      "LayoutDescription",
-      "dRAIDDataDisks",
-      "dRAIDSpareDisks",
-      "RecordSize",
-      "TargetFillPercent",
-      "UsedBytes",
-      "UsedTiB",
-      "AvailableBytes",
-      "AvailableTiB",
-      "UsedPercent",
-      "PoolSizeBytes",
-      "PoolSizeTiB",
-      "FragPercent",
-      "DiskSize",
-      "FragLevel",
-      "CPUStress",
-      "DiskStress",
-      "ResilverTime",
-      "ResilverTimeSeconds",
-      "ResilverTimeMinutes",
-      "PoolAFR1percent",
-      "PoolAFR2percent",
-      "PoolAFR3percent",
-      "PoolAFR4percent",
-      "PoolAFR5percent",
-      "PoolAFR6percent",
-      "PoolAFR7percent",
-      "PoolAFR8percent",
-      "PoolAFR9percent",
-      "PoolAFR10percent",
-      "PoolAFR1percent100x",
-      "PoolAFR2percent100x",
-      "PoolAFR3percent100x",
-      "PoolAFR4percent100x",
-      "PoolAFR5percent100x",
-      "PoolAFR6percent100x",
-      "PoolAFR7percent100x",
-      "PoolAFR8percent100x",
-      "PoolAFR9percent100x",
-      "PoolAFR10percent100x",
-      "Scanned",
-      "ScanSpeedMBps",
-      "Issued",
-      "IssueSpeedMBps",
-      "FillSpeedGiBps"])
+   results.writerow(results_header)
    return results
 
+# Write a test's summary row, fio stats, and per-disk stats to the columnar results store
+# Each table is partitioned by layout, fragmentation level, recordsize, and test (e.g.,
+# results_store/fio/layout=3/frag=med/recordsize=1M/test=4/part-0.parquet) and every file written is appended to
+# results_store/manifest.jsonl, so readers can pick partitions and columns without opening the other files
+def store_test_results(partition,summary_row,fio_stats_file,diskstats_file,cpustats_file,kstats_file):
+   global log
+
+   try:
+      # Summary row: text columns stay as strings, everything else is a number ("-" and other placeholders become null)
+      summary = {}
+      for column, value in zip(results_header,summary_row):
+         if column in results_text_columns:
+            summary[column] = pyarrow.array([str(value)],pyarrow.string())
+         else:
+            summary[column] = pyarrow.array([to_float(value)],pyarrow.float64())
+      write_store_table("summary",partition,pyarrow.table(summary))
+
+      # fio stats: the "Resilver Start" marker row becomes a phase column
+      with open(fio_stats_file) as fio_file:
+         fio_rows = list(csv.reader(fio_file))
+      fio_header = fio_rows[0]
+      fio_columns = {column: [] for column in fio_header}
+      phases = []
+      phase = "baseline"
+      for row in fio_rows[1:]:
+         if row == ["Resilver Start"]:
+            phase = "resilver"
+            continue
+         for column, value in zip(fio_header,row):
+            fio_columns[column].append(to_float(value))
+         phases.append(phase)
+      fio_table = {"Phase": pyarrow.array(phases,pyarrow.string())}
+      for column in fio_header:
+         fio_table[column] = pyarrow.array(fio_columns[column],pyarrow.float64())
+      write_store_table("fio",partition,pyarrow.table(fio_table))
+
+      # Per-disk stats in long format: one row per sample per disk
+      if os.path.isfile(diskstats_file):
+         header, times, values = read_diskstats_file(diskstats_file)
+         num_disks = len(header["disks"])
+         disk_table = {
+            "Timestamp": pyarrow.array([t for t in times for disk in range(num_disks)],pyarrow.float64()),
+            "Disk": pyarrow.array(header["disks"] * len(times),pyarrow.string())}
+         for metric in header["metrics"]:
+            disk_table[metric] = pyarrow.array([value for sample in values[metric] for value in sample],pyarrow.float32())
+         write_store_table("diskstats",partition,pyarrow.table(disk_table))
+
+      # Per-core and per-taskq CPU stats in long format: one row per sample per core or taskq
+      if os.path.isfile(cpustats_file):
+         header, times, cpu_values, taskq_values = read_cpustats_file(cpustats_file)
+         for table_name, column, names, values in (("cpustats","CPU",header["cpus"],cpu_values),("zfsthreads","Taskq",header["taskqs"],taskq_values)):
+            table = {
+               "Timestamp": pyarrow.array([t for t in times for name in names],pyarrow.float64()),
+               column: pyarrow.array(names * len(times),pyarrow.string())}
+            for metric in values:
+               table[metric] = pyarrow.array([value for sample in values[metric] for value in sample],pyarrow.float32())
+            write_store_table(table_name,partition,pyarrow.table(table))
+
+      # ZFS kstats: one row per sample, one column per kstat value
+      if os.path.isfile(kstats_file):
+         header, times, values = read_kstats_file(kstats_file)
+         kstat_table = {"Timestamp": pyarrow.array(times,pyarrow.float64())}
+         for column in header["columns"]:
+            kstat_table[column] = pyarrow.array(values[column],pyarrow.float64())
+         write_store_table("kstats",partition,pyarrow.table(kstat_table))
+   except Exception as e:
+      log.info("Could not write results store: " + str(e))
+
+# Write one partition file to the results store and record it in the manifest
+def write_store_table(table_name,partition,table):
+   path = os.path.join(results_store,table_name,*[key + "=" + str(value) for key, value in partition.items()])
+   os.makedirs(path,exist_ok=True)
+   path = os.path.join(path,"part-0.parquet")
+   pyarrow.parquet.write_table(table,path,compression="zstd")
+
+   # Single appended lines are atomic, so concurrent pool workers can share the manifest
+   entry = {"table": table_name,"path": path,"rows": table.num_rows,"columns": table.column_names,"written": round(time.time(),3)}
+   entry.update(partition)
+   with open(os.path.join(results_store,"manifest.jsonl"),"a") as manifest:
+      manifest.write(json.dumps(entry) + "\n")
+
+# Load a table from the results store, reading only the partitions that match the filters and the requested columns
+# e.g., load_results("summary",columns=["Layout","ResilverTimeSeconds"],frag="high")
+# Files are memory-mapped; re-run tests only keep the most recently written partition
+def load_results(table_name,columns=None,store=None,**filters):
+   store = store or results_store
+   entries = {}
+   with open(os.path.join(store,"manifest.jsonl")) as manifest:
+      for line in manifest:
+         entry = json.loads(line)
+         if entry["table"] == table_name and all(key in entry and str(entry[key]) == str(value) for key, value in filters.items()):
+            entries[entry["path"]] = entry
+
+   tables = []
+   for entry in entries.values():
+      table = pyarrow.parquet.read_table(entry["path"],columns=columns,memory_map=True)
+      # Add the partition keys so rows from different partitions can be told apart
+      # Partitions written before a key was added (e.g., tunables) get nulls for it
+      for key in ("layout","frag","recordsize","test","tunables"):
+         if key not in table.column_names:
+            value = str(entry[key]) if key in entry else None
+            table = table.append_column(key,pyarrow.array([value] * table.num_rows,pyarrow.string()))
+      tables.append(table)
+   return pyarrow.concat_tables(tables)
+
+# Export a table from the results store to CSV
+def export_results_csv(table_name,path,store=None,**filters):
+   pyarrow.csv.write_csv(load_results(table_name,store=store,**filters),path)
+
+# Convert a results value to a float, or None if it isn't a number (e.g., "-")
+def to_float(value):
+   try:
+      return float(value)
+   except (TypeError, ValueError):
+      return None
+
+# Write one row of fio and CPU stats covering the time since the previous row
+# fio output is read by a FioStream thread for each process, so this never blocks on a fio pipe
 def get_fio_stats(
       disk_stress_handle,
       read_monitor_handle,
       write_monitor_handle,
-      fio_stats,
-      psutil_interval,
-      num_read_latency_samples,
-      read_lat_mean,
-      num_write_latency_samples_mon,
-      write_lat_mean_mon,
-      num_write_latency_samples_stress,
-      write_lat_mean_stress):
-   global fio_key
+      fio_stats):
 
-   # Gather CPU stats
-   cpu_info_before_resilver = psutil.cpu_times_percent(interval=psutil_interval)
+   # Gather CPU stats; without an interval, psutil reports utilization since its previous call (the previous row)
+   cpu_info_before_resilver = psutil.cpu_times_percent(interval=None)
    cpu_user = cpu_info_before_resilver.user
    cpu_system = cpu_info_before_resilver.system
 
-   # Gather write latency stats from the write_monitor process
-   # Latency presented by FIO is an average over the full run. We need to calculate the average latency per sample
-   out = write_monitor_handle.stdout.readline().strip().split(";")
-   write_iops_mon = out[fio_key.index("write_iops")]
-   write_bw_mon = out[fio_key.index("write_bw_mean_kb")]
-   write_lat_mean_old_mon = write_lat_mean_mon
-   write_lat_mean_mon = float(out[fio_key.index("write_lat_mean_us")])/1000
-   write_lat_mon = (num_write_latency_samples_mon * write_lat_mean_mon) - (write_lat_mean_old_mon * (num_write_latency_samples_mon - 1))
-
-   # Gather read latency stats from the read_monitor process
-   out = read_monitor_handle.stdout.readline().strip().split(";")
-   if "fio: opendir added" not in out[0]:
-      read_iops = out[fio_key.index("read_iops")]
-      read_bw = out[fio_key.index("read_bw_mean_kb")]
-      read_lat_mean_old = read_lat_mean
-      read_lat_mean = float(out[fio_key.index("read_lat_mean_us")])/1000
-      read_lat = (num_read_latency_samples * read_lat_mean) - (read_lat_mean_old * (num_read_latency_samples - 1))
-      num_read_latency_samples += 1
-   else:
-      read_iops = "0"
-      read_bw = "0"
-      read_lat = "0"
-
-   # If a disk stress test is running, gather write disk stats from it
+   # Gather write stats from the write_monitor process, read stats from the read_monitor process, and write stats from
+   # the disk stress process (if running). Streams that haven't reported since the last row are written as "-"
+   write_mon = write_monitor_handle.take()
+   read_mon = read_monitor_handle.take()
    if disk_stress_handle != 0:
-      out = disk_stress_handle.stdout.readline().strip().split(";")
-      write_iops_stress = out[fio_key.index("write_iops")]
-      write_bw_stress = float(out[fio_key.index("write_bw_mean_kb")])/1024
-      write_lat_mean_old_stress = write_lat_mean_stress
-      write_lat_mean_stress = float(out[fio_key.index("write_lat_mean_us")])/1000
-      write_lat_stress = (num_write_latency_samples_stress * write_lat_mean_stress) - (write_lat_mean_old_stress * (num_write_latency_samples_stress - 1))
-      num_write_latency_samples_stress += 1
+      write_stress = disk_stress_handle.take()
    else:
-      write_iops_stress = "0"
-      write_bw_stress = "0"
-      write_lat_stress = "0"
+      write_stress = {"write": {"iops": 0, "bw": 0, "lat_mean": 0, "p50": 0, "p99": 0, "p999": 0}}
+
+   row = []
+   for stats, rw in ((write_mon,"write"),(write_stress,"write"),(read_mon,"read")):
+      if stats == None:
+         row += ["-","-","-"]
+      else:
+         row += [stats[rw]["iops"],stats[rw]["bw"],stats[rw]["lat_mean"]]
+
+   # Update live metrics; the disk stress stand-in used when there's no disk stress has no latency histogram
+   set_metric("resilver_cpu_percent",cpu_user,mode="user")
+   set_metric("resilver_cpu_percent",cpu_system,mode="system")
+   for stats, rw, monitor in ((write_mon,"write","write"),(write_stress,"write","stress"),(read_mon,"read","read")):
+      if stats != None:
+         set_metric("resilver_monitor_iops",stats[rw]["iops"],monitor=monitor)
+         set_metric("resilver_monitor_bandwidth_mibps",stats[rw]["bw"],monitor=monitor)
+         if "bins" in stats[rw]:
+            observe_metric_bins("resilver_monitor_latency_seconds",stats[rw]["bins"],monitor=monitor)
+   row += [cpu_user,cpu_system,round(time.time(),3)]
+   for stats, rw in ((write_mon,"write"),(write_stress,"write"),(read_mon,"read")):
+      if stats == None:
+         row += ["-","-","-"]
+      else:
+         row += [stats[rw]["p50"],stats[rw]["p99"],stats[rw]["p999"]]
    
-   fio_stats.writerow([write_iops_mon,write_bw_mon,write_lat_mon,write_iops_stress,write_bw_stress,write_lat_stress,read_iops,read_bw,read_lat,cpu_user,cpu_system])
+   fio_stats.writerow(row)
+   return write_mon, write_stress, read_mon
+
+# Writes a row of fio and CPU stats to a test's fio stats CSV every fio_stats_interval seconds on a background thread
+# Rows are scheduled against the monotonic clock and timestamped when they are sampled, so the interval doesn't drift with
+# the time the test loop spends waiting on zpool commands
+class FioStatsSampler:
+   def __init__(self,fio_file,fio_stats,disk_stress_handle,read_monitor_handle,write_monitor_handle):
+      self.fio_file = fio_file
+      self.fio_stats = fio_stats
+      self.handles = (disk_stress_handle,read_monitor_handle,write_monitor_handle)
+
+      # Rows and event markers are written from different threads
+      self.lock = threading.Lock()
+
+      # Latest reported values of the metrics the baseline steady-state check looks at
+      # A monitor that hasn't reported since the previous row (fio's status interval isn't aligned with ours) adds nothing
+      self.recent = {metric: collections.deque(maxlen=baseline_window) for metric in ("write_latency","read_latency","stress_iops")}
+
+      # Latency histograms of every I/O each monitor completes, one per test phase ("write/baseline", "read/resilver", ...)
+      self.phase = latency_histogram_phases[0]
+      self.histograms = {monitor + "/" + phase: LatencyHistogram() for monitor in latency_histogram_monitors for phase in latency_histogram_phases}
+
+      # Start CPU utilization from now rather than from the previous test
+      psutil.cpu_times_percent(interval=None)
+
+      self.stop_event = threading.Event()
+      self.thread = threading.Thread(target=self.run,daemon=True)
+      self.thread.start()
+
+   def run(self):
+      interval = fio_stats_interval/time_scale
+      next_sample = time.monotonic() + interval
+      while not self.stop_event.wait(max(next_sample - time.monotonic(),0)):
+         self.sample()
+         next_sample += interval
+         # If sampling fell behind (e.g., the system stalled), skip ahead instead of sampling in a burst
+         if next_sample < time.monotonic():
+            next_sample = time.monotonic() + interval
+
+   def sample(self):
+      with self.lock:
+         write_mon, write_stress, read_mon = get_fio_stats(*self.handles,self.fio_stats)
+         self.fio_file.flush()
+         for metric, stats, rw, value in (("write_latency",write_mon,"write","lat_mean"),("read_latency",read_mon,"read","lat_mean"),
+            ("stress_iops",write_stress,"write","iops")):
+            if stats != None:
+               self.recent[metric].append(stats[rw][value])
+         # The disk stress stand-in used when there's no disk stress has no latency histogram
+         for monitor, stats, rw in (("write",write_mon,"write"),("stress",write_stress,"write"),("read",read_mon,"read")):
+            if stats != None and "bins" in stats[rw]:
+               self.histograms[monitor + "/" + self.phase].add_bins(stats[rw]["bins"])
+
+   # Returns the coefficient of variation (standard deviation/mean) of each steady-state metric over its last
+   # baseline_window reported values, or None until it has reported that many
+   def get_variation(self):
+      variation = {}
+      for metric in self.recent:
+         with self.lock:
+            values = list(self.recent[metric])
+         if len(values) < baseline_window:
+            variation[metric] = None
+         else:
+            mean = numpy.mean(values)
+            variation[metric] = float(numpy.std(values)/mean) if mean > 0 else 0.0
+      return variation
+
+   # Write an event marker row (e.g., "Resilver Start") between samples
+   # If a phase is given, I/Os reported from now on go to that phase's latency histograms
+   def mark(self,event,phase=None):
+      with self.lock:
+         self.fio_stats.writerow([event])
+         self.fio_file.flush()
+         if phase != None:
+            self.phase = phase
+
+   # Stop sampling; a last row picks up the I/Os completed since the previous one so the histograms cover the whole phase
+   def stop(self):
+      self.stop_event.set()
+      self.thread.join()
+      self.sample()
+
+# Wait until the stress and monitor workloads reach a steady state: at least baseline_min seconds, and until monitor
+# latency and stress IOPS all vary by less than baseline_cv over their last baseline_window reported values, but no longer
+# than baseline_max seconds
+# Returns the baseline length (seconds), whether the workloads were steady, and the variation of each metric
+def wait_for_baseline(fio_stats_sampler):
+   global log
+
+   start = time.monotonic()
+   while True:
+      pause(fio_stats_interval)
+      elapsed = (time.monotonic() - start) * time_scale
+      variation = fio_stats_sampler.get_variation()
+      steady = all(value != None and value < baseline_cv for value in variation.values())
+      if (steady and elapsed >= baseline_min) or elapsed >= baseline_max:
+         break
+
+   log.info("Baseline " + ("steady" if steady else "not steady") + " after " + str(round(elapsed)) + " seconds (variation: " + \
+      ", ".join(metric + " " + (str(round(value,3)) if value != None else "-") for metric, value in variation.items()) + ")")
+   return round(elapsed,1), steady, variation
+
+# Reads interval stats from a running fio process (--output-format=json+ --status-interval=5) on a background thread
+# fio reports cumulative totals, so each report is turned into the change since the previous one (I/Os, bytes, runtime,
+# total latency, and completion latency histogram) and kept as a timestamped sample in a ring buffer
+class FioStream:
+   def __init__(self,proc):
+      self.proc = proc
+      self.stdout = proc.stdout
+      self.samples = collections.deque(maxlen=fio_ring_size)
+      self.unread = collections.deque(maxlen=fio_ring_size)
+      self.thread = threading.Thread(target=self.read_stream,daemon=True)
+      self.thread.start()
+
+   def read_stream(self):
+      previous = None
+      lines = []
+      for line in self.stdout:
+         # Each status interval is a complete JSON document; warnings like "fio: opendir added" are printed outside them
+         if line.startswith("{"):
+            lines = []
+         lines.append(line)
+         if line.rstrip() != "}":
+            continue
+         try:
+            current = get_fio_totals(json.loads("".join(lines)))
+         except (ValueError, KeyError, IndexError):
+            continue
+
+         sample = {"time": current["time"]}
+         for rw in ("read","write"):
+            sample[rw] = get_fio_delta(previous[rw] if previous != None else None,current[rw])
+         self.samples.append(sample)
+         self.unread.append(sample)
+         previous = current
+
+   # Returns the stats for every interval reported since the previous call, or None if nothing new has been reported
+   def take(self):
+      samples = []
+      while True:
+         try:
+            samples.append(self.unread.popleft())
+         except IndexError:
+            break
+      if samples == []:
+         return None
+      return summarize_fio_samples(samples)
+
+   def terminate(self):
+      self.proc.terminate()
+
+   def poll(self):
+      return self.proc.poll()
+
+# Start a fio process with json+ status output and wrap it in a FioStream
+def start_fio_stream(cmd):
+   proc = start_process(shlex.split(cmd),stdout=subprocess.PIPE,text=True)
+   return FioStream(proc)
+
+# Pull the cumulative totals out of a fio json+ report
+def get_fio_totals(report):
+   job = report["jobs"][0]
+   totals = {"time": report["timestamp_ms"]/1000}
+   for rw in ("read","write"):
+      stats = job[rw]
+      totals[rw] = {
+         "ios": stats["total_ios"],
+         "bytes": stats["io_bytes"],
+         "runtime": stats["runtime"],
+         "lat_sum": stats["lat_ns"]["mean"] * stats["lat_ns"].get("N",stats["total_ios"]),
+         "bins": {int(value): count for value, count in stats["clat_ns"].get("bins",{}).items()}}
+   return totals
+
+# Difference between two sets of cumulative fio totals (previous is None for the first report)
+def get_fio_delta(previous,current):
+   if previous == None:
+      return dict(current)
+   bins = {}
+   for value, count in current["bins"].items():
+      count -= previous["bins"].get(value,0)
+      if count > 0:
+         bins[value] = count
+   return {
+      "ios": current["ios"] - previous["ios"],
+      "bytes": current["bytes"] - previous["bytes"],
+      "runtime": current["runtime"] - previous["runtime"],
+      "lat_sum": current["lat_sum"] - previous["lat_sum"],
+      "bins": bins}
+
+# Combine fio interval samples into IOPS, bandwidth (MiB/s), mean latency and latency percentiles (mSec)
+def summarize_fio_samples(samples):
+   summary = {"time": samples[-1]["time"]}
+   for rw in ("read","write"):
+      ios = sum(sample[rw]["ios"] for sample in samples)
+      io_bytes = sum(sample[rw]["bytes"] for sample in samples)
+      runtime = sum(sample[rw]["runtime"] for sample in samples)/1000
+      lat_sum = sum(sample[rw]["lat_sum"] for sample in samples)
+      bins = collections.Counter()
+      for sample in samples:
+         bins.update(sample[rw]["bins"])
+      summary[rw] = {
+         "iops": round(ios/runtime,2) if runtime > 0 else 0,
+         "bw": round(io_bytes/1024**2/runtime,2) if runtime > 0 else 0,
+         "lat_mean": round(lat_sum/ios/1000**2,3) if ios > 0 else 0,
+         "p50": get_percentile(bins,50),
+         "p99": get_percentile(bins,99),
+         "p999": get_percentile(bins,99.9),
+         "bins": bins}
+   return summary
+
+# Latency (mSec) at the given percentile of a fio latency histogram ({latency in ns: count})
+def get_percentile(bins,percentile):
+   total = sum(bins.values())
+   if total == 0:
+      return 0
+   threshold = total * percentile/100
+   count = 0
+   for value in sorted(bins):
+      count += bins[value]
+      if count >= threshold:
+         return round(value/1000**2,3)
+
+# Serves live campaign and resilver progress in the Prometheus text format (or OpenMetrics, if the scraper asks for it)
+# The test, fill, and sampling loops update values with set(), add(), and observe(), which only hold a lock long enough
+# to update a dict, so a slow scrape never holds them up; the HTTP server runs on its own daemon thread
+class MetricsExporter:
+   # Histogram bucket upper bounds (seconds)
+   buckets = {
+      "resilver_duration_seconds": (60,300,600,1800,3600,7200,14400,28800,57600,86400,172800,345600),
+      "resilver_monitor_latency_seconds": (0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5)}
+
+   def __init__(self,port):
+      self.lock = threading.Lock()
+      self.values = {}        # Metric name: {labels: value} for gauges, {labels: [bucket counts, sum, count]} for histograms
+      exporter = self
+
+      class Handler(http.server.BaseHTTPRequestHandler):
+         def do_GET(self):
+            if self.path.split("?")[0] not in ("/","/metrics"):
+               self.send_error(404)
+               return
+            openmetrics = "application/openmetrics-text" in self.headers.get("Accept","")
+            body = exporter.render(openmetrics).encode("utf-8")
+            self.send_response(200)
+            if openmetrics:
+               self.send_header("Content-Type","application/openmetrics-text; version=1.0.0; charset=utf-8")
+            else:
+               self.send_header("Content-Type","text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length",str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+         # Scrapes would otherwise be printed to stderr
+         def log_message(self,format,*args):
+            pass
+
+      self.server = http.server.ThreadingHTTPServer(("",port),Handler)
+      self.server.daemon_threads = True
+      self.thread = threading.Thread(target=self.server.serve_forever,daemon=True)
+      self.thread.start()
+
+   # Labels are stored as a sorted tuple of (name, value) pairs so they can be used as a dict key
+   def key(self,labels):
+      labels["pool"] = pool_name
+      return tuple(sorted(labels.items()))
+
+   # Set a gauge; replace=True drops every other label set of the metric (e.g., for the info metric of the running test)
+   def set(self,name,value,replace=False,**labels):
+      with self.lock:
+         if replace or name not in self.values:
+            self.values[name] = {}
+         self.values[name][self.key(labels)] = value
+
+   def add(self,name,value,**labels):
+      with self.lock:
+         series = self.values.setdefault(name,{})
+         key = self.key(labels)
+         series[key] = series.get(key,0) + value
+
+   # Add count observations of value (seconds) to a histogram
+   def observe(self,name,value,count=1,**labels):
+      with self.lock:
+         series = self.values.setdefault(name,{})
+         key = self.key(labels)
+         if key not in series:
+            series[key] = [[0] * len(self.buckets[name]),0,0]
+         histogram = series[key]
+         for i, bound in enumerate(self.buckets[name]):
+            if value <= bound:
+               histogram[0][i] += count
+         histogram[1] += value * count
+         histogram[2] += count
+
+   def render(self,openmetrics):
+      lines = []
+      with self.lock:
+         for name, series in self.values.items():
+            metric_type, help_text = metrics_help[name]
+            lines.append("# HELP " + name + " " + help_text)
+            lines.append("# TYPE " + name + " " + metric_type)
+            for key, value in series.items():
+               if metric_type == "histogram":
+                  for bound, count in zip(self.buckets[name],value[0]):
+                     lines.append(name + "_bucket" + format_labels(key + (("le",str(bound)),)) + " " + str(count))
+                  lines.append(name + "_bucket" + format_labels(key + (("le","+Inf"),)) + " " + str(value[2]))
+                  lines.append(name + "_sum" + format_labels(key) + " " + str(value[1]))
+                  lines.append(name + "_count" + format_labels(key) + " " + str(value[2]))
+               else:
+                  lines.append(name + format_labels(key) + " " + str(value))
+      if openmetrics:
+         lines.append("# EOF")
+      return "\n".join(lines) + "\n"
+
+   def stop(self):
+      self.server.shutdown()
+      self.server.server_close()
+
+# Format a metric's labels as {name="value",...}
+def format_labels(labels):
+   if labels == ():
+      return ""
+   return "{" + ",".join(name + "=\"" + str(value).replace("\\","\\\\").replace("\"","\\\"") + "\"" for name, value in labels) + "}"
+
+# Start the metrics endpoint for this process on the given port
+def start_metrics(port):
+   global log
+   global metrics
+
+   try:
+      metrics = MetricsExporter(port)
+      log.info("Serving metrics on port " + str(port))
+   except OSError as e:
+      metrics = None
+      log.info("Could not start metrics endpoint on port " + str(port) + " (" + str(e) + ")")
+
+# Update the metrics endpoint, if it's running
+def set_metric(name,value,replace=False,**labels):
+   if metrics != None:
+      metrics.set(name,value,replace,**labels)
+
+def add_metric(name,value,**labels):
+   if metrics != None:
+      metrics.add(name,value,**labels)
+
+def observe_metric(name,value,**labels):
+   if metrics != None:
+      metrics.observe(name,value,**labels)
+
+# Add a fio latency histogram ({latency in ns: count}) to a latency histogram metric
+def observe_metric_bins(name,bins,**labels):
+   if metrics != None:
+      for latency, count in bins.items():
+         metrics.observe(name,latency/1000**3,count,**labels)
+
+# Samples /proc/diskstats (diskstats_path) for the pool's disks every diskstats_interval seconds on a background thread
+# Writes per-disk read/write throughput (MiB/s), IOPS, utilization (%), and average queue depth to a compact binary file:
+#   A JSON header line with the disk names, metric names, and sampling interval, followed by blocks of up to
+#   diskstats_block_size samples. Each block is a sample count (uint32), the sample timestamps (float64), and then one
+#   column per metric (float32, sample-major with one value per disk). read_diskstats_file() reads it back.
+# Memory use is fixed at one block regardless of how long the resilver takes
+class DiskStatsSampler:
+   metrics = ("read_mibps","write_mibps","read_iops","write_iops","util","queue_depth")
+
+   def __init__(self,path,disks):
+      self.disks = [disk.replace("/dev/","") for disk in disks]
+      self.disk_index = {disk: i for i, disk in enumerate(self.disks)}
+      self.file = open(path,"wb")
+      header = {"disks": self.disks,"metrics": list(self.metrics),"interval": diskstats_interval}
+      self.file.write((json.dumps(header) + "\n").encode("utf-8"))
+
+      self.count = 0
+      self.times = array.array("d",[0.0] * diskstats_block_size)
+      self.values = {metric: array.array("f",[0.0] * (diskstats_block_size * len(self.disks))) for metric in self.metrics}
+
+      self.stop_event = threading.Event()
+      self.thread = threading.Thread(target=self.run,daemon=True)
+      self.thread.start()
+
+   def run(self):
+      previous = read_diskstats(self.disk_index)
+      previous_time = time.monotonic()
+      next_sample = previous_time + diskstats_interval
+
+      # Samples are scheduled against the monotonic clock so the interval doesn't drift
+      while not self.stop_event.wait(max(next_sample - time.monotonic(),0)):
+         current = read_diskstats(self.disk_index)
+         now = time.monotonic()
+         elapsed = now - previous_time
+         offset = self.count * len(self.disks)
+         for i in range(len(self.disks)):
+            reads, read_sectors, writes, write_sectors, io_ms, weighted_ms = [c - p for c, p in zip(current[i],previous[i])]
+            self.values["read_mibps"][offset + i] = read_sectors * 512/1024**2/elapsed
+            self.values["write_mibps"][offset + i] = write_sectors * 512/1024**2/elapsed
+            self.values["read_iops"][offset + i] = reads/elapsed
+            self.values["write_iops"][offset + i] = writes/elapsed
+            self.values["util"][offset + i] = min(io_ms/(elapsed * 10),100)
+            self.values["queue_depth"][offset + i] = weighted_ms/(elapsed * 1000)
+         self.times[self.count] = time.time()
+         self.count += 1
+         if self.count == diskstats_block_size:
+            self.write_block()
+
+         previous = current
+         previous_time = now
+         next_sample += diskstats_interval
+         # If sampling fell behind (e.g., the system stalled), skip ahead instead of sampling in a burst
+         if next_sample < now:
+            next_sample = now + diskstats_interval
+
+   def write_block(self):
+      self.file.write(struct.pack("<I",self.count))
+      self.file.write(self.times[:self.count].tobytes())
+      for metric in self.metrics:
+         self.file.write(self.values[metric][:self.count * len(self.disks)].tobytes())
+      self.count = 0
+
+   def stop(self):
+      self.stop_event.set()
+      self.thread.join()
+      if self.count > 0:
+         self.write_block()
+      self.file.close()
+
+# Read a file written by DiskStatsSampler
+# Returns the header, a list of sample timestamps, and {metric: [[value for each disk] for each sample]}
+def read_diskstats_file(path):
+   with open(path,"rb") as diskstats_file:
+      header = json.loads(diskstats_file.readline().decode("utf-8"))
+      num_disks = len(header["disks"])
+      times = []
+      values = {metric: [] for metric in header["metrics"]}
+      while True:
+         count_bytes = diskstats_file.read(4)
+         if len(count_bytes) < 4:
+            break
+         count = struct.unpack("<I",count_bytes)[0]
+         block_times = array.array("d")
+         block_times.frombytes(diskstats_file.read(count * 8))
+         times += block_times.tolist()
+         for metric in header["metrics"]:
+            column = array.array("f")
+            column.frombytes(diskstats_file.read(count * num_disks * 4))
+            for sample in range(count):
+               values[metric].append(column[sample * num_disks:(sample + 1) * num_disks].tolist())
+   return header, times, values
+
+# HDR-style latency histogram (ns): values below 2^(sub_bucket_bits + 1) are counted exactly, larger values in
+# 2^sub_bucket_bits linear sub-buckets per power of 2, so every value is recorded to within 1/2^sub_bucket_bits (1.6%)
+# Bucket boundaries are fixed, so histograms from different monitors, phases, and tests merge by adding their counts
+class LatencyHistogram:
+   sub_bucket_bits = 6
+
+   def __init__(self):
+      self.counts = collections.Counter()
+      self.max = 0
+
+   def bucket(self,value):
+      if value < 2 << self.sub_bucket_bits:
+         return value
+      shift = value.bit_length() - self.sub_bucket_bits - 1
+      return ((shift + 1) << self.sub_bucket_bits) + (value >> shift) - (1 << self.sub_bucket_bits)
+
+   # Midpoint of a bucket's range (ns)
+   def bucket_value(self,bucket):
+      if bucket < 2 << self.sub_bucket_bits:
+         return bucket
+      shift = (bucket >> self.sub_bucket_bits) - 1
+      lowest = ((bucket & ((1 << self.sub_bucket_bits) - 1)) + (1 << self.sub_bucket_bits)) << shift
+      return lowest + ((1 << shift) - 1)//2
+
+   def add(self,value,count=1):
+      value = int(value)
+      self.counts[self.bucket(value)] += count
+      self.max = max(self.max,value)
+
+   # Add a fio latency histogram ({latency in ns: count})
+   def add_bins(self,bins):
+      for value, count in bins.items():
+         self.add(value,count)
+
+   def merge(self,other):
+      self.counts.update(other.counts)
+      self.max = max(self.max,other.max)
+
+   def total(self):
+      return sum(self.counts.values())
+
+   # Latency (mSec) at the given percentile, or "-" if nothing was recorded
+   def percentile(self,percentile):
+      total = self.total()
+      if total == 0:
+         return "-"
+      threshold = total * percentile/100
+      count = 0
+      for bucket in sorted(self.counts):
+         count += self.counts[bucket]
+         if count >= threshold:
+            return round(min(self.bucket_value(bucket),self.max)/1000**2,3)
+
+   def max_ms(self):
+      return round(self.max/1000**2,3) if self.total() > 0 else "-"
+
+# Summary row values for get_latency_columns(): p50, p99, p99.9, and max latency (mSec) of each monitor in each phase
+def get_latency_values(histograms):
+   values = []
+   for monitor in latency_histogram_monitors:
+      for phase in latency_histogram_phases:
+         histogram = histograms[monitor + "/" + phase]
+         values += [histogram.percentile(50),histogram.percentile(99),histogram.percentile(99.9),histogram.max_ms()]
+   return values
+
+# Write a test's latency histograms ({name: LatencyHistogram}) to a compact binary file:
+#   A JSON header line with the sub-bucket bits and each histogram's name, max latency (ns), and number of non-empty
+#   buckets, followed by each histogram's bucket indexes (uint16) and then their counts (uint64)
+def write_histogram_file(path,histograms):
+   header = {"sub_bucket_bits": LatencyHistogram.sub_bucket_bits,"histograms": []}
+   for name, histogram in histograms.items():
+      header["histograms"].append({"name": name,"max": histogram.max,"buckets": len(histogram.counts)})
+   with open(path,"wb") as histogram_file:
+      histogram_file.write((json.dumps(header) + "\n").encode("utf-8"))
+      for histogram in histograms.values():
+         buckets = sorted(histogram.counts)
+         histogram_file.write(array.array("H",buckets).tobytes())
+         histogram_file.write(array.array("Q",[histogram.counts[bucket] for bucket in buckets]).tobytes())
+
+# Read a file written by write_histogram_file()
+# Returns {name: LatencyHistogram}
+def read_histogram_file(path):
+   histograms = {}
+   with open(path,"rb") as histogram_file:
+      header = json.loads(histogram_file.readline().decode("utf-8"))
+      for entry in header["histograms"]:
+         buckets = array.array("H")
+         buckets.frombytes(histogram_file.read(entry["buckets"] * 2))
+         counts = array.array("Q")
+         counts.frombytes(histogram_file.read(entry["buckets"] * 8))
+         histogram = LatencyHistogram()
+         histogram.counts.update(dict(zip(buckets,counts)))
+         histogram.max = entry["max"]
+         histograms[entry["name"]] = histogram
+   return histograms
+
+# Merge the latency histograms of several tests for campaign-level tail analysis
+# e.g., merge_histogram_files(glob.glob("fio_stats/*.hist"))["read/resilver"].percentile(99.9)
+def merge_histogram_files(paths):
+   merged = {}
+   for path in paths:
+      for name, histogram in read_histogram_file(path).items():
+         merged.setdefault(name,LatencyHistogram()).merge(histogram)
+   return merged
+
+# Returns (reads, sectors read, writes, sectors written, ms doing I/O, weighted ms doing I/O) for each disk in disk_index
+def read_diskstats(disk_index):
+   counters = [(0,0,0,0,0,0)] * len(disk_index)
+   with open(diskstats_path) as diskstats:
+      for line in diskstats:
+         fields = line.split()
+         if fields[2] in disk_index:
+            counters[disk_index[fields[2]]] = (int(fields[3]),int(fields[5]),int(fields[7]),int(fields[9]),int(fields[12]),int(fields[13]))
+   return counters
+
+# Samples per-core utilization from /proc/stat and the CPU time of ZFS kernel threads (zfs_thread_prefixes) from
+# /proc/<pid>/stat every cpustats_interval seconds on a background thread
+# Threads are grouped by taskq, e.g., z_wr_iss_0 and z_wr_iss_1 both count as z_wr_iss. The taskqs are the ones running
+# when the sampler starts; threads of a taskq that starts later are counted as "other"
+# Each thread's stat file is kept open and re-read with pread(), and /proc is only rescanned for new threads every
+# cpustats_rescan seconds, so a sample costs one read per ZFS thread even on machines with many cores
+# Writes a compact binary file in the same layout as DiskStatsSampler: a JSON header line with the CPU and taskq names,
+# metric names, and sampling interval, followed by blocks of up to diskstats_block_size samples. Each block is a sample
+# count (uint32), the sample timestamps (float64), one column per CPU metric (float32, one value per CPU), and then one
+# column per taskq metric (float32, one value per taskq). read_cpustats_file() reads it back.
+class CpuStatsSampler:
+   cpu_metrics = ("user","system","iowait")
+   taskq_metrics = ("cpu_percent","threads")
+
+   def __init__(self,path):
+      self.clock_ticks = os.sysconf("SC_CLK_TCK")
+      self.threads = {}
+      self.scan_threads()
+      self.taskqs = sorted(set(taskq for fd, taskq, ticks in self.threads.values())) + ["other"]
+      self.taskq_index = {taskq: i for i, taskq in enumerate(self.taskqs)}
+      self.cpus = sorted(self.read_cpus(),key=lambda cpu: int(cpu[3:]))
+
+      self.file = open(path,"wb")
+      header = {"cpus": self.cpus,"taskqs": self.taskqs,"cpu_metrics": list(self.cpu_metrics),"taskq_metrics": list(self.taskq_metrics),
+         "interval": cpustats_interval}
+      self.file.write((json.dumps(header) + "\n").encode("utf-8"))
+
+      self.count = 0
+      self.times = array.array("d",[0.0] * diskstats_block_size)
+      self.values = {metric: array.array("f",[0.0] * (diskstats_block_size * len(self.cpus))) for metric in self.cpu_metrics}
+      self.values.update({metric: array.array("f",[0.0] * (diskstats_block_size * len(self.taskqs))) for metric in self.taskq_metrics})
+
+      self.stop_event = threading.Event()
+      self.thread = threading.Thread(target=self.run,daemon=True)
+      self.thread.start()
+
+   # Returns {cpu name: (user, system, iowait, total) ticks} from /proc/stat
+   def read_cpus(self):
+      cpus = {}
+      with open("/proc/stat") as proc_stat:
+         for line in proc_stat:
+            if not line.startswith("cpu"):
+               break
+            fields = line.split()
+            if fields[0] != "cpu":
+               user, nice, system, idle, iowait, irq, softirq, steal = [int(field) for field in fields[1:9]]
+               cpus[fields[0]] = (user + nice,system + irq + softirq,iowait,user + nice + system + idle + iowait + irq + softirq + steal)
+      return cpus
+
+   # User + system ticks of a thread from its open /proc/<pid>/stat, or None if it has exited
+   def read_thread_ticks(self,fd):
+      try:
+         stat = os.pread(fd,1024,0).decode("utf-8","replace")
+      except OSError:
+         return None
+      fields = stat[stat.rfind(")") + 2:].split()
+      return int(fields[11]) + int(fields[12])
+
+   # Open the stat file of every ZFS kernel thread (a child of kthreadd, pid 2) that isn't already being followed
+   def scan_threads(self):
+      for pid in os.listdir("/proc"):
+         if not pid.isdigit() or int(pid) in self.threads:
+            continue
+         try:
+            fd = os.open("/proc/" + pid + "/stat",os.O_RDONLY)
+         except OSError:
+            continue
+         try:
+            stat = os.pread(fd,1024,0).decode("utf-8","replace")
+         except OSError:
+            stat = ""
+         name = stat[stat.find("(") + 1:stat.rfind(")")]
+         fields = stat[stat.rfind(")") + 2:].split()
+         if len(fields) > 12 and fields[1] == "2" and name.startswith(zfs_thread_prefixes):
+            taskq = re.sub(r"(_?[0-9]+)+$","",name)
+            self.threads[int(pid)] = [fd,taskq,int(fields[11]) + int(fields[12])]
+         else:
+            os.close(fd)
+
+   def run(self):
+      previous = self.read_cpus()
+      previous_time = time.monotonic()
+      next_sample = previous_time + cpustats_interval
+      next_scan = previous_time + cpustats_rescan
+
+      # Samples are scheduled against the monotonic clock so the interval doesn't drift
+      while not self.stop_event.wait(max(next_sample - time.monotonic(),0)):
+         current = self.read_cpus()
+         now = time.monotonic()
+         elapsed = now - previous_time
+
+         offset = self.count * len(self.cpus)
+         for i, cpu in enumerate(self.cpus):
+            if cpu in current and cpu in previous:
+               user, system, iowait, total = [c - p for c, p in zip(current[cpu],previous[cpu])]
+            else:
+               # CPU went offline (or came back) since the previous sample
+               user, system, iowait, total = 0, 0, 0, 0
+            self.values["user"][offset + i] = user * 100/total if total > 0 else 0
+            self.values["system"][offset + i] = system * 100/total if total > 0 else 0
+            self.values["iowait"][offset + i] = iowait * 100/total if total > 0 else 0
+
+         offset = self.count * len(self.taskqs)
+         for i in range(len(self.taskqs)):
+            self.values["cpu_percent"][offset + i] = 0
+            self.values["threads"][offset + i] = 0
+         for pid, thread in list(self.threads.items()):
+            fd, taskq, ticks = thread
+            current_ticks = self.read_thread_ticks(fd)
+            if current_ticks == None:
+               os.close(fd)
+               del self.threads[pid]
+               continue
+            i = self.taskq_index.get(taskq,self.taskq_index["other"])
+            self.values["cpu_percent"][offset + i] += (current_ticks - ticks) * 100/self.clock_ticks/elapsed
+            self.values["threads"][offset + i] += 1
+            thread[2] = current_ticks
+
+         self.times[self.count] = time.time()
+         self.count += 1
+         if self.count == diskstats_block_size:
+            self.write_block()
+
+         if now >= next_scan:
+            self.scan_threads()
+            next_scan = now + cpustats_rescan
+
+         previous = current
+         previous_time = now
+         next_sample += cpustats_interval
+         # If sampling fell behind (e.g., the system stalled), skip ahead instead of sampling in a burst
+         if next_sample < now:
+            next_sample = now + cpustats_interval
+
+   def write_block(self):
+      self.file.write(struct.pack("<I",self.count))
+      self.file.write(self.times[:self.count].tobytes())
+      for metric in self.cpu_metrics:
+         self.file.write(self.values[metric][:self.count * len(self.cpus)].tobytes())
+      for metric in self.taskq_metrics:
+         self.file.write(self.values[metric][:self.count * len(self.taskqs)].tobytes())
+      self.count = 0
+
+   def stop(self):
+      self.stop_event.set()
+      self.thread.join()
+      if self.count > 0:
+         self.write_block()
+      self.file.close()
+      for fd, taskq, ticks in self.threads.values():
+         os.close(fd)
+
+# Read a file written by CpuStatsSampler
+# Returns the header, a list of sample timestamps, {metric: [[value for each CPU] for each sample]}, and
+# {metric: [[value for each taskq] for each sample]}
+def read_cpustats_file(path):
+   with open(path,"rb") as cpustats_file:
+      header = json.loads(cpustats_file.readline().decode("utf-8"))
+      times = []
+      cpu_values = {metric: [] for metric in header["cpu_metrics"]}
+      taskq_values = {metric: [] for metric in header["taskq_metrics"]}
+      while True:
+         count_bytes = cpustats_file.read(4)
+         if len(count_bytes) < 4:
+            break
+         count = struct.unpack("<I",count_bytes)[0]
+         block_times = array.array("d")
+         block_times.frombytes(cpustats_file.read(count * 8))
+         times += block_times.tolist()
+         for values, width in ((cpu_values,len(header["cpus"])),(taskq_values,len(header["taskqs"]))):
+            for metric in values:
+               column = array.array("f")
+               column.frombytes(cpustats_file.read(count * width * 4))
+               for sample in range(count):
+                  values[metric].append(column[sample * width:(sample + 1) * width].tolist())
+   return header, times, cpu_values, taskq_values
+
+# Samples the ZFS kstats in kstat_files every kstat_interval seconds on a background thread
+# Counters are recorded as rates (per second) over the interval and gauges (kstat_gauges) as is, each as a
+# "<kstat>.<name>" column, e.g., "arcstats.hits" or "tank/io.nwritten". The txg history ("txgs") becomes the number of
+# txgs committed in the interval, their bytes and I/Os (per second), and their average open, quiesce, wait, and sync times
+# (mSec)
+# Samples are timestamped with the same clock as the fio stats rows so the two line up
+# Each kstat file is kept open and re-read with pread() and split in one pass, so reading dozens of them per second costs
+# a small fraction of a core
+# Writes a compact binary file: a JSON header line with the column names and sampling interval, followed by blocks of
+# up to diskstats_block_size samples. Each block is a sample count (uint32), the sample timestamps (float64), and then
+# one column per kstat value (float64). read_kstats_file() reads it back.
+class KstatSampler:
+   txg_columns = ("committed","ndirty","nread","nwritten","reads","writes","otime_ms","qtime_ms","wtime_ms","stime_ms")
+
+   def __init__(self,path):
+      global log
+
+      self.kstats = []
+      for kstat in kstat_files:
+         kstat = kstat.replace("{pool}",pool_name)
+         try:
+            self.kstats.append((kstat,os.open(os.path.join(kstat_root,kstat),os.O_RDONLY)))
+         except OSError:
+            pass
+      self.last_txg = {}
+      previous = self.read_kstats()
+      self.columns = list(previous)
+      if len(self.kstats) == 0:
+         log.info("No ZFS kstats found under " + kstat_root + ", not sampling kstats")
+         self.thread = None
+         return
+
+      self.file = open(path,"wb")
+      header = {"columns": self.columns,"interval": kstat_interval}
+      self.file.write((json.dumps(header) + "\n").encode("utf-8"))
+
+      self.count = 0
+      self.times = array.array("d",[0.0] * diskstats_block_size)
+      self.values = array.array("d",[0.0] * (diskstats_block_size * len(self.columns)))
+
+      self.stop_event = threading.Event()
+      self.thread = threading.Thread(target=self.run,args=(previous,),daemon=True)
+      self.thread.start()
+
+   # Returns {column: (value, kind)} from every kstat that could be read, where kind is "counter" (a running total),
+   # "gauge", or "total" (summed over the txgs committed since the previous read)
+   def read_kstats(self):
+      values = {}
+      for kstat, fd in self.kstats:
+         try:
+            data = os.pread(fd,65536,0)
+         except OSError:
+            continue
+         if kstat.endswith("txgs"):
+            for name, value in zip(self.txg_columns,self.parse_txgs(kstat,data)):
+               values[kstat + "." + name] = (value,"total" if name in self.txg_columns[1:6] else "gauge")
+         else:
+            for name, value in zip(*parse_kstat(data)):
+               values[kstat + "." + name] = (value,"gauge" if name in kstat_gauges or name.endswith("size") else "counter")
+      return values
+
+   # Sum up the txgs committed since the previous read of the txg history
+   def parse_txgs(self,kstat,data):
+      totals = [0] * len(self.txg_columns)
+      last_txg = self.last_txg.get(kstat)
+      lines = data.split(b"\n")
+      for line in lines[2:]:
+         # txg birth state ndirty nread nwritten reads writes otime qtime wtime stime
+         fields = line.split()
+         if len(fields) < 12 or fields[2] != b"C":
+            continue
+         txg = int(fields[0])
+         if last_txg != None and txg <= last_txg:
+            continue
+         self.last_txg[kstat] = max(self.last_txg.get(kstat,txg),txg)
+         totals[0] += 1
+         for i in range(1,10):
+            totals[i] += int(fields[i + 2])
+      # First read only sets the starting txg
+      if last_txg == None:
+         self.last_txg.setdefault(kstat,-1)
+         return [0] * len(self.txg_columns)
+      if totals[0] > 0:
+         for i in range(6,10):
+            totals[i] = totals[i]/totals[0]/1000**2
+      return totals
+
+   def run(self,previous):
+      previous_time = time.monotonic()
+      next_sample = previous_time + kstat_interval
+
+      # Samples are scheduled against the monotonic clock so the interval doesn't drift
+      while not self.stop_event.wait(max(next_sample - time.monotonic(),0)):
+         current = self.read_kstats()
+         now = time.monotonic()
+         elapsed = now - previous_time
+         offset = self.count * len(self.columns)
+         for i, column in enumerate(self.columns):
+            value, kind = current.get(column,(0,"gauge"))
+            if kind == "counter":
+               # A counter that went backwards was reset (e.g., the pool was re-imported)
+               delta = value - previous[column][0] if value >= previous[column][0] else value
+               self.values[offset + i] = delta/elapsed
+            elif kind == "total":
+               self.values[offset + i] = value/elapsed
+            else:
+               self.values[offset + i] = value
+         self.times[self.count] = time.time()
+         self.count += 1
+         if self.count == diskstats_block_size:
+            self.write_block()
+
+         previous.update(current)
+         previous_time = now
+         next_sample += kstat_interval
+         # If sampling fell behind (e.g., the system stalled), skip ahead instead of sampling in a burst
+         if next_sample < now:
+            next_sample = now + kstat_interval
+
+   def write_block(self):
+      self.file.write(struct.pack("<I",self.count))
+      self.file.write(self.times[:self.count].tobytes())
+      self.file.write(self.values[:self.count * len(self.columns)].tobytes())
+      self.count = 0
+
+   def stop(self):
+      if self.thread != None:
+         self.stop_event.set()
+         self.thread.join()
+         if self.count > 0:
+            self.write_block()
+         self.file.close()
+      for kstat, fd in self.kstats:
+         os.close(fd)
+
+# Parse a named (KSTAT_TYPE_NAMED) or I/O (KSTAT_TYPE_IO) kstat into a list of names and a list of numeric values
+# e.g., arcstats:
+#   13 1 0x01 147 39984 4816745417 258318727385
+#   name                            type data
+#   hits                            4    1357531
+def parse_kstat(data):
+   lines = data.split(b"\n",2)
+   if len(lines) < 3:
+      return [], []
+   kstat_type = lines[0].split()[1:2]
+   if kstat_type == [b"1"]:
+      # Every row is "name type value", so split the whole table at once unless there are string values
+      tokens = lines[2].split()
+      if len(tokens) % 3 == 0 and set(tokens[1::3]) <= {b"0",b"1",b"2",b"3",b"4",b"5",b"6"}:
+         return [name.decode() for name in tokens[0::3]], [int(value) for value in tokens[2::3]]
+      names = []
+      values = []
+      for line in lines[2].split(b"\n"):
+         fields = line.split()
+         if len(fields) == 3 and fields[1] != b"7":
+            try:
+               values.append(int(fields[2]))
+               names.append(fields[0].decode())
+            except ValueError:
+               pass
+      return names, values
+   elif kstat_type == [b"3"]:
+      # A row of column names followed by a row of values
+      rows = lines[2].split(b"\n")
+      if len(rows) > 0 and len(lines[1].split()) == len(rows[0].split()):
+         return [name.decode() for name in lines[1].split()], [int(value) for value in rows[0].split()]
+   return [], []
+
+# Read a file written by KstatSampler
+# Returns the header, a list of sample timestamps, and {column: [value for each sample]}
+def read_kstats_file(path):
+   with open(path,"rb") as kstats_file:
+      header = json.loads(kstats_file.readline().decode("utf-8"))
+      num_columns = len(header["columns"])
+      times = []
+      values = {column: [] for column in header["columns"]}
+      while True:
+         count_bytes = kstats_file.read(4)
+         if len(count_bytes) < 4:
+            break
+         count = struct.unpack("<I",count_bytes)[0]
+         block_times = array.array("d")
+         block_times.frombytes(kstats_file.read(count * 8))
+         times += block_times.tolist()
+         block_values = array.array("d")
+         block_values.frombytes(kstats_file.read(count * num_columns * 8))
+         for i, column in enumerate(header["columns"]):
+            values[column] += block_values[i::num_columns].tolist()
+   return header, times, values
+
+# Sleep for a fixed harness wait, shortened by time_scale on the sim backend
+def pause(seconds):
+   time.sleep(seconds/time_scale)
+
+# Run an external command from an argv list (no shell) and return its output as a string
+# Every call is timed and added to command_stats and the trace with its exit code and output size. Raises
+# subprocess.CalledProcessError on a non-zero exit code if check is set, like subprocess.check_output()
+def run_command(cmd,check=True,stderr=None,timeout=None):
+   start = time.time()
+   # Stay None if the command can't be started (e.g., a missing binary), so the OSError isn't masked below
+   proc = None
+   returncode = None
+   try:
+      proc = subprocess.run(cmd,stdout=subprocess.PIPE,stderr=stderr,timeout=timeout)
+      returncode = proc.returncode
+   except subprocess.TimeoutExpired:
+      returncode = "timeout"
+      raise
+   finally:
+      duration = time.time() - start
+      name = " ".join(cmd[:2]) if cmd[0] in ("zpool","zfs","losetup") else cmd[0]
+      with command_stats_lock:
+         stats = command_stats.setdefault(name,{"count": 0,"time": 0,"failed": 0})
+         stats["count"] += 1
+         stats["time"] += duration
+         if returncode != 0:
+            stats["failed"] += 1
+      output_bytes = len(proc.stdout) if proc is not None else 0
+      write_trace_event({"name": name,"cat": "command","ph": "X","ts": start*1000**2,"dur": duration*1000**2,
+         "args": {"argv": " ".join(cmd),"exit_code": returncode,"output_bytes": output_bytes}})
+
+   if check and proc.returncode != 0:
+      raise subprocess.CalledProcessError(proc.returncode,cmd,proc.stdout,proc.stderr)
+   return proc.stdout.decode("utf-8")
+
+# Append an event to the trace file
+# Events are written as they finish in the Chrome trace JSON array format, which allows the closing bracket to be left
+# off, so the trace can be opened while the campaign is still running or after a crash. Each event is a single write to a
+# file opened with O_APPEND, so threads and concurrent pool workers can share the file
+def write_trace_event(event):
+   global trace_fd
+   global trace_pid
+
+   if trace_file == "":
+      return
+   if trace_pid != os.getpid():
+      trace_fd = os.open(trace_file,os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+      trace_pid = os.getpid()
+   event["pid"] = os.getpid()
+   event["tid"] = threading.get_native_id()
+   os.write(trace_fd,(json.dumps(event) + ",\n").encode("utf-8"))
+
+# A test phase (e.g., fill, resilver) shown in the trace as a span around the commands it runs
+# Use it as a context manager, or call end() for phases that don't line up with a block of code
+class TraceSpan:
+   def __init__(self,name,**args):
+      self.name = name
+      self.args = args
+      self.start = time.time()
+      self.ended = False
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self,*exc):
+      self.end()
+
+   def end(self):
+      if self.ended:
+         return
+      self.ended = True
+      self.args["pool"] = pool_name
+      self.args["test_index"] = test_index
+      write_trace_event({"name": self.name,"cat": "phase","ph": "X","ts": self.start*1000**2,
+         "dur": (time.time() - self.start)*1000**2,"args": self.args})
+
+# Start a new trace file for this campaign, keeping the previous one
+def start_trace():
+   if trace_file == "":
+      return
+   try:
+      os.rename(trace_file,trace_file + ".old")
+   except:
+      pass
+   with open(trace_file,"w") as trace:
+      trace.write("[\n")
+
+# Log the external commands that took the most time over the campaign
+def log_command_summary():
+   global log
+
+   total_time = sum(stats["time"] for stats in command_stats.values())
+   log.info("External commands: " + str(sum(stats["count"] for stats in command_stats.values())) + " calls, " + \
+      sec_to_dhms(total_time) + " total")
+   for name, stats in sorted(command_stats.items(),key=lambda item: item[1]["time"],reverse=True)[:10]:
+      log.info("   " + name + ": " + str(stats["count"]) + " calls, " + str(round(stats["time"],1)) + "s, " + str(stats["failed"]) + " failed")
+
+# Start a long-running child process and keep track of it so it can be stopped when the script exits
+def start_process(cmd,**kwargs):
+   global child_procs
+
+   write_trace_event({"name": "start " + cmd[0],"cat": "command","ph": "i","s": "t","ts": time.time()*1000**2,"args": {"argv": " ".join(cmd)}})
+   proc = subprocess.Popen(cmd,**kwargs)
+   child_procs = [child for child in child_procs if child.poll() == None]
+   child_procs.append(proc)
+   return proc
+
+# Stop every child process that is still running: SIGTERM first, then SIGKILL for any still running a few seconds later
+def stop_processes():
+   running = [child for child in child_procs if child.poll() == None]
+   for child in running:
+      child.terminate()
+   deadline = time.monotonic() + 5
+   for child in running:
+      try:
+         child.wait(timeout=max(deadline - time.monotonic(),0))
+      except subprocess.TimeoutExpired:
+         child.kill()
+         child.wait()
+
+# Wait for a readiness probe instead of sleeping for a fixed time
+# check() is called every probe_interval seconds until it returns True or probe_timeout passes; fixed_wait is the sleep the
+# probe replaces, and the difference is added to probe_stats. With readiness_probes off, this sleeps for fixed_wait instead
+def wait_ready(name,fixed_wait,check):
+   global log
+
+   if not readiness_probes:
+      pause(fixed_wait)
+      return True
+
+   start = time.monotonic()
+   ready = check()
+   while not ready and time.monotonic() - start < probe_timeout/time_scale:
+      time.sleep(probe_interval/time_scale)
+      ready = check()
+   waited = time.monotonic() - start
+
+   stats = probe_stats.setdefault(name,{"count": 0,"waited": 0,"saved": 0,"timeouts": 0})
+   stats["count"] += 1
+   stats["waited"] += waited
+   stats["saved"] += fixed_wait/time_scale - waited
+   if not ready:
+      stats["timeouts"] += 1
+      log.info("Readiness probe " + name + " timed out after " + str(probe_timeout) + " seconds, continuing")
+   return ready
+
+# Log the time each readiness probe waited and how much it saved against the fixed sleeps (negative if it waited longer)
+def log_probe_summary():
+   global log
+
+   total_saved = 0
+   for name, stats in probe_stats.items():
+      log.info("Readiness probe " + name + ": " + str(stats["count"]) + " waits, " + str(round(stats["waited"],1)) + "s waited, " + \
+         str(round(stats["saved"],1)) + "s saved, " + str(stats["timeouts"]) + " timeouts")
+      total_saved += stats["saved"]
+   if probe_stats != {}:
+      log.info("Readiness probes saved " + sec_to_dhms(max(total_saved,0)) + " in total")
+
+# Returns the number of fio processes still running, counting the same processes kill_fio() kills
+def fio_running():
+   if disk_group == None:
+      procs = psutil.process_iter()
+   else:
+      procs = psutil.Process().children(recursive=True)
+
+   num_running = 0
+   for proc in procs:
+      try:
+         if proc.name() == "fio" and proc.status() != psutil.STATUS_ZOMBIE:
+            num_running += 1
+      except psutil.NoSuchProcess:
+         pass
+   return num_running
+
+# Readiness probe: returns True once every transaction group with pending writes has synced to disk
+# zpool sync and zpool wait block until they're done, so the probe timeout is passed to them (unscaled, since starting the
+# command alone takes longer than a scaled timeout on the sim backend)
+def pool_synced():
+   try:
+      run_command(["zpool","sync",pool_name],stderr=subprocess.DEVNULL,timeout=probe_timeout)
+      return True
+   except:
+      return False
+
+# Readiness probe: returns True once no resilver is running on the pool
+def resilver_finished():
+   try:
+      run_command(["zpool","wait","-t","resilver",pool_name],stderr=subprocess.DEVNULL,timeout=probe_timeout)
+      return True
+   except:
+      return False
+
+# Readiness probe that is ready once the pool's disks have done fewer than idle_iops over the last probe interval
+class PoolIdleProbe:
+   def __init__(self):
+      self.disk_index = {disk.replace("/dev/",""): i for i, disk in enumerate(get_disk_list())}
+      self.previous = read_diskstats(self.disk_index)
+      self.previous_time = time.monotonic()
+
+   def __call__(self):
+      now = time.monotonic()
+      elapsed = now - self.previous_time
+      if elapsed < probe_interval/time_scale:
+         return False
+      current = read_diskstats(self.disk_index)
+      ios = sum(c[0] - p[0] + c[2] - p[2] for c, p in zip(current,self.previous))
+      self.previous = current
+      self.previous_time = now
+      return ios/elapsed < idle_iops
+
+# Set up the sim backend so a whole campaign can run without a disk shelf
+# "scripted": zpool, zfs, lsblk, sgdisk, udevadm, and fio are replaced by sim.py through symlinks in sim_dir/bin, which is
+#   put first on the PATH. Disks are simulated, pool data is sparse files under sim_dir/mnt, and fills and resilvers run
+#   sim_time_scale times faster than on hardware (zpool status and fio still report simulated sizes, rates, and times)
+# "files": real ZFS and fio on sparse files in sim_dir/vdevs attached as loop devices (needs root and ZFS)
+# "auto" uses "files" when running as root with zpool installed, otherwise "scripted"
+def set_up_sim():
+   global log
+   global sim_vdevs
+   global sim_disks
+   global mount_root
+   global time_scale
+   global target_disk
+   global format_disks
+   global diskstats_path
+   global diskstats_interval
+   global cpustats_interval
+
+   os.makedirs(sim_dir,exist_ok=True)
+   mount_root = os.path.abspath(os.path.join(sim_dir,"mnt"))
+   time_scale = sim_time_scale
+   # Resilvers only take seconds, so sample the disks and CPUs as often as the samplers allow
+   diskstats_interval = min(diskstats_interval,0.1)
+   cpustats_interval = min(cpustats_interval,0.1)
+   if sim_vdevs == "auto":
+      sim_vdevs = "files" if os.geteuid() == 0 and shutil.which("zpool") != None else "scripted"
+
+   if sim_vdevs == "files":
+      # Reuse loop devices that are still attached from an earlier run so pools and golden images survive a restart
+      os.makedirs(os.path.join(sim_dir,"vdevs"),exist_ok=True)
+      sim_disks = []
+      for disk_number in range(TOTAL_NUM_DISKS):
+         path = os.path.abspath(os.path.join(sim_dir,"vdevs","disk" + str(disk_number) + ".img"))
+         if not os.path.exists(path):
+            with open(path,"wb") as vdev_file:
+               vdev_file.truncate(parse_size(sim_vdev_size))
+         loop_device = run_command(["losetup","-j",path]).split(":")[0]
+         if loop_device == "":
+            loop_device = run_command(["losetup","-f","--show",path]).strip()
+         sim_disks.append(loop_device)
+
+      # Loop devices are used whole since their partitions aren't named like disk partitions
+      format_disks = False
+      target_disk = sim_disks[0].replace("/dev/","")
+      log.info("Sim backend: " + str(len(sim_disks)) + " sparse file vdevs of " + sim_vdev_size + " on loop devices")
+   else:
+      bin_dir = os.path.abspath(os.path.join(sim_dir,"bin"))
+      os.makedirs(bin_dir,exist_ok=True)
+      sim_script = os.path.abspath(os.path.join(os.path.dirname(__file__),"sim.py"))
+      for tool in ("zpool","zfs","lsblk","sgdisk","udevadm","fio"):
+         link = os.path.join(bin_dir,tool)
+         if os.path.lexists(link):
+            os.remove(link)
+         os.symlink(sim_script,link)
+      os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+      os.environ["RESILVER_SIM_DIR"] = os.path.abspath(sim_dir)
+      os.environ["RESILVER_SIM_TIME_SCALE"] = str(sim_time_scale)
+      os.environ["RESILVER_SIM_DISKS"] = str(TOTAL_NUM_DISKS)
+      os.environ["RESILVER_SIM_DISK_SIZE"] = physical_disk_size
+
+      # The stand-in fio keeps per-disk counters for the simulated disks up to date
+      diskstats_path = os.path.join(sim_dir,"diskstats")
+      open(diskstats_path,"a").close()
+      log.info("Sim backend: " + str(TOTAL_NUM_DISKS) + " scripted disks, time scale " + str(sim_time_scale) + "x")
 
 # Convert seconds to a string with days, hours, minutes, and seconds
 def sec_to_dhms(seconds):
@@ -636,13 +2479,24 @@ def sec_to_dhms(seconds):
       t = "{:02}".format(round(s)) + "s"
    return t
 
+# Convert seconds to a string with hours, minutes, and seconds (e.g., 26:03:15), as shown by zpool status
+def sec_to_hms(seconds):
+   m, s = divmod(round(seconds), 60)
+   h, m = divmod(m, 60)
+   return str(h) + ":" + "{:02}".format(m) + ":" + "{:02}".format(s)
+
 # Get a list of the device nodes for all disks with the specified size (i.e., don't use boot, cache, etc. drives)
 def get_disk_list():
    global log
 
+   # Concurrent pools only use the disks in their own group
+   if disk_group != None:
+      return list(disk_group)
+   if sim_disks != None:
+      return list(sim_disks)
+
    disk_list = []
-   disk_list_raw = subprocess.check_output("/usr/bin/lsblk -d -n --output NAME,SIZE",shell=True)
-   disk_list_raw = disk_list_raw.decode("utf-8").splitlines()
+   disk_list_raw = run_command(["lsblk","-d","-n","--output","NAME,SIZE"]).splitlines()
    
    for disk in disk_list_raw:
       dev_node = disk.split()[0]
@@ -653,32 +2507,64 @@ def get_disk_list():
    return(disk_list)
 
 # Format disks to a specified size
+# Partition sizes for every disk are read with a single lsblk call, disks that need it are partitioned in parallel,
+# and the results are checked with one more lsblk call once udev has created the new partition nodes
 def format(format_size):
    global log
 
    start = time.time()
    disk_list = get_disk_list()
-   num_formatted = 0
-   num_skipped = 0
 
-   for disk in disk_list:
-      # Check if disk is already formatted to the specified size. If disk is not partitioned, lsblk will error and disk needs to be formatted
-      try:
-         partition_info = subprocess.check_output("lsblk -n --output size " + disk + "1",shell=True).decode("utf-8").strip()
-      except:
-         partition_info = 0
-
-      # If disk is not formatted to the specified size, format it. If it has already been formatted to the correct size, skip it
-      if partition_info != format_size:
-         log.info("Formatting " + disk + "...")
-         subprocess.check_output("sgdisk -Z " + disk,shell=True,stderr=subprocess.DEVNULL)
-         subprocess.check_output("sgdisk -n 0:0:+" + format_size + " " + disk,shell=True,stderr=subprocess.DEVNULL)
-         num_formatted += 1
-      else:
-         num_skipped += 1
+   # If disk is not formatted to the specified size, format it. If it has already been formatted to the correct size, skip it
+   partition_sizes = get_partition_sizes(disk_list)
+   to_format = [disk for disk in disk_list if partition_sizes[disk] != format_size]
+   num_skipped = len(disk_list) - len(to_format)
+
+   failed = []
+   if to_format != []:
+      log.info("Formatting " + str(len(to_format)) + " disks with " + str(format_workers) + " workers...")
+      with concurrent.futures.ThreadPoolExecutor(max_workers=format_workers) as executor:
+         for disk, disk_time, error in executor.map(format_disk,to_format):
+            if error == None:
+               log.info("Formatted " + disk + " in " + str(round(disk_time,2)) + "s")
+            else:
+               log.info("Failed to format " + disk + " after " + str(round(disk_time,2)) + "s: " + error)
+               failed.append(disk)
+
+      # Wait once for udev to create all of the new partition nodes, then make sure every disk has the right partition
+      run_command(["udevadm","settle"],check=False)
+      partition_sizes = get_partition_sizes(to_format)
+      for disk in to_format:
+         if disk not in failed and partition_sizes[disk] != format_size:
+            log.info("Partition on " + disk + " is " + str(partition_sizes[disk]) + " instead of " + format_size)
+            failed.append(disk)
 
    time_taken = time.time() - start
-   log.info("Formatted " + str(num_formatted) + " and skipped " + str(num_skipped) + " disks in " + sec_to_dhms(time_taken))
+   log.info("Formatted " + str(len(to_format) - len(failed)) + " and skipped " + str(num_skipped) + " disks in " + sec_to_dhms(time_taken))
+   if failed != []:
+      raise Exception("Could not format " + ", ".join(failed))
+
+# Returns the size of the first partition (as shown by lsblk, e.g., "500G") on each disk, or None if it isn't partitioned
+def get_partition_sizes(disk_list):
+   lsblk = json.loads(run_command(["lsblk","-J","--output","NAME,SIZE"] + disk_list))
+   partition_sizes = {}
+   for device in lsblk["blockdevices"]:
+      if device.get("children"):
+         partition_sizes["/dev/" + device["name"]] = device["children"][0]["size"]
+      else:
+         partition_sizes["/dev/" + device["name"]] = None
+   return partition_sizes
+
+# Wipe a disk and create a single partition of format_size on it
+# Returns the disk, the time taken, and an error message (None if it succeeded)
+def format_disk(disk):
+   start = time.time()
+   try:
+      run_command(["sgdisk","-Z",disk],stderr=subprocess.PIPE)
+      run_command(["sgdisk","-n","0:0:+" + format_size,disk],stderr=subprocess.PIPE)
+      return disk, time.time() - start, None
+   except subprocess.CalledProcessError as e:
+      return disk, time.time() - start, e.stderr.decode("utf-8").strip()
 
 # CPU stress function
 def cpu_stress(cpu_load):
@@ -708,7 +2594,7 @@ def cpu_stress(cpu_load):
    cmd += "--cpuload=" + str(cpu_load)
 
    # Start CPU stress and return process handle
-   proc = subprocess.Popen(shlex.split(cmd),stdout=subprocess.DEVNULL)
+   proc = start_process(shlex.split(cmd),stdout=subprocess.DEVNULL)
    return proc
 
 # Disk stress function
@@ -731,13 +2617,13 @@ def disk_stress(disk_load):
       --runtime=100D \
       --time_based=1 \
       --direct=1 \
-      --directory=/mnt/tank/test/diskstress/ \
       --group_reporting \
       --unified_rw_reporting=both \
-      --output-format=terse \
+      --output-format=json+ \
       --status-interval=5 \
       --name=diskstress \
    """
+   cmd += "--directory=" + mount_root + "/" + pool_name + "/test/diskstress/ \\"
    # We high disk utilization with more jobs and smaller block sizes
    if disk_load == "high":
       cmd += "--numjobs=256 \\"
@@ -750,15 +2636,14 @@ def disk_stress(disk_load):
       cmd += "--filesize=1Mi"
       
    # Set sync=always on the dataset so I/O is not buffered in memory
-   subprocess.run("zfs set sync=always tank/test",shell=True)
+   run_command(["zfs","set","sync=always",pool_name + "/test"],check=False)
 
    # Remove any previous disk stress files and create a new directory for the stress test files
-   subprocess.run("rm -rf /mnt/tank/test/diskstress",shell=True)
-   subprocess.run("mkdir /mnt/tank/test/diskstress",shell=True)
+   shutil.rmtree(mount_root + "/" + pool_name + "/test/diskstress",ignore_errors=True)
+   os.makedirs(mount_root + "/" + pool_name + "/test/diskstress",exist_ok=True)
 
-   # Start disk stress and return process handle
-   proc = subprocess.Popen(shlex.split(cmd),stdout=subprocess.PIPE,text=True)
-   return proc
+   # Start disk stress and return a stream of its stats
+   return start_fio_stream(cmd)
 
 # Performs random reads with iodpeth of 1 to monitor read latency.
 # Disables primarycache on dataset to ensure reads are from disk rather than ARC
@@ -771,21 +2656,20 @@ def read_latency_monitor():
       --runtime=100D \
       --time_based=1 \
       --direct=1 \
-      --opendir=/mnt/tank/test/fill/fill0/0 \
       --group_reporting \
       --unified_rw_reporting=both \
       --name=readlatmon \
-      --output-format=terse \
+      --output-format=json+ \
       --allow_file_create=0 \
       --status-interval=5 \
       --numjobs=1 \
       --nrfiles=1 \
       --file_service_type=random \
-      --bs=4Ki
+      --bs=4Ki \
    """
-   subprocess.run("zfs set primarycache=none tank/test",shell=True)
-   proc = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE, text=True)
-   return proc
+   cmd += "--opendir=" + mount_root + "/" + pool_name + "/test/fill/fill0/0"
+   run_command(["zfs","set","primarycache=none",pool_name + "/test"],check=False)
+   return start_fio_stream(cmd)
 
 # Performs random writes with iodpeth of 1 to monitor read latency. Performs one I/O every 100ms
 def write_latency_monitor():
@@ -798,32 +2682,32 @@ def write_latency_monitor():
       --time_based=1 \
       --direct=1 \
       --thinktime=100ms \
-      --directory=/mnt/tank/test/write_latency \
       --group_reporting \
       --unified_rw_reporting=both \
       --name=writelatmon \
-      --output-format=terse \
+      --output-format=json+ \
       --status-interval=5 \
       --numjobs=1 \
       --nrfiles=1 \
       --file_service_type=random \
       --bs=4Ki \
-      --filesize=4Ki
+      --filesize=4Ki \
    """
+   cmd += "--directory=" + mount_root + "/" + pool_name + "/test/write_latency"
    # Set sync=always on the dataset so I/O is not buffered in memory
-   subprocess.run("zfs set sync=always tank/test",shell=True)
+   run_command(["zfs","set","sync=always",pool_name + "/test"],check=False)
 
    # Remove any previous disk stress files and create a new directory for the stress test files
-   subprocess.run("rm -rf /mnt/tank/test/write_latency",shell=True)
-   subprocess.run("mkdir /mnt/tank/test/write_latency",shell=True)
-   proc = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE, text=True)
-   return proc
+   shutil.rmtree(mount_root + "/" + pool_name + "/test/write_latency",ignore_errors=True)
+   os.makedirs(mount_root + "/" + pool_name + "/test/write_latency",exist_ok=True)
+   return start_fio_stream(cmd)
 
 # Create a ZFS pool with the specified layout, vdev width, recordsize, and minimum spare count
 def create_pool(layout,vdev_width,recordsize,minspares):
    global log
 
    start = time.time()
+   span = TraceSpan("create_pool")
 
    # Get a list of disks to use for the pool
    disk_list = get_disk_list()
@@ -869,7 +2753,7 @@ def create_pool(layout,vdev_width,recordsize,minspares):
    spares = spares.strip()
 
    # Format the zpool create string; set ashift=12 and autoreplace=on
-   zpool_create = "zpool create -f tank -o ashift=12 -o autoreplace=on -m /mnt/tank "
+   zpool_create = "zpool create -f " + pool_name + " -o ashift=12 -o autoreplace=on -m " + mount_root + "/" + pool_name + " "
 
    # Add each vdev to the zpool create string
    for vdev in vdev_lists:
@@ -891,11 +2775,12 @@ def create_pool(layout,vdev_width,recordsize,minspares):
    
    # Create the pool
    log.info("Creating pool/dataset: " + layout_description + " and recordsize: " + recordsize + "...")
-   subprocess.check_output(shlex.split(zpool_create))
+   run_command(shlex.split(zpool_create))
    
    # Create a dataset with the specified recordsize and disable compression
-   subprocess.check_output("zfs create -o compression=off -o recordsize=" + recordsize + " tank/test",shell=True)
+   run_command(["zfs","create","-o","compression=off","-o","recordsize=" + recordsize,pool_name + "/test"])
    time_taken = time.time() - start
+   span.end()
    log.info("Created pool in " + sec_to_dhms(time_taken))
 
 # Destroy zpool if it exists
@@ -903,107 +2788,142 @@ def destroy_pool():
    global log
    
    start = time.time()
+   span = TraceSpan("destroy_pool")
    log.info("Destroying pool...")
    
    # Kill any running instances of fio, otherwise pool destroy can fail
-   try:
-      subprocess.check_output("pkill -9 fio",shell=True)
+   if kill_fio() > 0:
       log.info("Killed lingering fio processes.")
-      time.sleep(1)
-   except:
-      pass
+      wait_ready("fio_exited",1,lambda: fio_running() == 0)
    
    pool_status = "online"
    while pool_status == "online":
       # Check if pool exists and is online
       try:
-         pool_status = subprocess.check_output("zpool list -Ho name tank",shell=True,stderr=subprocess.DEVNULL).decode("utf-8").strip()
-         if pool_status == "tank": pool_status = "online"
+         pool_status = run_command(["zpool","list","-Ho","name",pool_name],stderr=subprocess.DEVNULL).strip()
+         if pool_status == pool_name: pool_status = "online"
       except:
          pool_status = "offline"
          break
 
       # If pool is online, destroy it
       try:
-         subprocess.check_output("zpool destroy tank",shell=True,stderr=subprocess.DEVNULL)
+         run_command(["zpool","destroy",pool_name],stderr=subprocess.DEVNULL)
       except:
-         try:
-            subprocess.check_output("pkill -9 fio",shell=True)
+         if kill_fio() > 0:
             log.info("Killed lingering fio processes.")
-            time.sleep(1)
-         except:
+            wait_ready("fio_exited",1,lambda: fio_running() == 0)
+         else:
             log.info("Could not destroy pool or kill fio processes.")
-            time.sleep(5)
+            wait_ready("pool_idle",5,PoolIdleProbe())
       
    time_taken = time.time() - start
+   span.end()
    log.info("Destroyed pool in " + sec_to_dhms(time_taken))
 
 # Fill pool to a specified percentage with a specified fragmentation level
-# Moderate (~30%) and high fragmentation (~50%) levels are achieved by writing small, unaligned blocks to fill up the pool
-# to 100% and then randomly deleting a certain percentage of those files to get back to the specified fill percentage.
-# If fragmentation is "none", sequentially fill the pool
+# With a numeric fragmentation level, fragment_pool() alternates write and prune rounds until the pool reaches that
+# fragmentation percent. "med" and "high" write small, unaligned blocks to fill up the pool to 100% and then randomly
+# delete files to get back to the specified fill percentage. If fragmentation is "none", sequentially fill the pool
+# Returns the average fill speed (GiB/s written by fio)
 def fill_pool(fill_percent,frag_level):
    global log
-   global test_index
 
    start = time.time()
+   span = TraceSpan("fill")
 
    # Set sync=disabled on the dataset for faster fill
-   subprocess.run("zfs set sync=disabled tank/test",shell=True)
+   run_command(["zfs","set","sync=disabled",pool_name + "/test"],check=False)
    
    # Create a directory for the fill files
-   subprocess.run("mkdir /mnt/tank/test/fill",shell=True)
-   
-   # We will track the pool percent used as well as the run number during the fill loop
-   percent_used = 0
-   run_number = 0
-
-   # Check pool size and calculate the fill size required
-   zfs_status = subprocess.check_output("zfs list tank/test -Hpo used,available",shell=True).decode("utf-8")
-   pool_size = int(zfs_status.split()[0]) + int(zfs_status.split()[1])
+   os.makedirs(mount_root + "/" + pool_name + "/test/fill",exist_ok=True)
 
    if frag_level == "none":
       # If no fragmentation is specified, sequentially fill the pool with large blocks to the specified percentage
-      fill_size = pool_size * fill_percent/100
       log.info("Filling pool to " + str(fill_percent) + "%...")
+      percent_used, run_number, bytes_written = write_fill(fill_percent,frag_level,0)
+   elif frag_level == "med" or frag_level == "high":
+      # Fill the pool to 100% and then prune back down to the specified percentage
+      log.info("Filling pool to 100% and pruning " + str(100 - fill_percent) + "%...")
+      percent_used, run_number, bytes_written = write_fill(100,frag_level,0)
    else:
-      # If fragmentation is specified, fill the pool to 100% and then prune the specified percentage of files
-      fill_size = pool_size
-      prune_percent = 100 - fill_percent
-      fill_percent = 100
-      log.info("Filling pool to 100% and pruning " + str(prune_percent) + "%...")
-   
+      bytes_written = fragment_pool(fill_percent,frag_level)
+
+   # Calculate and log the time taken to fill the pool
+   time_taken = time.time() - start
+   span.end()
+   log.info("Filled pool in " + sec_to_dhms(time_taken))
+
+   # Prune files from the fixed recipe fills until the pool is back down to the target fill percentage
+   if frag_level == "high" or frag_level == "med":
+      log.info("Pruning " + str(100 - fill_percent) + "% of pool")
+      prune_pool(fill_percent)
+
+   # Return the average fill speed
+   return str(round(bytes_written/time_taken/1024**3,2))
+
+# Write fill files with the given fragmentation recipe ("none", "med", or "high") until the pool is at fill_percent
+# run_number is the number of the first fio run (runs write to fill/fill<run_number>)
+# Returns the percent used, the next run number, and the number of bytes written
+def write_fill(fill_percent,frag_level,run_number):
+   global log
+   global test_index
+
+   start = time.time()
+
+   # Check pool size and calculate the fill size required
+   zfs_status = run_command(["zfs","list","-Hpo","used,available",pool_name + "/test"])
+   pool_size = int(zfs_status.split()[0]) + int(zfs_status.split()[1])
+   fill_size = pool_size * fill_percent/100
+   start_used = int(zfs_status.split()[0])
+
+   # Each fio round is sized to write the bytes still needed to reach the target. ZFS allocates more than fio writes
+   # (parity, padding, metadata), so the ratio of "used" growth to bytes written is learned from each round.
+   # The first round only aims for 90% of the remaining space since the ratio isn't known yet
+   used_per_byte = None
+   used = int(zfs_status.split()[0])
+   percent_used = round(used/pool_size*100,2)
+   bytes_written = 0
+
    # Fill the pool with the specified fragmentation level
-   while percent_used < fill_percent:
+   while percent_used < fill_percent - fill_tolerance:
+      remaining = fill_size - used
+      if used_per_byte == None:
+         round_bytes = remaining * 0.9
+      else:
+         round_bytes = remaining / used_per_byte
+      round_start_used = used
+
       # Set up FIO command for pool fill
       cmd = """
          fio \
          --rw=write \
          --ioengine=io_uring \
-         --directory=/mnt/tank/test/fill/ \
          --filename_format='$jobname/$jobnum/$filenum' \
          --group_reporting \
          --unified_rw_reporting=both \
+         --output-format=json \
          --nrfiles=2000 \
          --openfiles=100 \
          --file_service_type=sequential \
          --fallocate=none \
       """
+      cmd += "--directory=" + mount_root + "/" + pool_name + "/test/fill/ \\"
       # We get higher fragmentation with small, unaligned blocks
       if frag_level == "high":
-         cmd += "--numjobs=128 \\"
+         numjobs = 128
          cmd += "--bs_unaligned \\"
          cmd += "--bsrange=4Ki-128Ki \\"
          cmd += "--filesize=4Ki-128Ki \\"
       # We get moderate fragmentation with medium, unaligned blocks
       elif frag_level == "med":
-         cmd += "--numjobs=128 \\"
+         numjobs = 128
          cmd += "--bs_unaligned \\"
          cmd += "--bsrange=128Ki-1Mi \\"
          cmd += "--filesize=128Ki-1Mi \\"
       # If no fragmentation is needed, use large, aligned blocks and fewer jobs
       elif frag_level == "none":
-         cmd += "--numjobs=8 \\"
+         numjobs = 8
          cmd += "--bs=1Mi \\"
          # Smaller pools should use smaller files otherwise 0-length files will be created with causes issues with read_latency_monitor()
          if fill_size < 8 * 2000 * 100 * 1024**2:
@@ -1011,24 +2931,27 @@ def fill_pool(fill_percent,frag_level):
             cmd += "--filesize=" + str(file_file_size) + "Mi \\"
          else:
             cmd += "--filesize=100Mi \\"
+      # Limit the amount each job writes this round
+      cmd += "--numjobs=" + str(numjobs) + " \\"
+      cmd += "--io_size=" + str(max(int(round_bytes/numjobs),1024**2)) + " \\"
       cmd += "--name=fill" + str(run_number)
 
       # Start the fill process
-      proc = subprocess.Popen(shlex.split(cmd),stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+      proc = start_process(shlex.split(cmd),stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,text=True)
 
-      # Wait for the fill run to complete (multiple runs required to fill to the specified percentage)
-      # Check pool status every 5 seconds and calculate fill rate and used percentage
-      # Once pool is filled to the specified percentage, terminate the fill process
+      # Wait for the fill run to complete (multiple runs may be required to fill to the specified percentage)
+      # Check pool status and calculate fill rate and used percentage, checking more often as the pool nears the target
+      # If the pool still reaches the specified percentage before the round ends, terminate the fill process
       while proc.poll() == None:
          # Check pool fill status
-         zfs_status = subprocess.check_output("zfs list tank/test -Hpo used,available",shell=True).decode("utf-8")
+         zfs_status = run_command(["zfs","list","-Hpo","used,available",pool_name + "/test"])
          used = int(zfs_status.split()[0])
          avail = int(zfs_status.split()[1])
          percent_used = round(used/(used+avail)*100,2)
 
          # Calculate elapsed time and use it to calculate fill rate and time left
          time_taken = time.time() - start
-         rate_bps = used/time_taken
+         rate_bps = (used - start_used)/time_taken
          rate_gibps = round(rate_bps/1024**3,2)
          if rate_bps == 0:
             rate_bps = 1
@@ -1041,46 +2964,443 @@ def fill_pool(fill_percent,frag_level):
          total_tib_str =  "{:.2f}".format(round((used+avail)/1024**4,2))
          percent_used_str = "{:.2f}".format(percent_used)
          rate_gibps_str = "{:.2f}".format(rate_gibps)
-         log.info(test_index + " Filling pool to " + str(fill_percent) + "% (frag @ " + frag_level + "): " + used_tib_str + \
+         log.info(test_index + " Filling pool to " + str(fill_percent) + "% (frag @ " + str(frag_level) + "): " + used_tib_str + \
             "TiB/" + total_tib_str + "TiB >> " + percent_used_str + "% (" + rate_gibps_str + "Gi/s | ETA " + sec_to_dhms(time_left_sec) + ")")
+         set_metric("resilver_fill_used_percent",percent_used)
+         set_metric("resilver_fill_target_percent",fill_percent)
+         set_metric("resilver_fill_rate_bytes",rate_bps)
          
          # If pool is filled to the specified percentage, terminate the fill process and break the loop
          if percent_used >= fill_percent:
             proc.terminate()
             break
-         time.sleep(5)
+         try:
+            proc.wait(timeout=min(5,max(fill_min_poll_interval,time_left_sec/4)))
+         except subprocess.TimeoutExpired:
+            pass
+
+      # Learn how much pool space each byte written by fio takes up from what this round wrote
+      written = get_fio_bytes_written(proc.communicate()[0])
+      zfs_status = run_command(["zfs","list","-Hpo","used,available",pool_name + "/test"])
+      used = int(zfs_status.split()[0])
+      avail = int(zfs_status.split()[1])
+      percent_used = round(used/(used+avail)*100,2)
+      bytes_written += written
+      if written > 0 and used > round_start_used:
+         used_per_byte = (used - round_start_used)/written
       
       # Increment the run number and start the next fill run
       run_number += 1
    
-   # Calculate and log the time taken to fill the pool
+   log.info("Fill reached " + str(percent_used) + "% (target " + str(fill_percent) + "%, error " + \
+      str(round(percent_used - fill_percent,2)) + "%) in " + sec_to_dhms(time.time() - start))
+   return percent_used, run_number, bytes_written
+
+# Fragment the pool to a target fragmentation percent (as reported by zpool list) at the given fill percent
+# After a sequential fill, each round writes small files above the fill target and prunes random files back down to it;
+# the holes left behind fragment free space. Rounds are sized by how far fragmentation is from the target, and an
+# overshoot is corrected with large sequential writes, which fill in small free segments
+# Returns the number of bytes written
+def fragment_pool(fill_percent,target_frag):
+   global log
+
+   log.info("Filling pool to " + str(fill_percent) + "% and fragmenting to " + str(target_frag) + "%...")
+   percent_used, run_number, bytes_written = write_fill(fill_percent,"none",0)
+   frag = get_pool_frag()
+   trajectory = [(0,percent_used,frag)]
+
+   frag_round = 0
+   while abs(target_frag - frag) > frag_tolerance and frag_round < frag_max_rounds:
+      frag_round += 1
+      error = target_frag - frag
+      if error > 10:
+         recipe = "high"
+      elif error > 0:
+         recipe = "med"
+      else:
+         recipe = "none"
+
+      # Keep at least 1% of the pool free so writes don't fail
+      swing = min(max(abs(error) * frag_gain,2),99 - fill_percent)
+      log.info("Fragmentation round " + str(frag_round) + ": " + str(frag) + "% (target " + str(target_frag) + "%), writing " + \
+         str(round(swing,1)) + "% of pool with " + recipe + " recipe")
+      percent_used, run_number, written = write_fill(fill_percent + swing,recipe,run_number)
+      bytes_written += written
+      prune_pool(fill_percent)
+
+      percent_used = get_pool_used_percent()
+      frag = get_pool_frag()
+      trajectory.append((frag_round,percent_used,frag))
+
+   if abs(target_frag - frag) <= frag_tolerance:
+      log.info("Fragmentation converged to " + str(frag) + "% in " + str(frag_round) + " rounds")
+   else:
+      log.info("Fragmentation did not converge after " + str(frag_round) + " rounds, pool at " + str(frag) + "%")
+   log.info("Fragmentation trajectory (round, used %, frag %): " + str(trajectory))
+   return bytes_written
+
+# Returns the pool fragmentation percent from zpool list
+def get_pool_frag():
+   frag = run_command(["zpool","list","-Hpo","frag",pool_name]).strip()
+   return int(frag) if frag.isdigit() else 0
+
+# Returns the percent of the dataset's space that is used
+def get_pool_used_percent():
+   zfs_status = run_command(["zfs","list","-Hpo","used,available",pool_name + "/test"])
+   used = int(zfs_status.split()[0])
+   return round(used/(used + int(zfs_status.split()[1]))*100,2)
+
+# Delete random fill files until the pool is at the target fill percentage
+# Each fio job directory (fill/<run>/<jobnum>) is pruned by its own worker, which deletes the same fraction of the bytes in
+# that directory, so deletes are spread evenly over the pool. ZFS frees space asynchronously, so after each pass we wait
+# for the frees to finish and run another pass on whatever is left over
+def prune_pool(target_percent):
+   global log
+
+   start = time.time()
+   span = TraceSpan("prune")
+   seed = prune_seed if prune_seed != None else random.randrange(2**32)
+   log.info("Prune seed: " + str(seed))
+
+   fill_dir = mount_root + "/" + pool_name + "/test/fill"
+   job_dirs = sorted(job.path for run in os.scandir(fill_dir) if run.is_dir() for job in os.scandir(run.path) if job.is_dir())
+
+   num_removed = 0
+   bytes_removed = 0
+   prune_pass = 0
+   zfs_status = run_command(["zfs","list","-Hpo","used,available",pool_name + "/test"])
+   used = int(zfs_status.split()[0])
+   total = used + int(zfs_status.split()[1])
+   while used/total*100 > target_percent + fill_tolerance and prune_pass < 5:
+      # Fraction of the fill data to delete this pass; "referenced" is the space used by the fill files themselves
+      referenced = int(run_command(["zfs","get","-Hpo","value","referenced",pool_name + "/test"]))
+      prune_fraction = min((used - total * target_percent/100)/max(referenced,1),1)
+
+      with concurrent.futures.ThreadPoolExecutor(max_workers=prune_workers) as executor:
+         for files, size in executor.map(prune_directory,job_dirs,[prune_fraction] * len(job_dirs),
+               [str(seed) + ":" + str(prune_pass)] * len(job_dirs)):
+            num_removed += files
+            bytes_removed += size
+
+      # Wait for ZFS to finish freeing the deleted blocks before checking how full the pool is
+      run_command(["zpool","sync",pool_name],check=False)
+      run_command(["zpool","wait","-t","free",pool_name],check=False)
+      zfs_status = run_command(["zfs","list","-Hpo","used,available",pool_name + "/test"])
+      used = int(zfs_status.split()[0])
+      prune_pass += 1
+
+   percent_used = round(used/total*100,2)
    time_taken = time.time() - start
-   log.info("Filled pool in " + sec_to_dhms(time_taken))
+   span.end()
+   log.info("Pruned " + str(num_removed) + " files (" + str(round(bytes_removed/1024**3,2)) + " GiB) in " + sec_to_dhms(time_taken) + \
+      " (" + str(round(num_removed/max(time_taken,1))) + " files/s, " + str(prune_pass) + " passes), pool at " + str(percent_used) + \
+      "% full (target " + str(target_percent) + "%)")
+   return percent_used
+
+# Delete a random selection of files from a directory totalling the given fraction of its bytes
+# The selection only depends on the seed and the directory, so the same seed prunes the same files
+def prune_directory(path,prune_fraction,seed):
+   files = sorted((entry.name, entry.stat().st_size) for entry in os.scandir(path) if entry.is_file())
+   budget = sum(size for name, size in files) * prune_fraction
+   random.Random(seed + ":" + path).shuffle(files)
+
+   num_removed = 0
+   bytes_removed = 0
+   for name, size in files:
+      if bytes_removed >= budget:
+         break
+      os.remove(os.path.join(path,name))
+      num_removed += 1
+      bytes_removed += size
+   return num_removed, bytes_removed
 
-   # If fragmentation is specified, prune the specified percentage of files
-   if frag_level == "high" or frag_level == "med":
-      start = time.time()
-      log.info("Pruning " + str(prune_percent) + "% of files")
+# Total bytes written by a fio run from its JSON output, or 0 if the output can't be parsed
+def get_fio_bytes_written(output):
+   try:
+      report = json.loads(output[output.index("{"):])
+      return sum(job["write"]["io_bytes"] for job in report["jobs"])
+   except (ValueError, KeyError):
+      return 0
 
-      # Prune random files until the specified size is reached
-      for root, dirs, files in os.walk("/mnt/tank/test/fill/"):
-         for file in files:
-            if random.random() < prune_percent/100:
-               os.remove(os.path.join(root,file))
+# Save the filled pool as a golden image so later runs can restore it instead of refilling
+# The key and fill speed are stored as user properties on the dataset so they survive a restart
+def save_golden_image(golden_key,fill_speed):
+   global log
 
-      # Get the current pool status and calculate the size to prune to achieve the specified fill percentage
-      zfs_status = subprocess.check_output("zfs list tank/test -Hpo used,available",shell=True).decode("utf-8")
-      used = int(zfs_status.split()[0])
-      avail = int(zfs_status.split()[1])
-      total = used + avail
-      percent_used = round(used/total*100,2)
+   start = time.time()
+   span = TraceSpan("save_golden_image")
+   log.info("Saving golden image (" + golden_image + ")...")
 
-      # Calculate and log the time taken to prune the files
-      time_taken = time.time() - start
-      log.info("Files pruned in " + sec_to_dhms(time_taken) + ", pool at " + str(percent_used) + "% full")
+   # Drop any stale golden image before taking a new one, including a checkpoint left by an older version of this script
+   run_command(["zfs","destroy",pool_name + "/test@golden"],check=False,stderr=subprocess.DEVNULL)
+   run_command(["zpool","checkpoint","-d",pool_name],check=False,stderr=subprocess.DEVNULL)
 
-   # Return the average fill speed
-   return str(rate_gibps)
+   run_command(["zfs","set","resilver:golden=" + golden_key,"resilver:fillspeed=" + str(fill_speed),pool_name + "/test"])
+   run_command(["zfs","snapshot",pool_name + "/test@golden"])
+
+   time_taken = time.time() - start
+   span.end()
+   log.info("Saved golden image in " + sec_to_dhms(time_taken))
+
+# Returns the key of the golden image held by the current pool, or None if there isn't a usable one
+def get_golden_image():
+   try:
+      golden_key = run_command(["zfs","get","-Hpo","value","resilver:golden",pool_name + "/test"],stderr=subprocess.DEVNULL).strip()
+   except:
+      return None
+   if golden_key == "-":
+      return None
+
+   # Make sure the snapshot backing the image still exists
+   try:
+      run_command(["zfs","list","-Ho","name",pool_name + "/test@golden"],stderr=subprocess.DEVNULL)
+      return golden_key
+   except:
+      return None
+
+# Returns the fill speed recorded when the golden image was saved
+def get_golden_fill_speed():
+   return run_command(["zfs","get","-Hpo","value","resilver:fillspeed",pool_name + "/test"]).strip()
+
+# Restore the pool to its golden image
+# Returns the time taken to restore and the number of bytes that were rolled back
+def restore_golden_image():
+   global log
+
+   start = time.time()
+   span = TraceSpan("restore_golden_image")
+
+   # Kill any running instances of fio, otherwise the rollback or export can fail
+   if kill_fio() > 0:
+      wait_ready("fio_exited",1,lambda: fio_running() == 0)
+
+   # "written" is the amount of data written to the dataset since the golden snapshot
+   restore_bytes = int(run_command(["zfs","get","-Hpo","value","written",pool_name + "/test"]).strip())
+   log.info("Rolling back dataset to golden snapshot (" + str(round(restore_bytes/1024**3,2)) + " GiB)...")
+   run_command(["zfs","rollback","-r",pool_name + "/test@golden"])
+
+   time_taken = round(time.time() - start,2)
+   span.end()
+   log.info("Restored golden image in " + sec_to_dhms(time_taken))
+   return time_taken, restore_bytes
+
+# Append an event to the campaign journal
+# Each event is a single JSON line written and synced to disk before returning, so a crash or power loss can at worst
+# leave a partial last line; concurrent pool workers append to the same file and tag events with their pool name
+def journal(event,**fields):
+   if journal_file == "":
+      return
+   entry = {"event": event,"time": round(time.time(),3),"pool": pool_name}
+   entry.update(fields)
+   with open(journal_file,"a") as journal_out:
+      journal_out.write(json.dumps(entry) + "\n")
+      journal_out.flush()
+      os.fsync(journal_out.fileno())
+
+# Read the journal of an interrupted run and set up finished_tests and resume_fills so run_layout() skips finished
+# tests and reuses filled pools. The journal only counts if it belongs to the same campaign, i.e., the layouts and
+# schedules haven't changed since it was started; otherwise a new journal is started
+def resume_campaign(layouts,total_tests):
+   global log
+   global finished_tests
+   global resume_fills
+
+   if journal_file == "":
+      return
+
+   signature = hashlib.sha1(json.dumps([layouts,frag_schedule,recordsize_schedule,test_schedule,tunables_schedule,fill_percent],
+      sort_keys=True).encode("utf-8")).hexdigest()
+
+   # Read the events of the last campaign in the journal; a partial last line from a crash is ignored
+   events = []
+   try:
+      with open(journal_file,"r") as journal_in:
+         for line in journal_in:
+            try:
+               entry = json.loads(line)
+            except ValueError:
+               continue
+            if entry["event"] == "campaign_start":
+               events = []
+            events.append(entry)
+   except FileNotFoundError:
+      pass
+
+   if events == [] or events[0].get("signature") != signature or events[-1]["event"] == "campaign_finished":
+      if events != []:
+         log.info("Journal is from a different or finished campaign, starting a new journal")
+         os.replace(journal_file,journal_file + ".old")
+      journal("campaign_start",signature=signature,total_tests=total_tests)
+      return
+
+   # A pool only holds the last fill completed on it; creating it again discards that fill
+   for entry in events:
+      if entry["event"] == "test_finished":
+         finished_tests.add(entry["test"])
+      elif entry["event"] == "pool_created":
+         resume_fills.pop(entry["pool"],None)
+      elif entry["event"] == "pool_filled":
+         resume_fills[entry["pool"]] = entry
+
+   log.info("Resuming interrupted campaign: " + str(len(finished_tests)) + "/" + str(total_tests) + " tests finished, " + \
+      str(len(resume_fills)) + " filled pool(s) to reuse")
+   journal("campaign_resumed",finished_tests=len(finished_tests))
+
+# Returns the key of the fill on the current pool (set by run_layout() once the fill completes), or None
+def get_pool_fill():
+   try:
+      fill_key = run_command(["zfs","get","-Hpo","value","resilver:fill",pool_name + "/test"],stderr=subprocess.DEVNULL).strip()
+   except:
+      return None
+   if fill_key == "-":
+      return None
+   return fill_key
+
+# Bring a pool that was part way through a test when the run was interrupted back to a healthy state
+def recover_pool():
+   global log
+
+   start = time.time()
+   span = TraceSpan("recover_pool")
+   log.info("Recovering pool from the interrupted run...")
+   if kill_fio() > 0:
+      wait_ready("fio_exited",1,lambda: fio_running() == 0)
+
+   # The target disk may have been left offline; onlining an online disk is harmless but may fail on some versions
+   try:
+      online_disk(target_disk)
+   except:
+      run_command(["zpool","clear",pool_name],check=False,stderr=subprocess.DEVNULL)
+   run_command(["zpool","wait","-t","resilver,scrub",pool_name],check=False,stderr=subprocess.DEVNULL)
+   detach_distributed_spares()
+
+   time_taken = time.time() - start
+   span.end()
+   log.info("Recovered pool in " + sec_to_dhms(time_taken))
+
+# Clear the ARC before a test and log how long it took
+# "arc" shrinks the ARC in place (see shrink_arc()), which is much faster than an export/import of a large pool, and falls
+# back to export/import if it can't. Concurrent pools always use export/import; the ARC is shared, and shrinking it would
+# evict the cache of pools that are in the middle of a test
+def reset_cache():
+   global log
+
+   start = time.time()
+   span = TraceSpan("cache_reset")
+   method = "export/import"
+   if cache_reset == "arc" and disk_group == None:
+      try:
+         if shrink_arc():
+            method = "ARC shrink"
+         else:
+            log.info("ARC did not shrink to " + str(round(arc_reset_size/1024**2)) + " MiB within " + str(arc_reset_timeout) + \
+               " seconds, falling back to export/import")
+      except (OSError, KeyError, ValueError, subprocess.CalledProcessError) as e:
+         log.info("Could not shrink ARC (" + str(e) + "), falling back to export/import")
+   if method == "export/import":
+      export_import_pool()
+
+   time_taken = time.time() - start
+   span.end()
+   log.info("Reset ARC (" + method + ") in " + sec_to_dhms(time_taken) + " (" + str(round(time_taken,2)) + " seconds)")
+
+# Returns the ARC kstats (kstat_root/arcstats) as a dict of name to value
+def get_arcstats():
+   with open(os.path.join(kstat_root,"arcstats"),"rb") as arcstats_file:
+      return dict(zip(*parse_kstat(arcstats_file.read())))
+
+# Read a ZFS module parameter
+def get_zfs_parameter(name):
+   with open(os.path.join(zfs_parameters_path,name)) as parameter:
+      return parameter.read().strip()
+
+# Write a ZFS module parameter
+def set_zfs_parameter(name,value):
+   with open(os.path.join(zfs_parameters_path,name),"w") as parameter:
+      parameter.write(str(value))
+
+# Set a test's ZFS module tunables ({parameter: value}), saving the values they replace for restore_tunables()
+# Returns the settings as read back from the module, e.g., "zfs_scan_vdev_limit=16777216 zfs_resilver_min_time_ms=5000",
+# or "-" if none were set. Tunables that can't be set are logged and left out
+def apply_tunables(tunables):
+   global log
+
+   applied = []
+   for name, value in tunables.items():
+      try:
+         if name not in tunables_defaults:
+            tunables_defaults[name] = get_zfs_parameter(name)
+         set_zfs_parameter(name,value)
+         applied.append(name + "=" + get_zfs_parameter(name))
+      except OSError as e:
+         log.info("Could not set tunable " + name + " to " + str(value) + " (" + str(e) + ")")
+   if applied == []:
+      return "-"
+   log.info("Set ZFS tunables: " + " ".join(applied))
+   return " ".join(applied)
+
+# Put back the ZFS module tunables changed by apply_tunables()
+def restore_tunables():
+   global log
+
+   for name, value in tunables_defaults.items():
+      try:
+         set_zfs_parameter(name,value)
+      except OSError as e:
+         log.info("Could not restore tunable " + name + " to " + value + " (" + str(e) + ")")
+   if tunables_defaults != {}:
+      log.info("Restored ZFS tunables: " + " ".join(name + "=" + value for name, value in tunables_defaults.items()))
+   tunables_defaults.clear()
+
+# Shrink the ARC to arc_reset_size by temporarily lowering zfs_arc_min and zfs_arc_max, then put the limits back
+# Caching is turned off on the dataset while the ARC shrinks so nothing reads blocks back in, and the page cache is dropped
+# (which also asks the ARC to give memory back). Returns True if arcstats shows the ARC got down to arc_reset_size
+def shrink_arc():
+   global log
+
+   # Restore the module parameters rather than arcstats c_min/c_max, which report the sizes picked for the default of 0
+   original_min = get_zfs_parameter("zfs_arc_min")
+   original_max = get_zfs_parameter("zfs_arc_max")
+   arcstats = get_arcstats()
+   log.info("Shrinking ARC from " + str(round(arcstats["size"]/1024**2)) + " MiB to clear cached data...")
+
+   caching = run_command(["zfs","get","-Hpo","value","primarycache,secondarycache",pool_name + "/test"]).split()
+   run_command(["zfs","set","primarycache=none","secondarycache=none",pool_name + "/test"])
+   try:
+      # zfs_arc_min has to stay below zfs_arc_max, so the minimum is lowered first and raised last
+      set_zfs_parameter("zfs_arc_min",arc_reset_size//2)
+      set_zfs_parameter("zfs_arc_max",arc_reset_size)
+      with open("/proc/sys/vm/drop_caches","w") as drop_caches:
+         drop_caches.write("3")
+      deadline = time.monotonic() + arc_reset_timeout/time_scale
+      while get_arcstats()["size"] > arc_reset_size and time.monotonic() < deadline:
+         time.sleep(probe_interval/time_scale)
+      shrunk = get_arcstats()["size"] <= arc_reset_size
+   finally:
+      run_command(["zfs","set","primarycache=" + caching[0],"secondarycache=" + caching[1],pool_name + "/test"])
+      set_zfs_parameter("zfs_arc_max",original_max)
+      set_zfs_parameter("zfs_arc_min",original_min)
+   return shrunk
+
+# Export and import the pool, which drops everything it had in the ARC
+def export_import_pool():
+   global log
+
+   log.info("Exporting and importing pool to clear ARC...")
+
+   # Pool will occasionally fail to export if pool is busy; retry once the pool has gone idle
+   pool_exported = False
+   export_attempts = 0
+   while pool_exported == False:
+      try:
+         run_command(["zpool","export",pool_name])
+         pool_exported = True
+      except:
+         export_attempts += 1
+         wait_ready("pool_idle",30,PoolIdleProbe())
+         log.info("Failed to export pool, retrying... Attempt " + str(export_attempts))
+
+   run_command(["zpool","import",pool_name])
 
 # Offline specified disk from the pool
 def offline_disk(disk):
@@ -1088,7 +3408,7 @@ def offline_disk(disk):
    disk = "/dev/" + disk
    if format_disks: disk += "1"
    log.info("Taking " + disk + " offline...")
-   subprocess.check_output("zpool offline tank -f " + disk,shell=True,stderr=subprocess.DEVNULL)
+   run_command(["zpool","offline",pool_name,"-f",disk],stderr=subprocess.DEVNULL)
 
 # Online specified disk on the pool
 def online_disk(disk):
@@ -1096,94 +3416,327 @@ def online_disk(disk):
    disk = "/dev/" + disk
    if format_disks: disk += "1"
    log.info("Bringing " + disk + " online...")
-   subprocess.check_output("zpool online tank " + disk,shell=True,stderr=subprocess.DEVNULL)
-   subprocess.check_output("zpool clear tank",shell=True,stderr=subprocess.DEVNULL)
+   run_command(["zpool","online",pool_name,disk],stderr=subprocess.DEVNULL)
+   run_command(["zpool","clear",pool_name],stderr=subprocess.DEVNULL)
+
+# Rebuild mode of a test on a layout: the test's "rebuild" setting, or rebuild_mode if it doesn't have one
+# Distributed spares only exist on dRAID, so other layouts use "offline" (where ZED swaps in a hot spare) instead of
+# "draid_spare", and raidz can't rebuild sequentially, so it uses a healing resilver onto the wiped disk instead of "sequential"
+def get_rebuild_mode(layout,test):
+   mode = test.get("rebuild",rebuild_mode)
+   if mode == "draid_spare" and not layout["layout"].startswith("draid"):
+      return "offline"
+   if mode == "sequential" and layout["layout"].startswith("raidz"):
+      return "replace"
+   return mode
+
+# Fail the target disk and start rebuilding its data the way the rebuild mode says
+# "offline" faults the disk and leaves the rest to ZED; the other modes take the disk offline (which ZED leaves alone) and
+# replace it themselves, either with a distributed spare or with the same disk after wiping it so it looks brand new
+def start_rebuild(disk,mode):
+   global log
 
-# Check resilver status
-def get_resilver_status():
+   discard_checkpoint()
+   if mode == "offline":
+      offline_disk(disk)
+      return
+
+   device = "/dev/" + disk
+   if format_disks: device += "1"
+   log.info("Taking " + device + " offline...")
+   run_command(["zpool","offline",pool_name,device],stderr=subprocess.DEVNULL)
+   if mode == "draid_spare":
+      spares = get_distributed_spares("AVAIL")
+      if spares == []:
+         raise Exception("No available distributed spare on " + pool_name)
+      spare = spares[0]
+      log.info("Replacing " + device + " with distributed spare " + spare + " (sequential rebuild)...")
+      run_command(["zpool","replace",pool_name,device,spare])
+   else:
+      wipe_disk(device)
+      log.info("Replacing " + device + " with itself after wiping it" + (" (sequential rebuild)" if mode == "sequential" else "") + "...")
+      run_command(["zpool","replace"] + (["-s"] if mode == "sequential" else []) + [pool_name,device])
+
+# Discard the pool's checkpoint, if it has one (e.g., taken by hand or left by an older version of this script)
+# ZFS won't attach a spare or replace or detach a device while a checkpoint exists, so the resilver would never start
+def discard_checkpoint():
    global log
 
-   # Get resilver status from zpool status output
-   resilver_status = subprocess.check_output("zpool status tank",shell=True).decode("utf-8")
-
-   # The output of the zpool status command is slightly different for different ZFS layouts
-   if "draid" in resilver_status:
-      raid_type = "draid"
-   elif "raidz" in resilver_status:
-      raid_type = "raidz"
-   elif "mirror" in resilver_status:
-      raid_type = "mirror"
-
-   # Check if resilver is in progress or if it has completed
-   if "currently being resilvered" in resilver_status:
-      resilver_status = resilver_status.splitlines()
-      for line in resilver_status:
-         if "scanned" in line:
-            # Extract scan speed from the zpool status output
-            scan_info = line.split(",")[0].split()
-            scan_speed = scan_info[len(scan_info)-1]
-            # On RAIDZ and mirrored vdevs, the scan speed is not listed
-            if scan_speed == "scanned": scan_speed = "-"
-
-            # Extract issue speed from the zpool status output
-            issue_info = line.split(",")[1].split()
-            issue_speed = issue_info[len(issue_info)-1]
-            # At the very start of a resilver, issue speed is not listed
-            if issue_speed == "issued": issue_speed = "-"
-         
-         if "resilvered" in line:
-            # Extract percent done and time left from the zpool status output
-            percent_done = line.split()[2]
-            time_left = line.split()[4]
-            # If resilver is at 100%, time left will not be listed in the zpool status output
-            if time_left == "no":
-               time_left = "00:00:00" 
-            if line.split()[5] == "days":
-               days_left = int(line.split()[4])
-               time_left = line.split()[6]
-               time_left_hrs = int(time_left.split(":")[0]) + 24 * days_left
-               time_left = time_left.replace(time_left.split(":")[0],str(time_left_hrs), 1)
-      # Return all the resilver progress information
-      return ("resilvering",scan_speed,issue_speed,percent_done,time_left)
-   
-   # If resilver has completed (but we still have a faulted disk), get the resilver rate(s) and time
-   elif "persistent errors" in resilver_status:
-      resilver_status = resilver_status.splitlines()
-      for line in resilver_status:
-         # For draid vdevs, get the resilver time, amount of data scanned, and amount of data issued
-         if raid_type == "draid":
-            if "resilvered" in line:
-               resilver_time = line.split()[5]
-               if line.split()[6] == "days":
-                  resilver_days = int(line.split()[5])
-                  resilver_time = line.split()[7]
-                  resilver_time_hrs = int(resilver_time.split(":")[0]) + 24 * resilver_days
-                  resilver_time = resilver_time.replace(resilver_time.split(":")[0],str(resilver_time_hrs), 1)
-            if "scanned," in line:
-               scanned = line.split()[0]
-               issued = line.split()[4]
-            if "scanned at" in line:
-               scanned = line.split()[2]
-               issued = line.split()[8]
-
-         # For RAIDZ and mirrored vdevs, get the resilver time and amount of data issued (scanned amount is not listed)
-         elif raid_type == "raidz" or raid_type == "mirror":
-            if "resilvered" in line:
-               resilver_time = line.split()[4]
-               scanned = "-"
-               issued = line.split()[2]
-               if line.split()[5] == "days":
-                  resilver_days = int(line.split()[4])
-                  resilver_time = line.split()[6]
-                  resilver_time_hrs = int(resilver_time.split(":")[0]) + 24 * resilver_days
-                  resilver_time = resilver_time.replace(resilver_time.split(":")[0],str(resilver_time_hrs), 1)
-      
-      # Return resilver completion information
-      return ("complete",resilver_time,scanned,issued)
-   
-   # If the pool is healthy, return "healthy"
+   checkpoint = run_command(["zpool","list","-Hpo","checkpoint",pool_name]).strip()
+   if checkpoint not in ("-","0"):
+      log.info("Discarding pool checkpoint, which would block the spare attach or replace...")
+      run_command(["zpool","checkpoint","-d","-w",pool_name])
+
+# Put the pool back the way it was before start_rebuild() so the next test starts from the same layout
+# A wiped and replaced disk is already back in its place; a faulted or offlined disk is brought back online
+def end_rebuild(disk,mode):
+   if mode in ("offline","draid_spare"):
+      online_disk(disk)
    else:
-      return "healthy"
+      run_command(["zpool","clear",pool_name],stderr=subprocess.DEVNULL)
+
+# Clear the ZFS labels at both ends of a disk so ZFS treats it as a new disk
+# Scripted sim disks aren't real devices, so the stand-in zpool labelclear does it for them
+def wipe_disk(device):
+   global log
+
+   log.info("Wiping ZFS labels on " + device + "...")
+   if backend == "sim" and sim_vdevs == "scripted":
+      run_command(["zpool","labelclear","-f",device])
+      return
+   # Each end of the device holds two 256 KiB labels; the end labels are aligned down to 256 KiB
+   fd = os.open(device,os.O_WRONLY)
+   try:
+      size = os.lseek(fd,0,os.SEEK_END)
+      zeros = bytes(1024**2)
+      os.pwrite(fd,zeros,0)
+      os.pwrite(fd,zeros,max(size//(256*1024)*(256*1024) - len(zeros),0))
+      os.fsync(fd)
+   finally:
+      os.close(fd)
+
+# Names of the pool's dRAID distributed spares (e.g., "draid2-0-1") in the given state ("AVAIL" or "INUSE")
+def get_distributed_spares(state):
+   output = run_command(["zpool","status","-p",pool_name],stderr=subprocess.DEVNULL)
+   return re.findall(r"^\s+(draid\d+-\d+-\d+)\s+" + state,output,re.MULTILINE)
+
+# Return distributed spares that are still in use to the pool once the disks they stood in for are back
+def detach_distributed_spares():
+   global log
+
+   for spare in get_distributed_spares("INUSE"):
+      try:
+         run_command(["zpool","detach",pool_name,spare],stderr=subprocess.PIPE)
+      except subprocess.CalledProcessError as e:
+         log.info("Could not detach distributed spare " + spare + ", it stays in use for the next test: " + e.stderr.decode("utf-8").strip())
+
+# Wait for the scrub ZFS starts after a sequential rebuild to verify the rebuilt data
+# Returns how long the scrub took (seconds, from zpool events if available), or "-" if no scrub started
+def wait_for_verify_scrub(resilver_events):
+   global log
+
+   log.info("Waiting for the post-rebuild verification scrub...")
+   span = TraceSpan("verify_scrub")
+   wait_start = time.time()
+   if not resilver_events.scrub_started.wait(timeout=resilver_start_timeout/time_scale):
+      span.end()
+      log.info("No scrub started within " + str(resilver_start_timeout) + " seconds of the rebuild finishing")
+      return "-"
+   run_command(["zpool","wait","-t","scrub",pool_name],check=False,stderr=subprocess.DEVNULL)
+   resilver_events.scrub_finished.wait(timeout=5/time_scale)
+   span.end()
+
+   scrub_start = resilver_events.scrub_start_time
+   scrub_end = resilver_events.scrub_end_time if resilver_events.scrub_end_time != None else time.time()
+   verify_seconds = round((scrub_end - scrub_start) * time_scale,3)
+   log.info("Verification scrub finished in " + str(verify_seconds) + " seconds (" + str(round((time.time() - wait_start) * time_scale,3)) + \
+      " seconds after the rebuild)")
+   return verify_seconds
+
+# Follows "zpool events" for the pool being tested and records when the resilver (or sequential rebuild) starts and
+# finishes, and when the scrub that follows a sequential rebuild starts and finishes
+# Event timestamps come from the kernel, so they are accurate to well under a second
+class ResilverEvents:
+   def __init__(self):
+      self.start_time = None
+      self.end_time = None
+      self.started = threading.Event()
+      self.finished = threading.Event()
+      self.scrub_start_time = None
+      self.scrub_end_time = None
+      self.scrub_started = threading.Event()
+      self.scrub_finished = threading.Event()
+
+      # zpool events replays the event history first; ignore anything older than this
+      self.armed_time = time.time()
+      self.proc = start_process(["zpool","events","-H","-f",pool_name],stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,text=True)
+      self.thread = threading.Thread(target=self.read_events,daemon=True)
+      self.thread.start()
+
+   # Runs on its own thread; blocks on the zpool events pipe so the sampling loop never has to
+   def read_events(self):
+      for line in self.proc.stdout:
+         event = line.split()
+         if len(event) < 5:
+            continue
+         try:
+            event_time = get_event_time(" ".join(event[0:4]))
+         except ValueError:
+            continue
+         if event_time < self.armed_time - 1:
+            continue
+
+         if event[4] == "sysevent.fs.zfs.resilver_start" and self.start_time == None:
+            self.start_time = event_time
+            self.started.set()
+         elif event[4] == "sysevent.fs.zfs.resilver_finish" and self.start_time != None:
+            self.end_time = event_time
+            self.finished.set()
+         elif event[4] == "sysevent.fs.zfs.scrub_start" and self.end_time != None and self.scrub_start_time == None:
+            self.scrub_start_time = event_time
+            self.scrub_started.set()
+         elif event[4] == "sysevent.fs.zfs.scrub_finish" and self.scrub_start_time != None:
+            self.scrub_end_time = event_time
+            self.scrub_finished.set()
+
+   def stop(self):
+      self.proc.terminate()
+      self.thread.join(timeout=5)
+
+# Convert a zpool events timestamp (e.g. "Oct 18 2026 12:34:56.123456789") to seconds since the epoch
+def get_event_time(event_time):
+   seconds, fraction = event_time.split(".")
+   return datetime.datetime.strptime(seconds,"%b %d %Y %H:%M:%S").timestamp() + float("0." + fraction)
+
+# Check resilver status
+# Resilvers that finished before "since" (seconds since the epoch) are left over from an earlier test and reported as "pending"
+# If replaced is True, the failed disk was replaced rather than left faulted, so a finished resilver counts even though the
+# pool is healthy again
+# Never raises; if the status can't be read or parsed the returned state is "unknown"
+def get_resilver_status(since=0,replaced=False):
+   global log
+   global status_backend
+
+   # Use JSON output if this version of ZFS supports it, otherwise fall back to parsable text output
+   if status_backend == "auto":
+      try:
+         run_command(["zpool","status","-jp","--json-int",pool_name],stderr=subprocess.DEVNULL)
+         status_backend = "json"
+      except:
+         status_backend = "text"
+      log.info("Using " + status_backend + " pool status backend")
+
+   try:
+      if status_backend == "json":
+         output = run_command(["zpool","status","-jp","--json-int",pool_name],stderr=subprocess.DEVNULL)
+         resilver_status = parse_status_json(output,pool_name,replaced)
+      else:
+         output = run_command(["zpool","status","-p",pool_name],stderr=subprocess.DEVNULL)
+         resilver_status = parse_status_text(output,replaced)
+   except Exception as e:
+      log.info("Could not read pool status: " + str(e))
+      return ResilverProgress("unknown")
+
+   # Text status times only have one second resolution, so allow a second of slack
+   if resilver_status.state == "complete" and resilver_status.end_time != None and resilver_status.end_time < since - 1:
+      return ResilverProgress("pending")
+   return resilver_status
+
+# Parse the output of "zpool status -jp --json-int"
+def parse_status_json(output,pool,replaced=False):
+   status = json.loads(output)["pools"][pool]
+   scan = status.get("scan_stats")
+   errors = int(status.get("error_count",0))
+
+   # No resilver has run on this pool yet
+   if scan == None or scan["function"] != "RESILVER":
+      return ResilverProgress("healthy",errors=errors)
+
+   start_time = get_scan_time(scan["start_time"])
+   scanned = int(scan["examined"])
+   issued = int(scan["issued"])
+   total = int(scan["to_examine"])
+   resilvered = int(scan["processed"])
+   errors += int(scan["errors"])
+
+   if scan["state"] == "FINISHED":
+      end_time = get_scan_time(scan["end_time"])
+      # A finished resilver with every device back online is from a previous test (unless the disk was replaced)
+      if status["state"] == "ONLINE" and not replaced:
+         return ResilverProgress("healthy",errors=errors)
+      return ResilverProgress("complete",scanned=scanned,issued=issued,total=total,resilvered=resilvered,start_time=start_time,
+         end_time=end_time,resilver_time=end_time - start_time,errors=errors)
+
+   # Rates are calculated the same way zpool status does: bytes this pass divided by time spent this pass (minus time paused)
+   elapsed = max(time.time() - get_scan_time(scan["pass_start"]) - int(scan.get("scrub_spent_paused",0)),1)
+   scan_rate = int(scan.get("bytes_per_scan",scanned))/elapsed
+   issue_rate = int(scan.get("issued_bytes_per_scan",issued))/elapsed
+   percent_done = issued/total*100 if total > 0 else 0
+   time_left = (total - issued)/issue_rate if issue_rate > 0 else None
+   return ResilverProgress("resilvering",scanned=scanned,issued=issued,total=total,resilvered=resilvered,scan_rate=scan_rate,
+      issue_rate=issue_rate,percent_done=percent_done,time_left=time_left,start_time=start_time,errors=errors)
+
+# Scan times are seconds since the epoch with --json-int, but older versions print them as dates
+def get_scan_time(scan_time):
+   try:
+      return int(scan_time)
+   except ValueError:
+      return time.mktime(time.strptime(scan_time.strip(),"%a %b %d %H:%M:%S %Y"))
+
+# Parse the output of "zpool status -p"
+# The scan lines differ between versions and layouts, e.g.:
+#   rebuild:       scan: resilver (draid1:8d:82c:2s-0) in progress since Sun Oct 18 11:00:00 2026
+#   dRAID/newer:   1.23T / 4.56T scanned at 1.2G/s, 500G / 4.56T issued at 800M/s
+#   older:         4.56T scanned at 1.2G/s, 500G issued at 800M/s, 4.56T total
+#   start:         4.56T scanned, 0B issued, 4.56T total
+#   progress:      100G resilvered, 10.96% done, 1 days 01:23:45 to go (or "no estimated completion time")
+#   complete:      scan: resilvered (draid1:8d:82c:2s-0) 100G in 01:23:45 with 0 errors on Sun Oct 18 12:00:00 2026
+# Sizes and rates are exact with -p, but human-readable sizes are also accepted
+def parse_status_text(output,replaced=False):
+   size = r"([\d.]+[BKMGTPE]?)"
+   errors = 0
+   match = re.search(r"errors: (\d+) data errors",output)
+   if match:
+      errors = int(match.group(1))
+
+   match = re.search(r"resilver (?:\(\S+\) )?in progress since (.+)",output)
+   if match:
+      start_time = time.mktime(time.strptime(match.group(1).strip(),"%a %b %d %H:%M:%S %Y"))
+      scanned, total, scan_rate = parse_scan_amount(output,"scanned")
+      issued, issued_total, issue_rate = parse_scan_amount(output,"issued")
+      if total == None:
+         total = issued_total
+      match = re.search(size + r" total",output)
+      if match:
+         total = parse_size(match.group(1))
+
+      resilvered = None
+      percent_done = None
+      time_left = None
+      match = re.search(size + r" resilvered, ([\d.]+)% done",output)
+      if match:
+         resilvered = parse_size(match.group(1))
+         percent_done = float(match.group(2))
+      match = re.search(r"(?:(\d+) days )?(\d+):(\d\d):(\d\d) to go",output)
+      if match:
+         time_left = int(match.group(1) or 0)*86400 + int(match.group(2))*3600 + int(match.group(3))*60 + int(match.group(4))
+      return ResilverProgress("resilvering",scanned=scanned,issued=issued,total=total,resilvered=resilvered,scan_rate=scan_rate,
+         issue_rate=issue_rate,percent_done=percent_done,time_left=time_left,start_time=start_time,errors=errors)
+
+   match = re.search(r"scan: resilvered (?:\(\S+\) )?" + size + r" in (?:(\d+) days )?(\d+):(\d\d):(\d\d) with (\d+) errors on (.+)",output)
+   # A finished resilver only counts while the target disk is still faulted or offline (or was replaced); otherwise it's
+   # from a previous test
+   if match and ("persistent errors" in output or "taken offline" in output or replaced):
+      resilver_time = int(match.group(2) or 0)*86400 + int(match.group(3))*3600 + int(match.group(4))*60 + int(match.group(5))
+      end_time = time.mktime(time.strptime(match.group(7).strip(),"%a %b %d %H:%M:%S %Y"))
+
+      # dRAID keeps the scanned and issued amounts in the status after the resilver completes
+      scanned, total, scan_rate = parse_scan_amount(output,"scanned")
+      issued = parse_scan_amount(output,"issued")[0]
+      resilvered = parse_size(match.group(1))
+      if issued == None:
+         issued = resilvered
+      return ResilverProgress("complete",scanned=scanned,issued=issued,total=total,resilvered=resilvered,
+         start_time=end_time - resilver_time,end_time=end_time,resilver_time=resilver_time,errors=errors + int(match.group(6)))
+
+   return ResilverProgress("healthy",errors=errors)
+
+# Find "<amount>[ / <total>] <verb>[ at <rate>/s]" in zpool status output and return (amount, total, rate)
+def parse_scan_amount(output,verb):
+   size = r"([\d.]+[BKMGTPE]?)"
+   match = re.search(size + r"(?: / " + size + r")? " + verb + r"(?: at " + size + r"/s)?",output)
+   if not match:
+      return None, None, None
+   return parse_size(match.group(1)), parse_size(match.group(2)), parse_size(match.group(3))
+
+# Convert an exact or human-readable ZFS size (e.g., "1234", "500G", "1.23T") to bytes
+def parse_size(size):
+   if size == None:
+      return None
+   units = "BKMGTPE"
+   if size[-1] in units:
+      return int(float(size[:-1]) * 1024**units.index(size[-1]))
+   return int(float(size))
 
 # Returns the parity level of the vdev configuration
 def get_parity_level(vdev_type, vdev_width):
@@ -1207,71 +3760,115 @@ def get_num_vdevs(vdev_type, vdev_width):
 
 # Returns the AFR of the pool based on the vdev configuration and AFR of the individual disks
 def get_pool_afr(vdev_width, parity_level, num_vdevs, disk_AFR, resilver_time_sec):
-   # Generate probability matrix
-   diskP = []
-   for i in range(0, parity_level + 1):
-      if i == 0:
-         diskP.append(disk_AFR)
-      else:
-         diskP.append(disk_AFR * resilver_time_sec * i / (365 * 24 * 60 * 60))
-
-   # Calculate the probability of 1, then 2, then ..., then p+1 disk failures (just enough to kill the vdev)
-   pool_P = 1
-
-   for num_disk_failures in range(1,parity_level + 2):
-      p = diskP[num_disk_failures - 1]
-      p_fail = (vdev_width - (num_disk_failures - 1)) * p
-      pool_P *= p_fail
-
-   return pool_P * num_vdevs
+   return float(get_pool_afr_grid(vdev_width, parity_level, num_vdevs, disk_AFR, resilver_time_sec))
+
+# Vectorized pool AFR; every argument can be a scalar or an array and they are broadcast against each other
+# The pool fails when one disk fails (disk_AFR) and then p more fail in the same vdev while it is still resilvering.
+# With w disks per vdev, the i-th additional failure has a (w - i) * disk_AFR * resilver_time * i / year chance, so:
+#   pool AFR = num_vdevs * w * disk_AFR * product over i = 1..p of ((w - i) * disk_AFR * resilver_time * i / year)
+def get_pool_afr_grid(vdev_width, parity_level, num_vdevs, disk_AFR, resilver_time_sec):
+   vdev_width = numpy.asarray(vdev_width,dtype=float)
+   parity_level = numpy.asarray(parity_level)
+   num_vdevs = numpy.asarray(num_vdevs,dtype=float)
+   disk_AFR = numpy.asarray(disk_AFR,dtype=float)
+   resilver_time_sec = numpy.asarray(resilver_time_sec,dtype=float)
+
+   # Probability of one more disk failure in the vdev per unit of (w - i) * i, which is the same for every i
+   p_during_resilver = disk_AFR * resilver_time_sec / (365 * 24 * 60 * 60)
+
+   # Multiply the terms for i = 1..max parity along an extra trailing axis, using 1 for i > p
+   i = numpy.arange(1,int(numpy.max(parity_level)) + 1)
+   terms = (vdev_width[...,None] - i) * i * p_during_resilver[...,None]
+   terms = numpy.where(i <= parity_level[...,None],terms,1)
+
+   return num_vdevs * vdev_width * disk_AFR * numpy.prod(terms,axis=-1)
+
+# Pool AFR for every disk AFR in afr_disk_percents and resilver time multiplier in afr_time_multipliers, in results column order
+# Cached on the layout and resilver time since re-runs and re-analysis ask for the same tables repeatedly
+@functools.lru_cache(maxsize=4096)
+def get_pool_afr_table(vdev_width, parity_level, num_vdevs, resilver_time_sec):
+   multipliers = numpy.array(afr_time_multipliers,dtype=float)[:,None]
+   disk_afrs = numpy.array(afr_disk_percents,dtype=float)[None,:] / 100
+   return get_pool_afr_grid(vdev_width, parity_level, num_vdevs, disk_afrs, resilver_time_sec * multipliers).ravel()
+
+# Recompute pool AFR offline from the resilver times in a results CSV for any disk AFRs and resilver time multipliers
+# Returns the array of pool AFRs (results rows x multipliers x disk AFRs) and optionally writes it to a CSV file
+# e.g., recompute_afr_table("output.csv",numpy.arange(0.5,20.5,0.5),[1,10,100,1000],"afr_table.csv")
+def recompute_afr_table(results_path,disk_percents,multipliers,output_path=None):
+   with open(results_path) as results_csv:
+      rows = list(csv.DictReader(results_csv))
+
+   vdev_width = numpy.array([float(row["VdevWidth"]) for row in rows])[:,None,None]
+   parity_level = numpy.array([int(row["ParityLevel"]) for row in rows])[:,None,None]
+   num_vdevs = numpy.array([float(row["NumVdevs"]) for row in rows])[:,None,None]
+   resilver_time = numpy.array([float(row["ResilverTimeSeconds"]) for row in rows])[:,None,None]
+   disk_afrs = numpy.asarray(disk_percents,dtype=float)[None,None,:] / 100
+   time_multipliers = numpy.asarray(multipliers,dtype=float)[None,:,None]
+
+   afr_table = get_pool_afr_grid(vdev_width, parity_level, num_vdevs, disk_afrs, resilver_time * time_multipliers)
+
+   if output_path != None:
+      with open(output_path,"w") as output_csv:
+         output = csv.writer(output_csv)
+         output.writerow(["TestIndex","Layout"] + get_afr_columns(disk_percents,multipliers))
+         for row, afrs in zip(rows,afr_table):
+            output.writerow([row["TestIndex"],row["Layout"]] + afrs.ravel().tolist())
+   return afr_table
 
 # Gets the layouts to be tested from the layouts file
 # Adds the layout index to the end of each line of the layout file
 def get_layouts():
-   layouts = []
-
-   with open('layouts', 'r') as file:
+   return read_schedule_file('layouts')
+
+# Get the sets of ZFS module tunables to test from tunables_file, in the same format as the layouts file
+# Each line is a dict of module parameters (/sys/module/zfs/parameters) and the values to run the test with, e.g.,
+# {"zfs_resilver_min_time_ms": 5000, "zfs_scan_vdev_limit": 16777216}; {} runs with the module's current settings
+# Every test in test_schedule is run once with each set. Without the file, only the current settings are tested
+def get_tunables():
+   if not os.path.isfile(tunables_file):
+      return [{}]
+   tunables = read_schedule_file(tunables_file)
+   if tunables == []:
+      return [{}]
+   return tunables
+
+# Read a schedule file with one Python literal per line, skipping blank and comment lines
+# Each entry's index is added as a trailing comment so it can be matched up with the results
+def read_schedule_file(path):
+   entries = []
+
+   with open(path, 'r') as file:
       lines = file.readlines()
       for line in lines:
          stripped_line = line.strip()
          # Skip blank lines and comment lines
          if stripped_line and not stripped_line.startswith("#"):
-            layouts.append(eval(stripped_line.split("#")[0].strip()))
+            entries.append(eval(stripped_line.split("#")[0].strip()))
 
-   with open('layouts', 'w') as file:
-      layout_index = 0
+   with open(path, 'w') as file:
+      entry_index = 0
       for line in lines:
          stripped_line = line.strip()
          # Skip blank lines and comment lines
          if stripped_line and not stripped_line.startswith("#"):
-            # Add layout index to end of line if it doesn't already exist
-            if "#" not in stripped_line or not stripped_line.endswith(f"# {layout_index}"):
-               file.write(f"{stripped_line.split('#')[0].strip()}  # {layout_index}\n")
+            # Add entry index to end of line if it doesn't already exist
+            if "#" not in stripped_line or not stripped_line.endswith(f"# {entry_index}"):
+               file.write(f"{stripped_line.split('#')[0].strip()}  # {entry_index}\n")
             else:
                file.write(line)
-            layout_index += 1
+            entry_index += 1
          else:
             file.write(line)
    
-   return layouts
+   return entries
 
 # SIGINT and SIGTERM handler
+# Exits by raising SystemExit wherever the main thread is, so main() and pool_worker() stop their fio and zpool child
+# processes and close the results file on the way out
 def kill(signum, frame):
    global log
-   global f
 
    log.info("Exiting...")
-
-   # Kill any running instances of fio
-   try:
-      subprocess.check_output("pkill fio",shell=True)
-   except:
-      pass
-
-   # Close file
-   f.close()
-   
-   # Exit
    sys.exit(0)
 
 if __name__ == '__main__':
@@ -0,0 +1,1054 @@
+#!/bin/python3
+
+# sim.py
+# Stand-ins for zpool, zfs, lsblk, sgdisk, udevadm, and fio used by the "sim" backend of resilver.py
+# resilver.py links each tool name to this script in <sim_dir>/bin and puts that directory first on the PATH; the tool
+# to act as is picked from the name the script was run as
+# Disks, pools, and resilvers are kept in <sim_dir>/state.json. Pool data is sparse files under the pool mountpoint, so
+# prune_pool() and golden images work on real files without using real disk space
+# Time is compressed by RESILVER_SIM_TIME_SCALE: fills and resilvers finish that many times faster than on hardware, while
+# zpool status and fio report sizes, rates, durations, and latencies in simulated time
+
+import sys, os, json, time, math, random, signal, fcntl, shutil, collections
+
+sim_dir = os.environ.get("RESILVER_SIM_DIR","sim")
+time_scale = float(os.environ.get("RESILVER_SIM_TIME_SCALE","1000"))
+num_disks = int(os.environ.get("RESILVER_SIM_DISKS","82"))
+disk_size = os.environ.get("RESILVER_SIM_DISK_SIZE","7.3T")
+
+disk_bandwidth = 250 * 1024**2   # Sequential bandwidth of a simulated disk (bytes/s)
+disk_iops = 200                  # Random IOPS of a simulated disk
+pool_overhead = 0.97             # Fraction of the raw data capacity left after metadata and slop space
+resilver_overhead = 10           # Fixed time (simulated seconds) added to every resilver for the metadata scan
+files_per_job = 64               # Most files a simulated fio job writes; bigger fills write bigger files instead of more files
+step_interval = 0.05             # Real seconds between simulated fio write progress updates
+read_latency = 0.008             # Median 4K random read latency of an idle simulated pool (seconds)
+write_latency = 0.002            # Median 4K sync write latency of an idle simulated pool (seconds)
+latency_samples = 1000           # Most latencies drawn per fio status interval; the histogram is scaled up to the I/O count
+
+# Fragmentation reported for free segments of 512B, 1K, 2K, ... 16M and larger (zfs_frag_table in ZFS)
+frag_table = [100, 100, 98, 95, 90, 80, 70, 60, 50, 40, 30, 20, 15, 10, 5, 0]
+
+# Set by SIGTERM so fio can stop and print its final report like the real one does
+stopping = False
+
+def main():
+   tool = os.path.basename(sys.argv[0])
+   args = sys.argv[1:]
+   if tool == "zpool":
+      zpool(args)
+   elif tool == "zfs":
+      zfs(args)
+   elif tool == "lsblk":
+      lsblk(args)
+   elif tool == "sgdisk":
+      sgdisk(args)
+   elif tool == "udevadm":
+      pass
+   elif tool == "fio":
+      fio(args)
+   else:
+      fail("sim.py: unknown tool " + tool)
+
+# Holds the state file locked for the duration of a with block and saves it afterwards (unless save is False or the
+# block raised, e.g. by calling fail())
+class SimState:
+   def __init__(self,save=True):
+      self.save = save
+
+   def __enter__(self):
+      os.makedirs(sim_dir,exist_ok=True)
+      self.lock = open(os.path.join(sim_dir,"state.lock"),"w")
+      fcntl.flock(self.lock,fcntl.LOCK_EX)
+      try:
+         with open(os.path.join(sim_dir,"state.json")) as state_file:
+            self.state = json.load(state_file)
+      except FileNotFoundError:
+         self.state = {"disks": {}, "pools": {}, "stress": {}}
+         for disk_number in range(num_disks):
+            self.state["disks"][get_disk_name(disk_number)] = {"size": disk_size, "partition": None}
+         self.save = True
+      return self.state
+
+   def __exit__(self,exc_type,exc_value,traceback):
+      if self.save and exc_type == None:
+         path = os.path.join(sim_dir,"state.json")
+         with open(path + ".tmp","w") as state_file:
+            json.dump(self.state,state_file)
+         os.replace(path + ".tmp",path)
+      self.lock.close()
+
+# Print an error and exit with a failure like the real tools do
+def fail(message):
+   print(message,file=sys.stderr)
+   sys.exit(1)
+
+# Disk names in the order the kernel hands them out: sda ... sdz, sdaa, sdab, ...
+def get_disk_name(disk_number):
+   name = ""
+   disk_number += 1
+   while disk_number > 0:
+      disk_number, letter = divmod(disk_number - 1,26)
+      name = chr(ord("a") + letter) + name
+   return "sd" + name
+
+# Convert a size such as "7.3T", "500G", "4Ki", or "1048576" to bytes
+def parse_size(size):
+   size = str(size).strip().rstrip("B").rstrip("i")
+   units = "BKMGTPE"
+   if size[-1].upper() in units:
+      return int(float(size[:-1]) * 1024**units.index(size[-1].upper()))
+   return int(float(size))
+
+# Convert bytes to a size the way lsblk prints it (e.g., "7.3T", "500G")
+def format_size(size):
+   units = "BKMGTPE"
+   value = float(size)
+   unit = 0
+   while value >= 1024 and unit < len(units) - 1:
+      value /= 1024
+      unit += 1
+   return "{:.1f}".format(value).rstrip("0").rstrip(".") + units[unit]
+
+# Name of the disk a device path is on (e.g., "sda" for /dev/sda1)
+def get_disk(device):
+   name = device.replace("/dev/","")
+   return name[:-1] if name[-1].isdigit() else name
+
+# Size of a device path (a whole disk like /dev/sda or its partition /dev/sda1) or None if it doesn't exist
+def get_device_size(state,device):
+   name = device.replace("/dev/","")
+   if name in state["disks"]:
+      return parse_size(state["disks"][name]["size"])
+   disk = state["disks"].get(name[:-1])
+   if name.endswith("1") and disk != None and disk["partition"] != None:
+      return parse_size(disk["partition"])
+   return None
+
+# Split combined short options (e.g., "-Hpo name tank") into flags, option values, and positional arguments
+def parse_args(args,value_options):
+   flags = set()
+   values = {}
+   positional = []
+   i = 0
+   while i < len(args):
+      arg = args[i]
+      if arg.startswith("--"):
+         key, _, value = arg[2:].partition("=")
+         values[key] = value
+      elif arg.startswith("-") and len(arg) > 1:
+         for char in arg[1:]:
+            if char in value_options:
+               i += 1
+               values.setdefault(char,[]).append(args[i])
+            else:
+               flags.add(char)
+      else:
+         positional.append(arg)
+      i += 1
+   return flags, values, positional
+
+# lsblk -d -n --output NAME,SIZE lists every disk; lsblk -J --output NAME,SIZE <disks> shows their partitions
+def lsblk(args):
+   with SimState(save=False) as state:
+      if "-J" in args:
+         devices = []
+         for device in args:
+            if not device.startswith("/dev/"):
+               continue
+            name = device.replace("/dev/","")
+            if name not in state["disks"]:
+               fail("lsblk: " + device + ": not a block device")
+            entry = {"name": name,"size": format_size(parse_size(state["disks"][name]["size"]))}
+            if state["disks"][name]["partition"] != None:
+               entry["children"] = [{"name": name + "1","size": state["disks"][name]["partition"]}]
+            devices.append(entry)
+         print(json.dumps({"blockdevices": devices},indent=3))
+      else:
+         # A boot disk that isn't the test disk size, so the harness has something to filter out
+         print("nvme0n1 931.5G")
+         for name, disk in state["disks"].items():
+            print(name + " " + format_size(parse_size(disk["size"])))
+
+# sgdisk -Z <disk> wipes the partition table; sgdisk -n 0:0:+<size> <disk> creates the first partition
+def sgdisk(args):
+   with SimState() as state:
+      name = args[-1].replace("/dev/","")
+      if name not in state["disks"]:
+         fail("Problem opening " + args[-1] + " for reading! Error is 2.")
+      if "-Z" in args:
+         state["disks"][name]["partition"] = None
+      if "-n" in args:
+         state["disks"][name]["partition"] = args[args.index("-n") + 1].split("+")[-1]
+   time.sleep(0.1/time_scale)
+
+# Capacity and rebuild shape of a vdev
+# draid specs are draid<parity>[:<data>d][:<children>c][:<spares>s]; mirrors keep one copy of the data per device
+def get_vdev(vdev_type,devices):
+   vdev = {"type": vdev_type,"devices": devices,"children": len(devices),"spares": 0}
+   if vdev_type.startswith("draid"):
+      spec = vdev_type.split(":")
+      vdev["parity"] = int(spec[0][5:] or 1)
+      vdev["data"] = 8
+      for field in spec[1:]:
+         if field.endswith("d"):
+            vdev["data"] = int(field[:-1])
+         elif field.endswith("s"):
+            vdev["spares"] = int(field[:-1])
+   elif vdev_type.startswith("raidz"):
+      vdev["parity"] = int(vdev_type[5:] or 1)
+      vdev["data"] = len(devices) - vdev["parity"]
+   elif vdev_type == "mirror":
+      vdev["parity"] = len(devices) - 1
+      vdev["data"] = 1
+   else:
+      vdev["parity"] = 0
+      vdev["data"] = 1
+   return vdev
+
+# Usable bytes of a vdev made of devices of device_size bytes
+def get_vdev_capacity(vdev,device_size):
+   if vdev["type"] in ("mirror","disk"):
+      return device_size
+   return (vdev["children"] - vdev["spares"]) * device_size * vdev["data"]/(vdev["data"] + vdev["parity"])
+
+# Return the pool with the given name, failing like zpool/zfs do if it doesn't exist or is exported
+def get_pool(state,name,allow_exported=False):
+   pool = state["pools"].get(name)
+   if pool == None or (pool["exported"] and not allow_exported):
+      fail("cannot open '" + name + "': no such pool")
+   return pool
+
+# Walk the pool's files and account for what changed since the last walk
+# Space used by new files comes out of never-used space first and then out of the biggest free segments; space freed by
+# deleted files becomes free segments the size of the files that directory was written with (its fio file size)
+# Returns the bytes used
+def reconcile(pool):
+   current = collections.Counter()
+   for root, dirs, files in os.walk(pool["mountpoint"]):
+      key = os.path.relpath(root,pool["mountpoint"])
+      for name in files:
+         try:
+            current[key] += os.stat(os.path.join(root,name)).st_size
+         except FileNotFoundError:
+            pass
+
+   for key in set(current) | set(pool["runs"]):
+      change = current[key] - pool["runs"].get(key,0)
+      if change > 0:
+         allocate(pool,change)
+      elif change < 0:
+         segment = str(pool["segments"].get(key,1024**2))
+         pool["holes"][segment] = pool["holes"].get(segment,0) - change
+   pool["runs"] = {key: size for key, size in current.items() if size > 0}
+
+   used = sum(current.values())
+   free = max(pool["capacity"] - used,0)
+   pool["clean"] = max(free - sum(pool["holes"].values()),0)
+   return used
+
+def allocate(pool,size):
+   take = min(pool["clean"],size)
+   pool["clean"] -= take
+   size -= take
+   for segment in sorted(pool["holes"],key=int,reverse=True):
+      if size <= 0:
+         break
+      take = min(pool["holes"][segment],size)
+      pool["holes"][segment] -= take
+      size -= take
+      if pool["holes"][segment] <= 0:
+         del pool["holes"][segment]
+
+# Free space fragmentation percent, weighted by the size of each free segment as ZFS does
+def get_frag(pool):
+   free = pool["clean"] + sum(pool["holes"].values())
+   if free <= 0:
+      return 0
+   weighted = 0
+   for segment, size in pool["holes"].items():
+      index = min(max(int(math.log2(int(segment))) - 9,0),len(frag_table) - 1)
+      weighted += size * frag_table[index]
+   return round(weighted/free)
+
+# Files (path relative to the mountpoint: size) under a directory of the pool
+def get_manifest(pool,prefix=""):
+   manifest = {}
+   for root, dirs, files in os.walk(os.path.join(pool["mountpoint"],prefix)):
+      for name in files:
+         path = os.path.join(root,name)
+         manifest[os.path.relpath(path,pool["mountpoint"])] = os.stat(path).st_size
+   return manifest
+
+# Bytes in a saved manifest that have since been deleted or changed
+def get_changed_bytes(pool,manifest,prefix=""):
+   current = get_manifest(pool,prefix)
+   return sum(size for path, size in manifest.items() if current.get(path) != size) + \
+      sum(size for path, size in current.items() if manifest.get(path) != size)
+
+# Put the files under a directory of the pool back the way they were when the manifest was saved
+def restore_manifest(pool,manifest,prefix=""):
+   for path, size in get_manifest(pool,prefix).items():
+      if manifest.get(path) != size:
+         os.remove(os.path.join(pool["mountpoint"],path))
+   for path, size in manifest.items():
+      path = os.path.join(pool["mountpoint"],path)
+      if not os.path.exists(path):
+         os.makedirs(os.path.dirname(path),exist_ok=True)
+         with open(path,"wb") as restored:
+            restored.truncate(size)
+
+# Saved copy of the files and space accounting, used for snapshots and checkpoints
+def save_image(pool,prefix=""):
+   return {"files": get_manifest(pool,prefix),"runs": dict(pool["runs"]),"holes": dict(pool["holes"]),"clean": pool["clean"]}
+
+def restore_image(pool,image,prefix=""):
+   restore_manifest(pool,image["files"],prefix)
+   pool["runs"] = dict(image["runs"])
+   pool["holes"] = dict(image["holes"])
+   pool["clean"] = image["clean"]
+
+# Running fio stress processes as {"disk": level, "cpu": level}; processes that were killed are dropped
+def get_stress(state):
+   stress = {}
+   for pid, entry in list(state["stress"].items()):
+      try:
+         os.kill(int(pid),0)
+         stress[entry["kind"]] = entry["level"]
+      except (ProcessLookupError, PermissionError):
+         del state["stress"][pid]
+   return stress
+
+# Start resilvering a failed device onto a spare ("spare": a hot spare or, on dRAID, a distributed spare) or onto a new
+# disk in its place ("disk")
+# Hot spares (raidz, mirror) and new disks are written at the speed of one disk; dRAID rebuilds onto distributed spare
+# space, so the reads and writes are spread over every child. Fragmentation and stress slow the resilver down
+# Sequential rebuilds skip the block pointer scan and issue large sequential I/Os, and are followed by a scrub of the pool
+def start_resilver(state,pool,device,target="spare",sequential=False):
+   used = reconcile(pool)
+   vdev = [vdev for vdev in pool["vdevs"] if device in vdev["devices"]][0]
+   num_vdevs = len(pool["vdevs"])
+   stripe = vdev["data"] + vdev["parity"]
+   if vdev["type"] == "mirror":
+      device_bytes = used/num_vdevs
+      total = used * vdev["children"]
+      seconds = device_bytes/disk_bandwidth
+   elif vdev["type"].startswith("draid"):
+      device_bytes = used/num_vdevs * stripe/vdev["data"]/(vdev["children"] - vdev["spares"])
+      total = used * stripe/vdev["data"]
+      seconds = device_bytes * (stripe - 1)/((vdev["children"] - 1) * disk_bandwidth)
+      if target == "disk":
+         seconds = device_bytes/disk_bandwidth
+   else:
+      device_bytes = used/num_vdevs/max(vdev["data"],1)
+      total = used * stripe/max(vdev["data"],1)
+      seconds = device_bytes/disk_bandwidth
+   overhead = resilver_overhead
+   if sequential:
+      seconds *= 0.7
+      overhead /= 5
+
+   stress = get_stress(state)
+   seconds *= 1 + get_frag(pool)/50
+   seconds *= {"high": 2.5, "med": 1.4}.get(stress.get("disk"),1)
+   seconds *= {"high": 1.1, "med": 1.05}.get(stress.get("cpu"),1)
+   seconds = (seconds + overhead) * random.uniform(0.95,1.05)
+
+   start = time.time() + 1/time_scale
+   end = start + seconds/time_scale
+   pool["scan"] = {"function": "RESILVER","start": start,"end": end,"seconds": seconds,"to_examine": int(total),
+      "processed": int(device_bytes),"device": device,"target": target,"sequential": sequential}
+   pool["events"] = pool["events"][-100:] + [[start,"sysevent.fs.zfs.resilver_start"],[end,"sysevent.fs.zfs.resilver_finish"]]
+
+   # The scrub after a sequential rebuild reads everything on every disk
+   pool["scrub"] = None
+   if sequential:
+      num_devices = sum(vdev["children"] for vdev in pool["vdevs"])
+      scrub_seconds = (total * num_vdevs/(num_devices * disk_bandwidth) + resilver_overhead) * random.uniform(0.95,1.05)
+      pool["scrub"] = {"function": "SCRUB","start": end,"end": end + scrub_seconds/time_scale,"seconds": scrub_seconds,
+         "to_examine": int(total * num_vdevs)}
+      pool["events"] += [[end,"sysevent.fs.zfs.scrub_start"],[end + scrub_seconds/time_scale,"sysevent.fs.zfs.scrub_finish"]]
+
+# Devices that are faulted or offline; a device replaced with a new disk since it went offline is back once its resilver finishes
+def get_offline(pool):
+   scan = pool["scan"]
+   if scan != None and scan.get("target") == "disk" and scan["start"] >= pool.get("offline_time",0) and time.time() >= scan["end"]:
+      return [device for device in pool["offline"] if device != scan["device"]]
+   return pool["offline"]
+
+# Names zpool status gives a pool's dRAID distributed spares (draid<parity>-<vdev>-<spare>)
+def get_distributed_spares(pool):
+   spares = []
+   for index, vdev in enumerate(pool["vdevs"]):
+      if vdev["type"].startswith("draid"):
+         spares += ["draid" + str(vdev["parity"]) + "-" + str(index) + "-" + str(spare) for spare in range(vdev["spares"])]
+   return spares
+
+# Progress of the pool's scan (or scrub) at the current time as (fraction done, simulated seconds since it started) or None
+def get_scan_progress(pool,kind="scan"):
+   scan = pool.get(kind)
+   if scan == None or time.time() < scan["start"]:
+      return None
+   fraction = min((time.time() - scan["start"])/(scan["end"] - scan["start"]),1)
+   return fraction, fraction * scan["seconds"]
+
+def zpool(args):
+   if args == []:
+      fail("usage: zpool command args ...")
+   command = args[0]
+   args = args[1:]
+   if command == "create":
+      zpool_create(args)
+   elif command == "destroy":
+      with SimState() as state:
+         pool = get_pool(state,args[-1],allow_exported=True)
+         shutil.rmtree(pool["mountpoint"],ignore_errors=True)
+         del state["pools"][args[-1]]
+   elif command == "list":
+      zpool_list(args)
+   elif command == "status":
+      zpool_status(args)
+   elif command == "export":
+      with SimState() as state:
+         get_pool(state,args[-1])["exported"] = True
+   elif command == "import":
+      with SimState() as state:
+         pool = get_pool(state,args[-1],allow_exported=True)
+         pool["exported"] = False
+         if "--rewind-to-checkpoint" in args:
+            if pool["checkpoint"] == None:
+               fail("cannot import '" + args[-1] + "': checkpoint does not exist")
+            restore_image(pool,pool["checkpoint"])
+            pool["checkpoint"] = None
+   elif command == "checkpoint":
+      with SimState() as state:
+         pool = get_pool(state,args[-1])
+         if "-d" in args or "--discard" in args:
+            if pool["checkpoint"] == None:
+               fail("cannot discard checkpoint in '" + args[-1] + "': checkpoint does not exist")
+            pool["checkpoint"] = None
+         else:
+            if pool["checkpoint"] != None:
+               fail("cannot checkpoint '" + args[-1] + "': checkpoint exists")
+            reconcile(pool)
+            pool["checkpoint"] = save_image(pool)
+   elif command == "offline":
+      flags, values, positional = parse_args(args,"")
+      with SimState() as state:
+         pool = get_pool(state,positional[0])
+         device = positional[-1]
+         if not any(device in vdev["devices"] for vdev in pool["vdevs"]):
+            fail("cannot offline " + device + ": no such device in pool")
+         pool["offline"] = [device]
+         pool["offline_time"] = time.time()
+         pool["faulted"] = "f" in flags
+         # Only a fault makes ZED swap in a spare, and ZED can't attach one while the pool has a checkpoint
+         if "f" in flags and pool["checkpoint"] == None:
+            start_resilver(state,pool,device)
+   elif command == "online":
+      with SimState() as state:
+         pool = get_pool(state,args[0])
+         if args[-1] in pool["offline"]:
+            pool["offline"].remove(args[-1])
+   elif command == "replace":
+      zpool_replace(args)
+   elif command == "detach":
+      with SimState() as state:
+         pool = get_pool(state,args[0])
+         if pool["checkpoint"] != None:
+            fail("cannot detach " + args[-1] + ": checkpoint exists")
+         if args[-1] not in pool.get("spares_in_use",[]):
+            fail("cannot detach " + args[-1] + ": only applicable to mirror and replacing vdevs")
+         pool["spares_in_use"].remove(args[-1])
+   elif command == "labelclear":
+      with SimState() as state:
+         device = args[-1]
+         for name, pool in state["pools"].items():
+            if any(device in vdev["devices"] for vdev in pool["vdevs"]) and device not in get_offline(pool):
+               fail(device + " is a member (ACTIVE) of pool \"" + name + "\"")
+         state.setdefault("wiped",[]).append(device)
+   elif command == "sync":
+      with SimState() as state:
+         for name in args or list(state["pools"]):
+            reconcile(get_pool(state,name))
+   elif command == "wait":
+      zpool_wait(args)
+   elif command == "events":
+      zpool_events(args)
+   elif command == "clear":
+      with SimState(save=False) as state:
+         get_pool(state,args[0])
+   else:
+      fail("unrecognized command '" + command + "'")
+
+# zpool replace [-s] <pool> <device> [<new device>]
+# The new device is a dRAID distributed spare, or the same device after zpool labelclear (a blank disk in its slot)
+def zpool_replace(args):
+   flags, values, positional = parse_args(args,"o")
+   with SimState() as state:
+      pool = get_pool(state,positional[0])
+      device = positional[1]
+      new_device = positional[2] if len(positional) > 2 else device
+      vdevs = [vdev for vdev in pool["vdevs"] if device in vdev["devices"]]
+      if vdevs == []:
+         fail("cannot replace " + device + " with " + new_device + ": no such device in pool")
+      if pool["checkpoint"] != None:
+         fail("cannot replace " + device + " with " + new_device + ": checkpoint exists")
+      if "s" in flags and vdevs[0]["type"].startswith("raidz"):
+         fail("cannot replace " + device + " with " + new_device + ": requires a mirror or dRAID vdev for sequential resilver")
+      pool.setdefault("spares_in_use",[])
+      if new_device.startswith("draid"):
+         if new_device not in get_distributed_spares(pool):
+            fail("cannot replace " + device + " with " + new_device + ": no such device in pool")
+         if new_device in pool["spares_in_use"]:
+            fail("cannot replace " + device + " with " + new_device + ": " + new_device + " is busy")
+         pool["spares_in_use"].append(new_device)
+         # Replacing with a distributed spare always rebuilds sequentially
+         start_resilver(state,pool,device,"spare",True)
+      else:
+         if new_device not in state.get("wiped",[]):
+            fail("cannot replace " + device + " with " + new_device + ": " + new_device + " is part of active pool '" + positional[0] + "'")
+         state["wiped"].remove(new_device)
+         if device not in pool["offline"]:
+            pool["offline"] = [device]
+         start_resilver(state,pool,device,"disk","s" in flags)
+
+# zpool create [-f] <pool> [-o property=value] [-m mountpoint] <vdev type> <devices> ... [spare <devices>]
+def zpool_create(args):
+   flags, values, positional = parse_args(args,"omO")
+   name = positional[0]
+   with SimState() as state:
+      if name in state["pools"]:
+         fail("cannot create '" + name + "': pool already exists")
+      in_use = set(device for pool in state["pools"].values() for vdev in pool["vdevs"] for device in vdev["devices"])
+      in_use |= set(device for pool in state["pools"].values() for device in pool["spares"])
+
+      groups = []
+      for token in positional[1:]:
+         if token.startswith("draid") or token.startswith("raidz") or token in ("mirror","spare"):
+            groups.append([token,[]])
+         else:
+            if get_device_size(state,token) == None:
+               fail("cannot open '" + token + "': no such device in /dev")
+            if token in in_use:
+               fail(token + " is part of active pool")
+            if groups == []:
+               groups.append(["disk",[]])
+            groups[-1][1].append(token)
+
+      vdevs = []
+      spares = []
+      for vdev_type, devices in groups:
+         if vdev_type == "spare":
+            spares += devices
+         elif vdev_type == "disk":
+            vdevs += [get_vdev("disk",[device]) for device in devices]
+         else:
+            vdevs.append(get_vdev(vdev_type,devices))
+      if vdevs == []:
+         fail("invalid vdev specification")
+
+      device_size = min(get_device_size(state,device) for vdev in vdevs for device in vdev["devices"])
+      capacity = int(sum(get_vdev_capacity(vdev,device_size) for vdev in vdevs) * pool_overhead)
+      write_bandwidth = sum((vdev["children"] - vdev["spares"]) * vdev["data"]/(vdev["data"] + vdev["parity"]) for vdev in vdevs) * disk_bandwidth
+      mountpoint = values.get("m",["/" + name])[0]
+      os.makedirs(mountpoint,exist_ok=True)
+      state["pools"][name] = {"vdevs": vdevs,"spares": spares,"mountpoint": mountpoint,"capacity": capacity,
+         "write_bandwidth": write_bandwidth,"exported": False,"datasets": {},"runs": {},"segments": {},"holes": {},
+         "clean": capacity,"scan": None,"scrub": None,"events": [],"offline": [],"faulted": False,"spares_in_use": [],"snapshots": {},
+         "checkpoint": None}
+   time.sleep(2/time_scale)
+
+# zpool list [-H] [-p] [-o property,...] [pool]
+def zpool_list(args):
+   flags, values, positional = parse_args(args,"o")
+   fields = values.get("o",["name,size,alloc,free,frag,cap,health"])[0].split(",")
+   with SimState() as state:
+      names = positional or [name for name, pool in state["pools"].items() if not pool["exported"]]
+      for name in names:
+         pool = get_pool(state,name)
+         used = reconcile(pool)
+         row = []
+         for field in fields:
+            if field == "name":
+               row.append(name)
+            elif field == "size":
+               row.append(str(pool["capacity"]))
+            elif field in ("alloc","allocated"):
+               row.append(str(used))
+            elif field == "free":
+               row.append(str(pool["capacity"] - used))
+            elif field in ("frag","fragmentation"):
+               row.append(str(get_frag(pool)))
+            elif field in ("cap","capacity"):
+               row.append(str(round(used/pool["capacity"]*100)))
+            elif field == "health":
+               row.append("DEGRADED" if get_offline(pool) else "ONLINE")
+            elif field == "checkpoint":
+               if pool["checkpoint"] == None:
+                  row.append("-")
+               else:
+                  row.append(str(max(get_changed_bytes(pool,pool["checkpoint"]["files"]),4096)))
+            else:
+               fail("bad property list: invalid property '" + field + "'")
+         print("\t".join(row))
+
+# zpool status -jp --json-int <pool> or zpool status -p <pool>
+# Like zpool status, shows the most recent of the resilver and the scrub that follows a sequential rebuild
+def zpool_status(args):
+   flags, values, positional = parse_args(args,"")
+   with SimState(save=False) as state:
+      name = positional[-1]
+      pool = get_pool(state,name)
+      offline = get_offline(pool)
+      health = "DEGRADED" if offline else "ONLINE"
+      scan = pool["scan"]
+      progress = get_scan_progress(pool)
+      if get_scan_progress(pool,"scrub") != None:
+         scan = pool["scrub"]
+         progress = get_scan_progress(pool,"scrub")
+
+      if "j" in flags:
+         status = {"name": name,"state": health,"error_count": 0,"vdevs": get_status_vdevs(pool)}
+         if progress != None:
+            fraction, elapsed = progress
+            finished = fraction >= 1
+            # Simulated times: the scan started "elapsed" simulated seconds ago
+            start_time = int(time.time() - elapsed) if not finished else int(scan["start"])
+            status["scan_stats"] = {
+               "function": scan["function"],
+               "state": "FINISHED" if finished else "SCANNING",
+               "start_time": start_time,
+               "end_time": int(scan["start"] + scan["seconds"]) if finished else 0,
+               "to_examine": scan["to_examine"],
+               "examined": int(scan["to_examine"] * min(fraction * 1.5,1)),
+               "skipped": 0,
+               "processed": int(scan.get("processed",0) * fraction),
+               "errors": 0,
+               "bytes_per_scan": int(scan["to_examine"] * min(fraction * 1.5,1)),
+               "pass_start": start_time,
+               "scrub_pause": 0,
+               "scrub_spent_paused": 0,
+               "issued_bytes_per_scan": int(scan["to_examine"] * fraction),
+               "issued": int(scan["to_examine"] * fraction)}
+         print(json.dumps({"output_version": {"command": "zpool status","vers_major": 0,"vers_minor": 1},
+            "pools": {name: status}},indent=2))
+         return
+
+      print("  pool: " + name)
+      print(" state: " + health)
+      if offline and pool.get("faulted",True):
+         print("status: One or more devices are faulted in response to persistent errors.")
+      elif offline:
+         print("status: One or more devices has been taken offline by the administrator.")
+      if progress == None:
+         print("  scan: none requested")
+      else:
+         fraction, elapsed = progress
+         # Sequential rebuilds name the top-level vdev being rebuilt
+         rebuild = "(" + get_vdev_name(pool,scan["device"]) + ") " if scan.get("sequential") else ""
+         if fraction >= 1:
+            seconds = round(scan["seconds"])
+            days, seconds = divmod(seconds,86400)
+            hours, seconds = divmod(seconds,3600)
+            minutes, seconds = divmod(seconds,60)
+            duration = (str(days) + " days " if days > 0 else "") + "{:02}:{:02}:{:02}".format(hours,minutes,seconds)
+            if scan["function"] == "SCRUB":
+               print("  scan: scrub repaired 0B in " + duration + " with 0 errors on " + time.ctime(scan["start"] + scan["seconds"]))
+            else:
+               print("  scan: resilvered (" + get_vdev_name(pool,scan["device"]) + ") " + str(scan["processed"]) + " in " + \
+                  duration + " with 0 errors on " + time.ctime(scan["start"] + scan["seconds"]))
+         else:
+            examined = int(scan["to_examine"] * min(fraction * 1.5,1))
+            issued = int(scan["to_examine"] * fraction)
+            left = round(scan["seconds"] - elapsed)
+            if scan["function"] == "SCRUB":
+               print("  scan: scrub in progress since " + time.ctime(time.time() - elapsed))
+            else:
+               print("  scan: resilver " + rebuild + "in progress since " + time.ctime(time.time() - elapsed))
+            print("\t" + str(examined) + " / " + str(scan["to_examine"]) + " scanned at " + str(int(examined/max(elapsed,1))) + \
+               "/s, " + str(issued) + " / " + str(scan["to_examine"]) + " issued at " + str(int(issued/max(elapsed,1))) + "/s")
+            if scan["function"] == "SCRUB":
+               print("\t0B repaired, " + "{:.2f}".format(fraction * 100) + "% done, " + \
+                  "{:02}:{:02}:{:02}".format(left//3600,left//60 % 60,left % 60) + " to go")
+            else:
+               print("\t" + str(int(scan["processed"] * fraction)) + " resilvered, " + "{:.2f}".format(fraction * 100) + "% done, " + \
+                  "{:02}:{:02}:{:02}".format(left//3600,left//60 % 60,left % 60) + " to go")
+      print("config:\n")
+      print("\tNAME\tSTATE")
+      print("\t" + name + "\t" + health)
+      device_state = "FAULTED" if pool.get("faulted",True) else "OFFLINE"
+      for vdev in pool["vdevs"]:
+         print("\t  " + get_vdev_name(pool,vdev["devices"][0]) + "\t" + ("DEGRADED" if set(vdev["devices"]) & set(offline) else "ONLINE"))
+         for device in vdev["devices"]:
+            print("\t    " + device.replace("/dev/","") + "\t" + (device_state if device in offline else "ONLINE"))
+      spares = get_distributed_spares(pool) + [spare.replace("/dev/","") for spare in pool["spares"]]
+      if spares != []:
+         print("\tspares")
+         for spare in spares:
+            print("\t  " + spare + "\t" + ("INUSE" if spare in pool.get("spares_in_use",[]) else "AVAIL"))
+      print("\nerrors: No known data errors")
+
+# Name zpool status gives the vdev holding a device (e.g., "raidz2-0", "draid2:8d:82c:2s-0")
+def get_vdev_name(pool,device):
+   for index, vdev in enumerate(pool["vdevs"]):
+      if device in vdev["devices"]:
+         return vdev["type"] + "-" + str(index)
+   return device
+
+def get_status_vdevs(pool):
+   vdevs = {}
+   for vdev in pool["vdevs"]:
+      children = {}
+      for device in vdev["devices"]:
+         children[device.replace("/dev/","")] = {"name": device.replace("/dev/",""),"vdev_type": "disk","path": device,
+            "state": ("FAULTED" if pool.get("faulted",True) else "OFFLINE") if device in get_offline(pool) else "ONLINE"}
+      name = get_vdev_name(pool,vdev["devices"][0])
+      vdevs[name] = {"name": name,"vdev_type": vdev["type"].split(":")[0],
+         "state": "DEGRADED" if set(vdev["devices"]) & set(get_offline(pool)) else "ONLINE","vdevs": children}
+   return vdevs
+
+# zpool wait -t <activity>[,<activity>] <pool>; only resilvers and scrubs take time in the sim
+def zpool_wait(args):
+   flags, values, positional = parse_args(args,"tT")
+   activities = ",".join(values.get("t",["resilver"])).split(",")
+   kinds = [kind for activity, kind in (("resilver","scan"),("scrub","scrub")) if activity in activities]
+   while True:
+      with SimState(save=False) as state:
+         pool = get_pool(state,positional[-1])
+         ends = [pool[kind]["end"] for kind in kinds if pool.get(kind) != None and time.time() < pool[kind]["end"]]
+      if ends == []:
+         break
+      time.sleep(min(max(max(ends) - time.time(),0),0.5) + 0.001)
+
+# zpool events -H [-f] <pool>; prints the event history and, with -f, new events as they happen
+def zpool_events(args):
+   flags, values, positional = parse_args(args,"")
+   printed = set()
+   while True:
+      with SimState(save=False) as state:
+         pool = state["pools"].get(positional[-1]) if positional else None
+         events = pool["events"] if pool != None else []
+      for event_time, event_class in events:
+         if event_time <= time.time() and (event_time,event_class) not in printed:
+            printed.add((event_time,event_class))
+            print(time.strftime("%b %d %Y %H:%M:%S",time.localtime(event_time)) + "." + \
+               "{:09d}".format(int(event_time % 1 * 1e9)) + " " + event_class,flush=True)
+      if "f" not in flags:
+         break
+      time.sleep(0.02)
+
+def zfs(args):
+   if args == []:
+      fail("usage: zfs command args ...")
+   command = args[0]
+   args = args[1:]
+   with SimState() as state:
+      if command == "create":
+         flags, values, positional = parse_args(args,"o")
+         pool_name, _, dataset = positional[-1].partition("/")
+         pool = get_pool(state,pool_name)
+         if dataset in pool["datasets"]:
+            fail("cannot create '" + positional[-1] + "': dataset already exists")
+         pool["datasets"][dataset] = {"props": dict(value.split("=",1) for value in values.get("o",[]))}
+         os.makedirs(os.path.join(pool["mountpoint"],dataset),exist_ok=True)
+      elif command == "set":
+         pool, dataset = get_dataset(state,args[-1])
+         for prop in args[:-1]:
+            key, _, value = prop.partition("=")
+            pool["datasets"][dataset]["props"][key] = value
+      elif command == "get":
+         flags, values, positional = parse_args(args,"o")
+         pool, dataset = get_dataset(state,positional[-1])
+         for prop in positional[0].split(","):
+            print(get_dataset_prop(pool,dataset,prop))
+      elif command == "list":
+         flags, values, positional = parse_args(args,"o")
+         fields = values.get("o",["name,used,avail,refer,mountpoint"])[0].split(",")
+         target = positional[-1]
+         if "@" in target:
+            pool, dataset = get_dataset(state,target.split("@")[0])
+            if target.split("@")[1] not in pool["datasets"][dataset].get("snapshots",{}):
+               fail("cannot open '" + target + "': dataset does not exist")
+         else:
+            pool, dataset = get_dataset(state,target)
+         print("\t".join(target if field == "name" else get_dataset_prop(pool,dataset,field) for field in fields))
+      elif command == "snapshot":
+         dataset_name, _, snapshot = args[-1].partition("@")
+         pool, dataset = get_dataset(state,dataset_name)
+         reconcile(pool)
+         pool["datasets"][dataset].setdefault("snapshots",{})[snapshot] = save_image(pool,dataset)
+      elif command == "destroy":
+         dataset_name, _, snapshot = args[-1].partition("@")
+         pool, dataset = get_dataset(state,dataset_name)
+         if snapshot not in pool["datasets"][dataset].get("snapshots",{}):
+            fail("could not find any snapshots to destroy; check snapshot names.")
+         del pool["datasets"][dataset]["snapshots"][snapshot]
+      elif command == "rollback":
+         dataset_name, _, snapshot = args[-1].partition("@")
+         pool, dataset = get_dataset(state,dataset_name)
+         if snapshot not in pool["datasets"][dataset].get("snapshots",{}):
+            fail("cannot open '" + args[-1] + "': dataset does not exist")
+         restore_image(pool,pool["datasets"][dataset]["snapshots"][snapshot],dataset)
+      else:
+         fail("unrecognized command '" + command + "'")
+
+# Return (pool, dataset name within the pool) for "pool/dataset"
+def get_dataset(state,name):
+   pool_name, _, dataset = name.partition("/")
+   pool = get_pool(state,pool_name)
+   if dataset not in pool["datasets"]:
+      fail("cannot open '" + name + "': dataset does not exist")
+   return pool, dataset
+
+def get_dataset_prop(pool,dataset,prop):
+   if prop in ("used","referenced","refer"):
+      return str(reconcile(pool))
+   elif prop in ("available","avail"):
+      return str(max(pool["capacity"] - reconcile(pool),0))
+   elif prop == "written":
+      snapshots = pool["datasets"][dataset].get("snapshots",{})
+      if snapshots == {}:
+         return str(reconcile(pool))
+      return str(get_changed_bytes(pool,list(snapshots.values())[-1]["files"],dataset))
+   elif prop == "mountpoint":
+      return os.path.join(pool["mountpoint"],dataset)
+   return pool["datasets"][dataset]["props"].get(prop,"-")
+
+# fio stand-in
+# Sequential fills write sparse files; jobs with --status-interval print json+ reports with simulated latencies until
+# they are stopped; --ioengine=cpuio and --readonly bandwidth checks only take (scaled) time
+def fio(args):
+   options = {}
+   filenames = []
+   for arg in args:
+      key, _, value = arg.lstrip("-").partition("=")
+      options[key] = value
+      if key == "filename":
+         filenames.append(value)
+
+   def stop(signum,frame):
+      global stopping
+      stopping = True
+   signal.signal(signal.SIGTERM,stop)
+   signal.signal(signal.SIGINT,stop)
+
+   if options.get("ioengine") == "cpuio":
+      level = "high" if int(options.get("cpuload","0")) >= 80 else "med"
+      with StressRegistration("cpu",level):
+         while not stopping:
+            time.sleep(0.1)
+   elif "readonly" in options:
+      fio_bandwidth(options,len(filenames))
+   elif "status-interval" in options:
+      fio_stream(options)
+   else:
+      fio_fill(options)
+
+# Records a running stress process in the state for the length of a with block (nothing is recorded if level is None)
+class StressRegistration:
+   def __init__(self,kind,level):
+      self.kind = kind
+      self.level = level
+
+   def __enter__(self):
+      if self.level != None:
+         with SimState() as state:
+            state["stress"][str(os.getpid())] = {"kind": self.kind,"level": self.level}
+
+   def __exit__(self,exc_type,exc_value,traceback):
+      if self.level != None:
+         with SimState() as state:
+            state["stress"].pop(str(os.getpid()),None)
+
+# Find the pool whose mountpoint holds a directory
+def get_pool_for_path(state,path):
+   for name, pool in state["pools"].items():
+      if not pool["exported"] and os.path.abspath(path).startswith(os.path.abspath(pool["mountpoint"]) + os.sep):
+         return pool
+   fail("fio: " + path + ": No such file or directory")
+
+# Sequential fill of sparse files: each job writes --io_size bytes (or until the pool is full) at the pool's write
+# bandwidth, which drops for small files
+def fio_fill(options):
+   directory = os.path.abspath(options["directory"].split(":")[0])
+   name = options.get("name","fio")
+   numjobs = int(options.get("numjobs","1"))
+   filesize = [parse_size(size) for size in options.get("filesize","100Mi").split("-")]
+   nominal_size = sum(filesize)/len(filesize)
+   filename_format = options.get("filename_format","$jobname.$jobnum.$filenum").strip("'")
+
+   with SimState() as state:
+      pool = get_pool_for_path(state,directory)
+      space = pool["capacity"] - reconcile(pool)
+      bandwidth = pool["write_bandwidth"] * min(math.sqrt(nominal_size/1024**2),1)
+      # Deleting these files later leaves free segments of about this size
+      for job in range(numjobs):
+         job_dir = os.path.dirname(os.path.join(directory,get_filename(filename_format,name,job,0)))
+         pool["segments"][os.path.relpath(job_dir,pool["mountpoint"])] = int(nominal_size)
+
+   job_size = parse_size(options["io_size"]) if "io_size" in options else space/numjobs
+   num_files = min(max(math.ceil(job_size/nominal_size),1),files_per_job)
+   file_size = math.ceil(job_size/num_files)
+   written = [0] * numjobs
+   error = 0
+   start = time.time()
+   while not stopping and min(written) < job_size:
+      time.sleep(step_interval)
+      step = bandwidth * time_scale * step_interval/numjobs
+      for job in range(numjobs):
+         amount = min(step,job_size - written[job],space - sum(written))
+         if amount <= 0:
+            continue
+         end = written[job] + amount
+         while written[job] < end:
+            file_number = int(written[job]//file_size)
+            path = os.path.join(directory,get_filename(filename_format,name,job,file_number))
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            size = min(end - file_number * file_size,file_size)
+            with open(path,"ab") as fill_file:
+               fill_file.truncate(int(size))
+            written[job] = min(end,(file_number + 1) * file_size)
+      if sum(written) >= space:
+         # No space left on device
+         error = 28
+         break
+
+   runtime = (time.time() - start) * time_scale
+   total = int(sum(written))
+   report = get_fio_report(name,error,{"write": {"io_bytes": total,"io_kbytes": total//1024,"bw": int(total/1024/max(runtime,0.001)),
+      "iops": round(total/nominal_size/max(runtime,0.001),2),"runtime": int(runtime * 1000),"total_ios": int(total/nominal_size)}})
+   print(json.dumps(report,indent=2))
+
+def get_filename(filename_format,name,job,file_number):
+   return filename_format.replace("$jobname",name).replace("$jobnum",str(job)).replace("$filenum",str(file_number))
+
+# Skeleton of a fio JSON report with one (group reported) job
+def get_fio_report(name,error,stats):
+   now = time.time()
+   job = {"jobname": name,"groupid": 0,"error": error}
+   for rw in ("read","write"):
+      job[rw] = {"io_bytes": 0,"io_kbytes": 0,"bw": 0,"iops": 0,"runtime": 0,"total_ios": 0,"lat_ns": {"mean": 0,"N": 0},
+         "clat_ns": {"mean": 0,"N": 0,"bins": {}}}
+      job[rw].update(stats.get(rw,{}))
+   return {"fio version": "fio-3.36","timestamp": int(now),"timestamp_ms": int(now * 1000),"time": time.ctime(now),"jobs": [job]}
+
+# Report simulated cumulative totals every --status-interval (simulated seconds) until stopped
+# Latencies rise while the pool is resilvering and with disk stress; the read monitor also keeps <sim_dir>/diskstats
+# up to date so the harness's per-disk sampler sees the simulated disks
+def fio_stream(options):
+   name = options.get("name","fio")
+   interval = float(options["status-interval"].rstrip("s"))
+   rw = "read" if "read" in options.get("rw","read") else "write"
+   numjobs = int(options.get("numjobs","1"))
+   block_size = parse_size(options.get("bs","4Ki"))
+   think_time = parse_size(options.get("thinktime","0").replace("ms","")) / 1000 if "thinktime" in options else 0
+   totals = {"ios": 0,"bytes": 0,"runtime": 0,"lat_sum": 0,"bins": collections.Counter()}
+   disk_counters = {}
+
+   level = None
+   if name == "diskstress":
+      level = "high" if numjobs >= 128 else "med"
+
+   last = time.time()
+   try:
+      with StressRegistration("disk",level):
+         while not stopping:
+            time.sleep(interval/time_scale)
+            with SimState(save=False) as state:
+               stress = get_stress(state)
+               pools = [pool for pool in state["pools"].values() if not pool["exported"]]
+               resilvering = any(get_scan_progress(pool) != None and get_scan_progress(pool)[0] < 1 for pool in pools)
+               devices = sum(len(vdev["devices"]) for pool in pools for vdev in pool["vdevs"])
+               if name == "readlatmon":
+                  write_diskstats(state,disk_counters,time.time() - last,stress)
+            last = time.time()
+
+            # Median latency for this interval
+            median = read_latency if rw == "read" else write_latency
+            if resilvering:
+               median *= 2 if rw == "read" else 1.5
+            median *= {"high": 3, "med": 1.5}.get(stress.get("disk") if level == None else level,1)
+            median *= max(block_size/(64 * 1024),1)
+
+            # I/Os completed this interval: queue depth of one per job plus think time, capped by what the disks can do
+            ios = numjobs * interval/(median + think_time)
+            if numjobs > 1:
+               ios = min(ios,max(devices,1) * disk_iops * interval)
+            ios = max(int(ios),1)
+
+            samples = min(ios,latency_samples)
+            latencies = [random.lognormvariate(math.log(median),0.4) for sample in range(samples)]
+            for latency in latencies:
+               ns = int(latency * 1e9)
+               digits = max(len(str(ns)) - 2,0)
+               totals["bins"][ns//10**digits * 10**digits] += ios/samples
+            totals["ios"] += ios
+            totals["bytes"] += ios * block_size
+            totals["runtime"] += interval * 1000
+            totals["lat_sum"] += sum(latencies)/samples * 1e9 * ios
+
+            report = get_fio_report(name,0,{rw: {"io_bytes": int(totals["bytes"]),"io_kbytes": int(totals["bytes"]//1024),
+               "runtime": int(totals["runtime"]),"total_ios": int(totals["ios"]),
+               "lat_ns": {"mean": totals["lat_sum"]/totals["ios"],"N": int(totals["ios"])},
+               "clat_ns": {"mean": totals["lat_sum"]/totals["ios"],"N": int(totals["ios"]),
+                  "bins": {str(value): round(count) for value, count in totals["bins"].items()}}}})
+            print(json.dumps(report,indent=2),flush=True)
+   except BrokenPipeError:
+      pass
+
+# Add elapsed (real) seconds of simulated disk activity to the per-disk counters and rewrite <sim_dir>/diskstats
+# Rates are realistic per real second: resilvering pools read from every surviving device and write to the spare
+def write_diskstats(state,counters,elapsed,stress):
+   activity = {}
+   for pool in state["pools"].values():
+      progress = get_scan_progress(pool)
+      resilvering = progress != None and progress[0] < 1
+      for vdev in pool["vdevs"]:
+         for device in vdev["devices"]:
+            read_bps = 0.6 * disk_bandwidth if resilvering and device not in pool["offline"] else 0
+            write_bps = 0.3 * disk_bandwidth if resilvering and vdev["type"].startswith("draid") else 0
+            util = 70 if resilvering else 1
+            if "disk" in stress:
+               write_bps += {"high": 0.1, "med": 0.3}[stress["disk"]] * disk_bandwidth
+               util += 25
+            activity[get_disk(device)] = (read_bps,write_bps,min(util,100))
+      if resilvering and pool["spares"]:
+         activity[get_disk(pool["spares"][0])] = (0,disk_bandwidth,100)
+
+   lines = []
+   for index, disk in enumerate(state["disks"]):
+      read_bps, write_bps, util = activity.get(disk,(0,0,0))
+      previous = counters.get(disk,[0,0,0,0,0,0])
+      current = [
+         previous[0] + read_bps * elapsed/(128 * 1024),
+         previous[1] + read_bps * elapsed/512,
+         previous[2] + write_bps * elapsed/(128 * 1024),
+         previous[3] + write_bps * elapsed/512,
+         previous[4] + util/100 * elapsed * 1000,
+         previous[5] + util/100 * elapsed * 1000 * 4]
+      counters[disk] = current
+      reads, read_sectors, writes, write_sectors, io_ms, weighted_ms = [int(value) for value in current]
+      lines.append(" ".join(str(value) for value in [8,index * 16,disk,reads,0,read_sectors,0,writes,0,write_sectors,0,0,io_ms,
+         weighted_ms,0,0,0,0,0,0]))
+
+   path = os.path.join(sim_dir,"diskstats")
+   with open(path + ".tmp","w") as diskstats:
+      diskstats.write("\n".join(lines) + "\n")
+   os.replace(path + ".tmp",path)
+
+# Sequential read bandwidth check (--output-format=terse): every disk reads at full speed
+def fio_bandwidth(options,num_disks):
+   runtime = float(options.get("runtime","15").rstrip("s"))
+   end = time.time() + runtime/time_scale
+   while not stopping and time.time() < end:
+      time.sleep(min(end - time.time(),0.1))
+   fields = ["0"] * 130
+   fields[0] = "3"
+   fields[1] = "fio-3.36"
+   fields[2] = options.get("name","fio")
+   fields[6] = str(int(num_disks * disk_bandwidth/1024))
+   print(";".join(fields))
+
+if __name__ == '__main__':
+   main()
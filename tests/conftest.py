@@ -0,0 +1,4 @@
+import os, sys
+
+# resilver.py is a script at the top of the repo rather than an installed package
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,143 @@
+# Tests for the zpool status parsers, run against captured "zpool status -jp --json-int" and "zpool status -p" output
+import os, time
+import pytest
+import resilver
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)),"fixtures","zpool_status")
+
+# Start time of the scans in the fixtures
+start = 1792321200
+start_text = time.mktime(time.strptime("Sun Oct 18 11:00:00 2026","%a %b %d %H:%M:%S %Y"))
+
+def read_fixture(name):
+   with open(os.path.join(fixtures,name)) as fixture:
+      return fixture.read()
+
+def parse_json(name,replaced=False):
+   return resilver.parse_status_json(read_fixture(name),"tank",replaced)
+
+def parse_text(name,replaced=False):
+   return resilver.parse_status_text(read_fixture(name),replaced)
+
+def test_json_resilver_in_progress(monkeypatch):
+   # 1200 seconds into the pass, 200 of them paused
+   monkeypatch.setattr(resilver.time,"time",lambda: start + 1200)
+   status = parse_json("resilver_in_progress.json")
+   assert status.state == "resilvering"
+   assert status.scanned == 1319413953331
+   assert status.issued == 549755813888
+   assert status.total == 4398046511104
+   assert status.resilvered == 54975581388
+   assert status.scan_rate == pytest.approx(1319413953331/1000)
+   assert status.issue_rate == pytest.approx(549755813888/1000)
+   assert status.percent_done == pytest.approx(12.5)
+   assert status.time_left == pytest.approx(7000)
+   assert status.start_time == start
+   assert status.end_time == None
+   assert status.errors == 0
+
+def test_json_resilver_missing_fields(monkeypatch):
+   # Older versions print scan times as dates and leave out the per-pass byte counts, pause time, and error count
+   monkeypatch.setattr(resilver.time,"time",lambda: start_text + 100)
+   status = parse_json("resilver_minimal.json")
+   assert status.state == "resilvering"
+   assert status.start_time == start_text
+   assert status.scanned == 0
+   assert status.scan_rate == 0
+   assert status.issue_rate == 0
+   assert status.percent_done == 0
+   assert status.time_left == None
+   assert status.errors == 0
+
+def test_json_resilver_finished():
+   status = parse_json("resilver_finished.json")
+   assert status.state == "complete"
+   assert status.start_time == start
+   assert status.end_time == start + 4980
+   assert status.resilver_time == 4980
+   assert status.scanned == 4398046511104
+   assert status.issued == 4398046511104
+   assert status.resilvered == 439804651110
+   # Pool errors plus scan errors
+   assert status.errors == 5
+
+def test_json_resilver_finished_online():
+   # A finished resilver on a healthy pool is from an earlier test, unless the disk was replaced
+   assert parse_json("resilver_finished_online.json") == resilver.ResilverProgress("healthy",errors=0)
+   status = parse_json("resilver_finished_online.json",replaced=True)
+   assert status.state == "complete"
+   assert status.resilver_time == 4980
+
+@pytest.mark.parametrize("name",["scrub_paused.json","no_scan.json"])
+def test_json_no_resilver(name):
+   assert parse_json(name) == resilver.ResilverProgress("healthy",errors=0)
+
+def test_text_resilver_in_progress():
+   status = parse_text("resilver_in_progress.txt")
+   assert status.state == "resilvering"
+   assert status.scanned == 1319413953331
+   assert status.scan_rate == 1288490188
+   assert status.issued == 549755813888
+   assert status.issue_rate == 858993459
+   assert status.total == 4398046511104
+   assert status.resilvered == 54975581388
+   assert status.percent_done == 12.5
+   assert status.time_left == 4480
+   assert status.start_time == start_text
+   assert status.errors == 0
+
+def test_text_resilver_in_progress_human_readable():
+   # Older versions print "<scanned> scanned, <issued> issued, <total> total" and sizes may be human-readable
+   status = parse_text("resilver_in_progress_old.txt")
+   assert status.state == "resilvering"
+   assert status.scanned == int(1.2 * 1024**4)
+   assert status.scan_rate == int(1.2 * 1024**3)
+   assert status.issued == 512 * 1024**3
+   assert status.issue_rate == 819 * 1024**2
+   assert status.total == 4 * 1024**4
+   assert status.resilvered == int(51.2 * 1024**3)
+   assert status.time_left == 86400 + 4480
+
+def test_text_rebuild_in_progress():
+   # Sequential rebuilds name the vdev, print the issue rate without "at", and may have no completion estimate
+   status = parse_text("rebuild_in_progress.txt")
+   assert status.state == "resilvering"
+   assert status.scanned == 1319413953331
+   assert status.issued == 1319413953331
+   assert status.issue_rate == None
+   assert status.total == 4398046511104
+   assert status.resilvered == 131941395333
+   assert status.percent_done == 30.0
+   assert status.time_left == None
+   assert status.start_time == start_text
+
+def test_text_rebuild_finished():
+   status = parse_text("rebuild_finished.txt")
+   end_time = time.mktime(time.strptime("Sun Oct 18 11:22:52 2026","%a %b %d %H:%M:%S %Y"))
+   assert status.state == "complete"
+   assert status.resilvered == 364543164416
+   # No issued amount in the status, so the resilvered amount stands in for it
+   assert status.issued == 364543164416
+   assert status.resilver_time == 1372
+   assert status.end_time == end_time
+   assert status.start_time == end_time - 1372
+
+def test_text_resilver_finished():
+   status = parse_text("resilver_finished.txt")
+   assert status.state == "complete"
+   assert status.scanned == 4398046511104
+   assert status.issued == 4398046511104
+   assert status.total == 4398046511104
+   assert status.resilvered == 439804651110
+   assert status.resilver_time == 4980
+   # Pool data errors plus scan errors
+   assert status.errors == 5
+
+def test_text_resilver_finished_online():
+   assert parse_text("resilver_finished_online.txt") == resilver.ResilverProgress("healthy",errors=0)
+   status = parse_text("resilver_finished_online.txt",replaced=True)
+   assert status.state == "complete"
+   assert status.resilver_time == 4980
+
+def test_text_scrub_paused():
+   assert parse_text("scrub_paused.txt") == resilver.ResilverProgress("healthy",errors=0)